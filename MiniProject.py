@@ -1,111 +1,133 @@
+import atexit
 import getpass
 import os
-import sqlite3
 import sys
-import re
+
+import service
+import settings
+from connection_pool import close_all_pools, get_pool
+from feed import FEED_PAGE_SIZE, ensure_timeline
+from migrations import migrate
+from replicas import close_replicas, read_connection, write_connection
+from service import is_valid_email, is_valid_phone
+from tweet_search import ensure_fts_index
 
 
 # ========================
 # Database Setup
 # ========================
-def get_database_connection():
+def get_database_connection(write=False, replica=False):
+    """
+    Return a context manager yielding the pooled connection for the database
+    named on the command line. Foreign keys, WAL and busy_timeout are already set.
+    Pass write=True for a block that writes, so it waits for the write lock first.
+    Pass replica=True for a block that only reads, so it may read a replica (replicas.py).
+    """
     if len(sys.argv) < 2:
         print("Error: No database filename provided.")
         sys.exit(1)
     db_filename = sys.argv[1]
-    return sqlite3.connect(db_filename)
+    if write:
+        return write_connection(db_filename)
+    if replica:
+        return read_connection(db_filename)
+    return get_pool(db_filename).connection()
 
-def Set_Database():
+def Set_Database(db_filename=None):
     """
     Create the necessary tables in the SQLite database if they don't already exist.
+    Uses the database named on the command line unless db_filename is given (shard files).
     """
-    conn = get_database_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    # Enable foreign key constraints
-    cursor.execute('''PRAGMA foreign_keys = ON;''')
-
-    # Create tables only if they don't exist
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            usr INTEGER PRIMARY KEY,
-            name TEXT,
-            email TEXT,
-            phone INTEGER,
-            pwd TEXT
-        );
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS follows (
-            flwer INTEGER,
-            flwee INTEGER,
-            start_date DATE,
-            PRIMARY KEY (flwer, flwee),
-            FOREIGN KEY (flwer) REFERENCES users(usr) ON DELETE CASCADE,
-            FOREIGN KEY (flwee) REFERENCES users(usr) ON DELETE CASCADE
-        );
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS lists (
-            owner_id INTEGER,
-            lname TEXT,
-            PRIMARY KEY (owner_id, lname),
-            FOREIGN KEY (owner_id) REFERENCES users(usr) ON DELETE CASCADE
-        );
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS include (
-            owner_id INTEGER,
-            lname TEXT,
-            tid INTEGER,
-            PRIMARY KEY (owner_id, lname, tid),
-            FOREIGN KEY (owner_id, lname) REFERENCES lists(owner_id, lname) ON DELETE CASCADE,
-            FOREIGN KEY (tid) REFERENCES tweets(tid) ON DELETE CASCADE
-        );
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tweets (
-            tid INTEGER PRIMARY KEY,
-            writer_id INTEGER,
-            text TEXT,
-            tdate DATE,
-            ttime TIME,
-            replyto_tid INTEGER,
-            FOREIGN KEY (writer_id) REFERENCES users(usr) ON DELETE CASCADE,
-            FOREIGN KEY (replyto_tid) REFERENCES tweets(tid) ON DELETE CASCADE
-        );
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS retweets (
-            tid INTEGER,
-            retweeter_id INTEGER,
-            writer_id INTEGER,
-            spam INTEGER,
-            rdate DATE,
-            PRIMARY KEY (tid, retweeter_id),
-            FOREIGN KEY (tid) REFERENCES tweets(tid) ON DELETE CASCADE,
-            FOREIGN KEY (retweeter_id) REFERENCES users(usr) ON DELETE CASCADE,
-            FOREIGN KEY (writer_id) REFERENCES users(usr) ON DELETE CASCADE
-        );
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS hashtag_mentions (
-            tid INTEGER,
-            term TEXT,
-            PRIMARY KEY (tid, term),
-            FOREIGN KEY (tid) REFERENCES tweets(tid) ON DELETE CASCADE
-        );
-    ''')
-
-    conn.commit()
-    conn.close()
+    with get_pool(db_filename).connection() if db_filename else get_database_connection() as conn:
+        cursor = conn.cursor()
+
+        # Create tables only if they don't exist
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                usr INTEGER PRIMARY KEY,
+                name TEXT,
+                email TEXT,
+                phone INTEGER,
+                pwd TEXT
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS follows (
+                flwer INTEGER,
+                flwee INTEGER,
+                start_date DATE,
+                PRIMARY KEY (flwer, flwee),
+                FOREIGN KEY (flwer) REFERENCES users(usr) ON DELETE CASCADE,
+                FOREIGN KEY (flwee) REFERENCES users(usr) ON DELETE CASCADE
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS lists (
+                owner_id INTEGER,
+                lname TEXT,
+                PRIMARY KEY (owner_id, lname),
+                FOREIGN KEY (owner_id) REFERENCES users(usr) ON DELETE CASCADE
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS include (
+                owner_id INTEGER,
+                lname TEXT,
+                tid INTEGER,
+                PRIMARY KEY (owner_id, lname, tid),
+                FOREIGN KEY (owner_id, lname) REFERENCES lists(owner_id, lname) ON DELETE CASCADE,
+                FOREIGN KEY (tid) REFERENCES tweets(tid) ON DELETE CASCADE
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tweets (
+                tid INTEGER PRIMARY KEY,
+                writer_id INTEGER,
+                text TEXT,
+                tdate DATE,
+                ttime TIME,
+                replyto_tid INTEGER,
+                FOREIGN KEY (writer_id) REFERENCES users(usr) ON DELETE CASCADE,
+                FOREIGN KEY (replyto_tid) REFERENCES tweets(tid) ON DELETE CASCADE
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS retweets (
+                tid INTEGER,
+                retweeter_id INTEGER,
+                writer_id INTEGER,
+                spam INTEGER,
+                rdate DATE,
+                PRIMARY KEY (tid, retweeter_id),
+                FOREIGN KEY (tid) REFERENCES tweets(tid) ON DELETE CASCADE,
+                FOREIGN KEY (retweeter_id) REFERENCES users(usr) ON DELETE CASCADE,
+                FOREIGN KEY (writer_id) REFERENCES users(usr) ON DELETE CASCADE
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS hashtag_mentions (
+                tid INTEGER,
+                term TEXT,
+                PRIMARY KEY (tid, term),
+                FOREIGN KEY (tid) REFERENCES tweets(tid) ON DELETE CASCADE
+            );
+        ''')
+
+        # Bring indexes and derived tables up to the current schema version
+        migrate(conn)
+
+        # Full-text index for search_tweets; falls back to LIKE scans if FTS5 is missing
+        if settings.SEARCH_BACKEND != "like":
+            ensure_fts_index(conn)
+
+        # Materialized per-follower timelines, used when TWITTER_FEED_MODE=fanout
+        ensure_timeline(conn)
 
 def masked_input(prompt="Enter your password: "):
     if os.name == 'nt':  # Windows
@@ -178,29 +200,13 @@ def login(user_id, password):
     """
     Authenticate a user based on their user ID and password.
     """
-    conn = get_database_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM users WHERE usr = ? AND pwd = ?", (user_id, password))
-    user = cursor.fetchone()
-    conn.close()
-    return user is not None
+    with get_database_connection() as conn:
+        return service.authenticate(conn, user_id, password)
 '''
 def is_valid_email(email):
     # Check if the email contains '@' and '.'
     return '@' in email and '.' in email
 '''
-def is_valid_email(email):
-    """
-    Validate an email address based on standard email rules.
-    """
-    email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(email_regex, email) is not None
-
-def is_valid_phone(phone):
-    # Check if the phone number contains only numeric characters and meets lenght requirements
-    return phone.isdigit() and 7 <= len(phone) <= 15
 
 def sign_up():
     # Ensure the name is not empty
@@ -235,21 +241,10 @@ def sign_up():
         else:
             print("Error: Password cannot be empty. Please enter a valid password.")
 
-    # Connect to the database
-    conn = get_database_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    # Get the maximum user ID and assign a new one
-    cursor.execute("SELECT MAX(usr) FROM users")
-    max_id = cursor.fetchone()[0]
-    new_id = max_id + 1 if max_id else 1
-
-    # Insert the new user into the database
-    cursor.execute("INSERT INTO users (usr, name, email, phone, pwd) VALUES (?, ?, ?, ?, ?)",
-                   (new_id, name, email, phone, password))
-    conn.commit()
-    conn.close()
+    # Not write=True: create_user hashes the password before its first statement,
+    # and that statement is a write, so it waits for the lock on its own
+    with get_database_connection() as conn:
+        new_id = service.create_user(conn, name, email, phone, password)
 
     print(f"Sign up successful! Your user ID is {new_id}.")
 
@@ -270,7 +265,9 @@ def user_menu(user_id):
         print("3. Compose a tweet")
         print("4. List followers")
         print("5. List favorite lists")
-        print("6. Logout")
+        print("6. Trending hashtags")
+        print("7. Who to follow")
+        print("8. Logout")
         choice = input("Enter your choice: ")
 
         if choice == '1':
@@ -284,6 +281,10 @@ def user_menu(user_id):
         elif choice == '5':
             list_favorite_lists(user_id)
         elif choice == '6':
+            show_trending()
+        elif choice == '7':
+            show_recommendations(user_id)
+        elif choice == '8':
             print("Logging out...")
             break
         else:
@@ -303,76 +304,41 @@ def search_tweets(user_id):
         print("No valid keywords provided.")
         return
 
-    conn = get_database_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    # Fetch one page at a time; only the rows on screen are held in memory
+    cursor = None
+    first_page = True
 
-    query_parts = []
-    params = []
-
-    for kw in keywords:
-        normalized_kw = kw.lower()
-        if kw.startswith("#"):
-            # Exact hashtag match (case-insensitive, preserves #)
-            query_parts.append("EXISTS (SELECT 1 FROM hashtag_mentions hm WHERE t.tid = hm.tid AND LOWER(hm.term) = LOWER(?))")
-            params.append(kw)
-        else:
-            # Substring in tweet text (case-insensitive)
-            query_parts.append("LOWER(t.text) LIKE ?")
-            params.append(f"%{normalized_kw}%")
-            # Substring in hashtags (case-insensitive)
-            query_parts.append("EXISTS (SELECT 1 FROM hashtag_mentions hm WHERE t.tid = hm.tid AND LOWER(hm.term) LIKE ?)")
-            params.append(f"%{normalized_kw}%")
-
-    if not query_parts:
-        print("No valid search conditions.")
-        conn.close()
-        return
-
-    final_query = f"""
-        SELECT DISTINCT t.tid, t.writer_id, t.tdate, t.ttime, t.text
-        FROM tweets t
-        WHERE {' OR '.join(query_parts)}
-        ORDER BY t.tdate DESC, t.ttime DESC
-    """
-
-    cursor.execute(final_query, params)
-    results = cursor.fetchall()
-    conn.close()
-
-    # Handle no matches explicitly
-    if not results:
-        print("\nNo tweets found matching the search criteria.")
-        return
+    while True:
+        with get_database_connection(replica=True) as conn:
+            page = service.search_tweets(conn, keywords, cursor)
 
-    # Pagination and display logic
-    offset = 0
-    page_size = 5
+        # Handle no matches explicitly
+        if not page.items and first_page:
+            print("\nNo tweets found matching the search criteria.")
+            return
+        first_page = False
+        cursor = page.next_cursor
 
-    while offset < len(results):
         print("\n--- Search Results ---")
         print(f"{'tid':<5} | {'writer_id':<10} | {'date':<12} | {'time':<10} | text")
         print("-" * 80)
 
-        batch = results[offset:offset + page_size]
         displayed_tweet_ids = set()
 
-        for tweet in batch:
-            print(f"{tweet['tid']:<5} | {tweet['writer_id']:<10} | {tweet['tdate']:<12} | {tweet['ttime']:<10} | {tweet['text']}")
-            displayed_tweet_ids.add(tweet['tid'])
-
-        offset += page_size
+        for tweet in page.items:
+            print(f"{tweet.tid:<5} | {tweet.writer_id:<10} | {tweet.tdate:<12} | {tweet.ttime:<10} | {tweet.text}")
+            displayed_tweet_ids.add(tweet.tid)
 
         while True:
             print("\nOptions:")
             print("Enter a Tweet ID to view details")
-            if offset < len(results):
+            if cursor is not None:
                 print("m (more): See more results")
             print("q (quit): Return to menu")
 
             choice = input("Your choice: ").strip().lower()
 
-            if choice == 'm' and offset < len(results):
+            if choice == 'm' and cursor is not None:
                 break
             elif choice == 'q':
                 return
@@ -386,23 +352,18 @@ def search_tweets(user_id):
                 print("Invalid input. Please enter a valid Tweet ID, 'm', or 'q'.")
 
 def show_tweet_details(user_id, tid):
-    conn = get_database_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT COUNT(*) FROM tweets WHERE replyto_tid = ?", (tid,))
-    num_replies = cursor.fetchone()[0]
-
-    cursor.execute("SELECT COUNT(*) FROM retweets WHERE tid = ?", (tid,))
-    num_retweets = cursor.fetchone()[0]
+    with get_database_connection(replica=True) as conn:
+        stats = service.get_tweet_details(conn, tid)
 
-    print(f"\nTweet {tid} Statistics: {num_replies} replies, {num_retweets} retweets")
+    print(f"\nTweet {tid} Statistics: {stats.replies} replies, {stats.retweets} retweets")
 
     while True:
         print("\nOptions:")
         print("1. Reply to this tweet")
         print("2. Retweet this tweet")
         print("3. Add to favorite list")
-        print("4. Go back")
+        print("4. View conversation")
+        print("5. Go back")
 
         choice = input("Choose an option: ").strip()
         if choice == '1':
@@ -412,66 +373,60 @@ def show_tweet_details(user_id, tid):
         elif choice == '3':
             add_to_favorites(user_id, tid)
         elif choice == '4':
+            show_conversation(tid)
+        elif choice == '5':
             break
         else:
             print("Invalid choice.")
 
-    conn.close()
+def show_conversation(tid):
+    """
+    Print the tweets a tweet replies to and the replies below it, indented by depth.
+    """
+    try:
+        with get_database_connection(replica=True) as conn:
+            print("\nConversation:")
+            top = None
+            for node in service.get_conversation(conn, tid):
+                # The root comes first; indent everything relative to it
+                if top is None:
+                    top = node.depth
+                marker = ">" if node.tweet.tid == tid else "-"
+                indent = "  " * (node.depth - top)
+                print(f"{indent}{marker} [{node.tweet.tid}] User {node.tweet.writer_id}: {node.tweet.text} "
+                      f"(Date: {node.tweet.tdate}, Time: {node.tweet.ttime}, Replies: {node.replies})")
+    except service.NotFound as e:
+        print(e)
 
 def retweet(user_id, tid):
-    conn = get_database_connection()
-    cursor = conn.cursor()
-
-    # Get the original writer_id of the tweet being retweeted
-    cursor.execute("SELECT writer_id FROM tweets WHERE tid = ?", (tid,))
-    tweet = cursor.fetchone()
-    
-    if not tweet:
-        print("Error: Tweet does not exist.")
-        conn.close()
-        return
-
-    writer_id = tweet[0]  # Original writer of the tweet
-
     try:
-        # Attempt to insert the retweet (prevents duplicates)
-        cursor.execute('''
-            INSERT INTO retweets (tid, retweeter_id, writer_id, spam, rdate)
-            VALUES (?, ?, ?, 0, DATE('now'))
-        ''', (tid, user_id, writer_id))
-
-        conn.commit()
+        with get_database_connection(write=True) as conn:
+            service.retweet(conn, user_id, tid)
         print("Tweet successfully retweeted.")
-
-    except sqlite3.IntegrityError:
-        print("You have already retweeted this tweet.")
-
-    conn.close()
+    except service.NotFound as e:
+        print(f"Error: {e}")
+    except service.ServiceError as e:
+        print(e)
 
 def add_to_favorites(user_id, tid):
-    conn = get_database_connection()
-    cursor = conn.cursor()
-
-    # Fetch all favorite lists owned by the user
-    cursor.execute("SELECT lname FROM lists WHERE owner_id = ?", (user_id,))
-    lists = cursor.fetchall()
+    with get_database_connection(replica=True) as conn:
+        lists = service.get_favorite_lists(conn, user_id)
 
     if not lists:
         # If no lists exist, display message and exit
         print("You have no favorite lists. Cannot add tweet to favorites.")
-        conn.close()
         return
 
     # If lists exist, user must choose an existing one
     print("\nYour Favorite Lists:")
     for idx, lst in enumerate(lists, start=1):
-        print(f"{idx}. {lst[0]}")
+        print(f"{idx}. {lst.name}")
 
     while True:
         try:
             list_choice = int(input("Select a list number to add this tweet to: ").strip())
             if 1 <= list_choice <= len(lists):
-                selected_list = lists[list_choice - 1][0]
+                selected_list = lists[list_choice - 1].name
                 break
             else:
                 print("Invalid choice. Please enter a valid list number.")
@@ -480,16 +435,11 @@ def add_to_favorites(user_id, tid):
 
     # Insert the tweet into the selected favorite list
     try:
-        cursor.execute('''
-            INSERT INTO include (owner_id, lname, tid)
-            VALUES (?, ?, ?)
-        ''', (user_id, selected_list, tid))
-        conn.commit()
+        with get_database_connection(write=True) as conn:
+            service.add_to_list(conn, user_id, selected_list, tid)
         print(f"Tweet added to '{selected_list}'.")
-    except sqlite3.IntegrityError:
-        print(f"Tweet is already in '{selected_list}'.")
-    finally:
-        conn.close()
+    except service.ServiceError as e:
+        print(e)
 
 def search_users(current_user_id):
     
@@ -501,43 +451,30 @@ def search_users(current_user_id):
         print("Keyword cannot be empty.")
         return
 
-    conn = get_database_connection()
-    cursor = conn.cursor()
+    with get_database_connection(replica=True) as conn:
+        page = service.search_users(conn, keyword)
 
-    # Case-insensitive search for users with names containing the keyword
-    cursor.execute('''
-        SELECT usr, name 
-        FROM users 
-        WHERE name LIKE ? COLLATE NOCASE 
-        ORDER BY LENGTH(name) ASC, name ASC
-    ''', ('%' + keyword + '%',))
-    
-    all_users = cursor.fetchall()
-    conn.close()
-
-    if not all_users:
+    if not page.items:
         print("No users found.")
         return
 
-    offset = 0
-    limit = 5
     while True:
-        current_page = all_users[offset:offset + limit]
         print("\nSearch Results:")
-        for user in current_page:
-            print(f"User ID: {user[0]}, Name: {user[1]}")
+        for user in page.items:
+            print(f"User ID: {user.usr}, Name: {user.name}")
 
-        user_ids = [str(user[0]) for user in current_page]
+        user_ids = [str(user.usr) for user in page.items]
         print("\nOptions:")
         print("Enter a User ID to view details")
-        if len(all_users) > offset + limit:
+        if page.next_cursor is not None:
             print("m (more): See more results")
         print("q (quit): Return to the menu")
 
         choice = input("Your choice: ").strip().lower()
 
-        if choice == 'm' and len(all_users) > offset + limit:
-            offset += limit
+        if choice == 'm' and page.next_cursor is not None:
+            with get_database_connection(replica=True) as conn:
+                page = service.search_users(conn, keyword, page.next_cursor)
         elif choice == 'q':
             return
         elif choice in user_ids:
@@ -546,104 +483,81 @@ def search_users(current_user_id):
         else:
             print("Invalid input. Please enter a valid User ID, 'm', or 'q'.")
 
+def print_tweet_lines(tweets, empty_message):
+    """
+    Print tweets as "- text (Date: ..., Time: ...)" lines.
+    """
+    if not tweets:
+        print(empty_message)
+    for tweet in tweets:
+        print(f"- {tweet.text} (Date: {tweet.tdate}, Time: {tweet.ttime})")
+
+def follow_user(current_user_id, selected_user_id, success_message):
+    """
+    Follow a user from a details screen. Returns True once the user is followed.
+    """
+    try:
+        with get_database_connection(write=True) as conn:
+            service.follow(conn, current_user_id, selected_user_id)
+        print(success_message)
+        return True
+    except service.AlreadyExists as e:
+        print(e)
+        return True
+    except service.ServiceError as e:
+        print(f"Error: {e}")
+        return False
+
 def display_user_details(selected_user_id, current_user_id):
     """
     Display detailed information about a user, including tweets and follow options.
     """
-    conn = get_database_connection()
-    cursor = conn.cursor()
+    display_profile(selected_user_id, current_user_id, "User Details - {name} (ID: {usr})",
+                    "Return to search results", "You are now following this user.")
 
-    try:
-        cursor.execute("SELECT name FROM users WHERE usr = ?", (selected_user_id,))
-        user_row = cursor.fetchone()
-        if not user_row:
-            print("User not found.")
-            return
-        user_name = user_row[0]
 
-        # Get user statistics
-        cursor.execute("SELECT COUNT(*) FROM tweets WHERE writer_id = ?", (selected_user_id,))
-        num_tweets = cursor.fetchone()[0]
+def display_profile(profile_id, current_user_id, heading, back_label, followed_message):
+    """
+    Show a user's profile and offer to follow them or view all their tweets.
+    heading and followed_message may use {name} and {usr}.
+    """
+    try:
+        with get_database_connection(replica=True) as conn:
+            profile = service.get_user_profile(conn, profile_id, viewer_id=current_user_id)
+    except service.NotFound as e:
+        print(e)
+        return
 
-        cursor.execute("SELECT COUNT(*) FROM follows WHERE flwer = ?", (selected_user_id,))
-        num_following = cursor.fetchone()[0]
+    print("\n" + heading.format(name=profile.name, usr=profile_id))
+    print(f"Number of Tweets: {profile.tweets}")
+    print(f"Following: {profile.following}")
+    print(f"Followers: {profile.followers}")
+    print("\nRecent Tweets:")
+    print_tweet_lines(profile.recent_tweets, "No recent tweets.")
 
-        cursor.execute("SELECT COUNT(*) FROM follows WHERE flwee = ?", (selected_user_id,))
-        num_followers = cursor.fetchone()[0]
+    is_following = profile.is_following
+    can_follow = profile_id != current_user_id
 
-        # Get recent tweets
-        cursor.execute('''
-            SELECT text, tdate, ttime 
-            FROM tweets 
-            WHERE writer_id = ? 
-            ORDER BY tdate DESC, ttime DESC 
-            LIMIT 3
-        ''', (selected_user_id,))
-        recent_tweets = cursor.fetchall()
-
-        print(f"\nUser Details - {user_name} (ID: {selected_user_id})")
-        print(f"Number of Tweets: {num_tweets}")
-        print(f"Following: {num_following}")
-        print(f"Followers: {num_followers}")
-        print("\nRecent Tweets:")
-        if recent_tweets:
-            for tweet in recent_tweets:
-                print(f"- {tweet[0]} (Date: {tweet[1]}, Time: {tweet[2]})")
+    while True:
+        print("\nOptions:")
+        if not is_following and can_follow:
+            print("1. Follow this user")
         else:
-            print("No recent tweets.")
-
-        # Check if current user is already following the selected user
-        cursor.execute("SELECT 1 FROM follows WHERE flwer = ? AND flwee = ?", 
-                      (current_user_id, selected_user_id))
-        is_following = cursor.fetchone() is not None
+            print("You are already following this user.")
+        print("2. View all tweets")
+        print(f"3. {back_label}")
+        option = input("Enter your choice: ").strip()
 
-        while True:
-            print("\nOptions:")
-            if ((not is_following) and (selected_user_id != current_user_id)):
-                print("1. Follow this user")
-            else:
-                print("You are already following this user.")
-            print("2. View all tweets")
-            print("3. Return to search results")
-            option = input("Enter your choice: ").strip()
+        if option == '1' and not is_following and can_follow:
+            message = followed_message.format(name=profile.name, usr=profile_id)
+            is_following = follow_user(current_user_id, profile_id, message)
+        elif option == '2':
+            view_all_tweets(profile_id)
+        elif option == '3':
+            break
+        else:
+            print("Invalid option. Please try again.")
 
-            if option == '1' and not is_following and selected_user_id != current_user_id:
-                try:
-                    cursor.execute('''
-                        INSERT INTO follows (flwer, flwee, start_date)
-                        VALUES (?, ?, DATE('now'))
-                    ''', (current_user_id, selected_user_id))
-                    conn.commit()
-                    print("You are now following this user.")
-                    is_following = True
-                except sqlite3.IntegrityError:
-                    print("You are already following this user.")
-                    is_following = True
-                except Exception as e:
-                    print(f"An error occurred: {e}")
-            elif option == '2':
-                cursor.execute('''
-                    SELECT text, tdate, ttime 
-                    FROM tweets 
-                    WHERE writer_id = ? 
-                    ORDER BY tdate DESC, ttime DESC
-                ''', (selected_user_id,))
-                all_tweets = cursor.fetchall()
-                print("\nAll Tweets:")
-                if all_tweets:
-                    for tweet in all_tweets:
-                        print(f"- {tweet[0]} (Date: {tweet[1]}, Time: {tweet[2]})")
-                else:
-                    print("No tweets available.")
-            elif option == '3':
-                break
-            else:
-                print("Invalid option. Please try again.")
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
-    finally:
-        conn.close()
-        
 
 def compose_tweet(user_id, replyto_tid):
     """
@@ -653,55 +567,19 @@ def compose_tweet(user_id, replyto_tid):
     - Reply tweets (replyto_tid is passed when replying to another tweet).
     - Ensures no duplicate hashtags in the tweet.
     """
-    conn = get_database_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
     text = input("Enter your tweet: ").strip()
     if not text:
         print("Tweet cannot be empty.")
-        conn.close()
         return
 
-    # Extract hashtags from the text
-    hashtags = re.findall(r"#\w+", text)
-
-    # Convert to lowercase for case-insensitive duplicate check
-    lower_hashtags = [h.lower() for h in hashtags]
-
-    # Check for duplicate hashtags (case insensitive)
-    if len(lower_hashtags) != len(set(lower_hashtags)):
-        print("Tweet rejected: Duplicate hashtags are not allowed.")
-        conn.close()
+    try:
+        with get_database_connection(write=True) as conn:
+            service.post_tweet(conn, user_id, text, replyto_tid)
+    except service.InvalidInput as e:
+        print(f"Tweet rejected: {e}")
         return
 
-    # Get new Tweet ID
-    cursor.execute("SELECT MAX(tid) FROM tweets")
-    max_tid = cursor.fetchone()[0]
-    new_tid = (max_tid or 0) + 1
-
-    # Insert into `tweets` table - handles both normal and reply tweets
-    if replyto_tid is None:
-        cursor.execute('''
-            INSERT INTO tweets (tid, writer_id, text, tdate, ttime)
-            VALUES (?, ?, ?, DATE('now'), TIME('now'))
-        ''', (new_tid, user_id, text))
-    else:
-        cursor.execute('''
-            INSERT INTO tweets (tid, writer_id, text, tdate, ttime, replyto_tid)
-            VALUES (?, ?, ?, DATE('now'), TIME('now'), ?)
-        ''', (new_tid, user_id, text, replyto_tid))
-
-    # Insert hashtags into `hashtag_mentions` table
-    for hashtag in hashtags:
-        cursor.execute('''
-            INSERT INTO hashtag_mentions (tid, term)
-            VALUES (?, ?)
-        ''', (new_tid, hashtag))
-
-    conn.commit()
-    conn.close()
-
+    hashtags = service.HASHTAG_PATTERN.findall(text)
     print("Tweet posted successfully!")
     if hashtags:
         print(f"Hashtags saved: {', '.join(hashtags)}")
@@ -712,52 +590,40 @@ def list_followers(user_id):
     Paginate if there are more than 5 followers.
     """
 
-    conn = get_database_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    with get_database_connection(replica=True) as conn:
+        page = service.list_followers(conn, user_id)
 
-    # Fetch all followers of the logged-in user
-    cursor.execute('''
-        SELECT u.usr, u.name 
-        FROM follows f
-        JOIN users u ON f.flwer = u.usr
-        WHERE f.flwee = ?
-        ORDER BY u.name ASC
-    ''', (user_id,))
-
-    followers = cursor.fetchall()
-    conn.close()
-
-    if not followers:
+    if not page.items:
         print("You have no followers.")
         return
 
-    offset = 0
-    limit = 5
-
     while True:
         print("\nFollowers List")
         print(f"{'User ID':<10} | {'Name':<20}")
         print("-" * 32)
 
-        for follower in followers[offset:offset + limit]:
-            print(f"{follower['usr']:<10} | {follower['name']:<20}")
+        for follower in page.items:
+            print(f"{follower.usr:<10} | {follower.name:<20}")
 
         print("\nOptions:")
         print("Enter a User ID to view more details about a follower")
-        if len(followers) > offset + limit:
+        if page.next_cursor is not None:
             print("m (more): See more results")
         print("q (quit): Return to the menu")
 
         choice = input("Your choice: ").strip().lower()
 
-        if choice == 'm' and len(followers) > offset + limit:
-            offset += limit
+        if choice == 'm' and page.next_cursor is not None:
+            with get_database_connection(replica=True) as conn:
+                page = service.list_followers(conn, user_id, page.next_cursor)
         elif choice == 'q':
             break
         elif choice.isdigit():
             selected_user_id = int(choice)
-            if any(f['usr'] == selected_user_id for f in followers):
+            # Any follower may be opened, not only those on the current page
+            with get_database_connection(replica=True) as conn:
+                is_follower = service.is_following_user(conn, selected_user_id, user_id)
+            if is_follower:
                 display_follower_details(user_id, selected_user_id)
             else:
                 print("Invalid User ID. Please enter a valid User ID from the list.")
@@ -769,119 +635,22 @@ def display_follower_details(current_user_id, follower_id):
     Display detailed information about a follower.
     Allow following the user if not already followed, or viewing all tweets.
     """
-
-    conn = get_database_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    # Fetch follower's basic information
-    cursor.execute("SELECT name FROM users WHERE usr = ?", (follower_id,))
-    follower = cursor.fetchone()
-
-    if not follower:
-        print("User not found.")
-        conn.close()
-        return
-
-    name = follower['name']
-
-    # Fetch stats: number of tweets, following count, follower count
-    cursor.execute("SELECT COUNT(*) FROM tweets WHERE writer_id = ?", (follower_id,))
-    tweet_count = cursor.fetchone()[0]
-
-    cursor.execute("SELECT COUNT(*) FROM follows WHERE flwer = ?", (follower_id,))
-    following_count = cursor.fetchone()[0]
-
-    cursor.execute("SELECT COUNT(*) FROM follows WHERE flwee = ?", (follower_id,))
-    follower_count = cursor.fetchone()[0]
-
-    # Fetch up to 3 most recent tweets
-    cursor.execute('''
-        SELECT text, tdate, ttime
-        FROM tweets
-        WHERE writer_id = ?
-        ORDER BY tdate DESC, ttime DESC
-        LIMIT 3
-    ''', (follower_id,))
-    recent_tweets = cursor.fetchall()
-
-    print(f"\nFollower Details - {name} (User ID: {follower_id})")
-    print(f"Number of Tweets: {tweet_count}")
-    print(f"Following: {following_count}")
-    print(f"Followers: {follower_count}")
-
-    print("\nRecent Tweets:")
-    if recent_tweets:
-        for tweet in recent_tweets:
-            print(f"- {tweet['text']} (Date: {tweet['tdate']}, Time: {tweet['ttime']})")
-    else:
-        print("No recent tweets.")
-
-    # Check if the logged-in user is already following this follower
-    cursor.execute("SELECT 1 FROM follows WHERE flwer = ? AND flwee = ?", (current_user_id, follower_id))
-    already_following = cursor.fetchone() is not None
-
-    while True:
-        print("\nOptions:")
-        if not already_following and current_user_id != follower_id:
-            print("1. Follow this user")
-        else:
-            print("You are already following this user.")
-        print("2. View all tweets")
-        print("3. Return to followers list")
-
-        option = input("Enter your choice: ").strip()
-
-        if option == '1' and not already_following and current_user_id != follower_id:
-            try:
-                cursor.execute('''
-                    INSERT INTO follows (flwer, flwee, start_date)
-                    VALUES (?, ?, DATE('now'))
-                ''', (current_user_id, follower_id))
-                conn.commit()
-                print(f"You are now following {name}.")
-                already_following = True
-            except sqlite3.IntegrityError:
-                print("You are already following this user.")
-            except Exception as e:
-                print(f"Error: {e}")
-
-        elif option == '2':
-            view_all_tweets(follower_id)
-        elif option == '3':
-            break
-        else:
-            print("Invalid choice. Please try again.")
-
-    conn.close()
+    display_profile(follower_id, current_user_id, "Follower Details - {name} (User ID: {usr})",
+                    "Return to followers list", "You are now following {name}.")
 
 
 def view_all_tweets(user_id):
     """
     Display all tweets written by a specific user.
     """
-
-    conn = get_database_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT text, tdate, ttime
-        FROM tweets
-        WHERE writer_id = ?
-        ORDER BY tdate DESC, ttime DESC
-    ''', (user_id,))
-
-    tweets = cursor.fetchall()
+    with get_database_connection(replica=True) as conn:
+        tweets = service.get_user_tweets(conn, user_id)
 
     if not tweets:
         print("This user has no tweets.")
     else:
         print("\nAll Tweets:")
-        for tweet in tweets:
-            print(f"- {tweet['text']} (Date: {tweet['tdate']}, Time: {tweet['ttime']})")
-
-    conn.close()
+        print_tweet_lines(tweets, "")
 
 
 
@@ -889,90 +658,90 @@ def list_favorite_lists(user_id):
     """
     List all favorite lists of the logged-in user, along with the TIDs stored in each list.
     """
-    conn = get_database_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    # Query to get all lists belonging to the user
-    cursor.execute('''
-        SELECT lname 
-        FROM lists 
-        WHERE owner_id = ?
-    ''', (user_id,))
-
-    lists = cursor.fetchall()
+    with get_database_connection(replica=True) as conn:
+        lists = service.get_favorite_lists(conn, user_id)
 
     if not lists:
         print("You have no favorite lists.")
-        conn.close()
         return
 
-    # For each list, get the TIDs stored in it
-    for list_row in lists:
-        list_name = list_row["lname"]
+    for favorite_list in lists:
+        tids_str = ', '.join(str(tid) for tid in favorite_list.tids) if favorite_list.tids else "No tweets in this list"
+        print(f"{favorite_list.name}: {tids_str}")
 
-        cursor.execute('''
-            SELECT tid 
-            FROM include 
-            WHERE owner_id = ? AND lname = ?
-        ''', (user_id, list_name))
+def show_trending():
+    """
+    Show the most mentioned hashtags of the last hour, day or week.
+    """
+    window = input("Window (1h, 24h, 7d) [24h]: ").strip().lower() or "24h"
+    try:
+        # On the primary: reading the windows may advance them (a write)
+        with get_database_connection() as conn:
+            tags = service.get_trending(conn, window)
+    except service.InvalidInput as e:
+        print(e)
+        return
+
+    if not tags:
+        print(f"No hashtags in the last {window}.")
+        return
+    print(f"\nTrending ({window}):")
+    for rank, tag in enumerate(tags, start=1):
+        print(f"{rank}. {tag.term} ({tag.mentions} mentions)")
 
-        tids = cursor.fetchall()
+def show_recommendations(user_id, limit=10):
+    """
+    Suggest users followed by the people the user follows, and follow one by ID.
+    """
+    with get_database_connection(replica=True) as conn:
+        suggestions = service.get_recommendations(conn, user_id, limit)
 
-        tids_str = ', '.join(str(row["tid"]) for row in tids) if tids else "No tweets in this list"
-        print(f"{list_name}: {tids_str}")
+    if not suggestions:
+        print("No one to suggest yet.")
+        return
+    print("\nWho to follow:")
+    for suggestion in suggestions:
+        print(f"- {suggestion.name} (ID: {suggestion.usr}), followed by {suggestion.mutual} of the users you follow")
 
-    conn.close()
+    choice = input("Enter a user ID to follow (or press Enter to go back): ").strip()
+    if not choice:
+        return
+    if not choice.isdigit() or int(choice) not in {suggestion.usr for suggestion in suggestions}:
+        print("Invalid user ID.")
+        return
+    follow_user(user_id, int(choice), "You are now following this user.")
 
-def view_followed_tweets(user_id, offset=0, limit=5):
+def view_followed_tweets(user_id, limit=FEED_PAGE_SIZE):
     """
     Display tweets and retweets from users followed by the logged-in user in a tabular format.
+    Pages are fetched by keyset cursor, so "Show more" costs the same on every page.
     """
-    conn = get_database_connection()
-    cursor = conn.cursor()
-
-    # Fetch total count for followed tweets and retweets
-    cursor.execute('''
-        SELECT COUNT(*) FROM (
-            SELECT tid FROM tweets WHERE writer_id IN (SELECT flwee FROM follows WHERE flwer = ?)
-            UNION ALL
-            SELECT tid FROM retweets WHERE retweeter_id IN (SELECT flwee FROM follows WHERE flwer = ?) AND spam = 0
-        )
-    ''', (user_id, user_id))
-    total_count = cursor.fetchone()[0]
-
-    # Fetch actual tweets/retweets for the current page
-    cursor.execute('''
-        SELECT 'tweet' AS type, tid, tdate, ttime, 0 as spam
-        FROM tweets
-        WHERE writer_id IN (SELECT flwee FROM follows WHERE flwer = ?)
-        UNION ALL
-        SELECT 'retweet' AS type, tid, rdate AS tdate, NULL AS ttime, spam
-        FROM retweets
-        WHERE retweeter_id IN (SELECT flwee FROM follows WHERE flwer = ?) AND spam = 0
-        ORDER BY tdate DESC, ttime DESC
-        LIMIT ? OFFSET ?
-    ''', (user_id, user_id, limit, offset))
-
-    tweets = cursor.fetchall()
-    conn.close()
+    cursor = None
+    first_page = True
 
-    if not tweets:
-        print("No tweets or retweets to display.")
-        return
+    while True:
+        with get_database_connection(replica=True) as conn:
+            page = service.get_feed(conn, user_id, cursor, limit)
+        cursor = page.next_cursor
+
+        if not page.items and first_page:
+            print("No tweets or retweets to display.")
+            return
+        first_page = False
 
-    # Print header
-    print(f"{'Type':<10} | {'Tweet ID':<10} | {'Date':<12} | {'Time':<8} | {'Spam'}")
-    print("-" * 50)
+        # Print header
+        print(f"{'Type':<10} | {'Tweet ID':<10} | {'Date':<12} | {'Time':<8} | {'Spam'}")
+        print("-" * 50)
 
-    # Print tweets
-    for tweet in tweets:
-        print(f"{tweet[0]:<10} | {tweet[1]:<10} | {tweet[2]:<12} | {tweet[3] or 'N/A':<8} | {tweet[4]}")
+        # Print tweets
+        for item in page.items:
+            print(f"{item.type:<10} | {item.tid:<10} | {item.tdate:<12} | {item.ttime or 'N/A':<8} | {item.spam}")
 
-    if offset + len(tweets) < total_count:
+        if cursor is None:
+            return
         more = input("Show more tweets? (y/n): ").strip().lower()
-        if more == 'y':
-            view_followed_tweets(user_id, offset + limit, limit)
+        if more != 'y':
+            return
 
             
 # ========================
@@ -980,6 +749,10 @@ def view_followed_tweets(user_id, offset=0, limit=5):
 # ========================
 
 if __name__ == "__main__":
+    # Close pooled connections however the program exits
+    atexit.register(close_all_pools)
+    atexit.register(close_replicas)
+
     # Create tables if they don't exist
     Set_Database()
     
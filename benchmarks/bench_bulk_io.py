@@ -0,0 +1,116 @@
+"""
+Measure bulk_io.py import and export against one-row-at-a-time inserts.
+
+Usage: python benchmarks/bench_bulk_io.py [--scale NAME] [--data-dir DIR] [--format csv|ndjson] [--skip-rows]
+
+Exports a datagen.py database with bulk_io, then loads the files into two
+empty databases set up by Set_Database:
+- bulk: bulk_io.import_tables (deferred indexes, triggers and foreign keys)
+- rows: every row its own INSERT and commit through the connection pool,
+  with indexes, triggers and foreign keys live, the way sign_up and
+  compose_tweet write (--skip-rows leaves it out at large scales)
+
+Reports rows/s for the export and each load, and checks that both loads
+end with the same counters.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bulk_io  # noqa: E402
+import datagen  # noqa: E402
+from connection_pool import close_all_pools, get_pool  # noqa: E402
+
+
+def empty_database(db_filename):
+    import MiniProject
+    argv = sys.argv
+    sys.argv = [argv[0], db_filename]
+    try:
+        MiniProject.Set_Database()
+    finally:
+        sys.argv = argv
+    close_all_pools()
+
+
+def load_rows(db_filename, sources):
+    pool = get_pool(db_filename)
+    count = 0
+    for table, path, fmt in sources:
+        with bulk_io._open_source(path) as f:
+            columns = bulk_io.table_columns(pool.get(), table)
+            sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            reader = bulk_io._read_csv if fmt == "csv" else bulk_io._read_ndjson
+            for row in reader(f, path, columns):
+                with pool.connection(immediate=True) as conn:
+                    conn.execute(sql, row)
+                count += 1
+    close_all_pools()
+    return count
+
+
+def counters(db_filename):
+    with get_pool(db_filename).connection() as conn:
+        result = (conn.execute("SELECT * FROM tweet_stats ORDER BY tid").fetchall(),
+                  conn.execute("SELECT * FROM user_stats ORDER BY usr").fetchall())
+        result = [[tuple(row) for row in rows] for rows in result]
+    close_all_pools()
+    return result
+
+
+def report(label, rows, elapsed):
+    print(f"{label:<8} | {rows:>10,} | {elapsed:>8.2f} | {rows / elapsed:>10,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="tiny")
+    parser.add_argument("--data-dir", help="keep and reuse the generated database here")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--skip-rows", action="store_true", help="skip the row-at-a-time load")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        source_db = os.path.join(data_dir, f"bench-{args.scale}-seed0.db")
+        if not os.path.exists(source_db):
+            print(f"Generating the {args.scale} database...")
+            users, tweets = datagen.SCALES[args.scale]
+            datagen.generate(source_db, users, tweets, 0, log=lambda message: None)
+
+        def quiet(message):
+            pass
+
+        print(f"{'load':<8} | {'rows':>10} | {'seconds':>8} | {'rows/s':>10}")
+        print("-" * 45)
+        export_dir = os.path.join(tmp, "export")
+        os.makedirs(export_dir)
+        start = time.perf_counter()
+        exported = sum(bulk_io.export_tables(source_db, export_dir, fmt=args.format, log=quiet).values())
+        report("export", exported, time.perf_counter() - start)
+        sources = bulk_io.find_sources([export_dir])
+
+        bulk_db = os.path.join(tmp, "bulk.db")
+        empty_database(bulk_db)
+        start = time.perf_counter()
+        counts, _violations = bulk_io.import_tables(bulk_db, sources, log=quiet)
+        report("bulk", sum(read for read, _inserted in counts.values()), time.perf_counter() - start)
+
+        if not args.skip_rows:
+            rows_db = os.path.join(tmp, "rows.db")
+            empty_database(rows_db)
+            start = time.perf_counter()
+            loaded = load_rows(rows_db, sources)
+            report("rows", loaded, time.perf_counter() - start)
+            same = counters(bulk_db) == counters(rows_db)
+            print(f"Counters after both loads {'match' if same else 'DIFFER'}.")
+
+
+if __name__ == "__main__":
+    main()
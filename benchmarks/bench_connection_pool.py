@@ -0,0 +1,101 @@
+"""
+Compare ops/sec of the old open-per-call connection pattern against the pool.
+
+Usage: python benchmarks/bench_connection_pool.py [database] [--ops N] [--threads T]
+
+The database is copied to a temporary directory first, so the file passed in
+(the sample database by default) is never modified.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connection_pool import ConnectionPool  # noqa: E402
+
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prj-sample_W2025.db")
+
+# One "op" is the statement mix of opening a tweet: login check plus the two stat counts
+OP_STATEMENTS = [
+    ("SELECT * FROM users WHERE usr = ? AND pwd = ?", (1, "pass1")),
+    ("SELECT COUNT(*) FROM tweets WHERE replyto_tid = ?", (101,)),
+    ("SELECT COUNT(*) FROM retweets WHERE tid = ?", (101,)),
+]
+
+
+def op_unpooled(db_filename):
+    """
+    The pre-pool pattern: connect, set PRAGMAs, query, close.
+    """
+    conn = sqlite3.connect(db_filename)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    for sql, params in OP_STATEMENTS:
+        conn.execute(sql, params).fetchall()
+    conn.close()
+
+
+def make_op_pooled(pool):
+    def op_pooled(db_filename):
+        with pool.connection() as conn:
+            for sql, params in OP_STATEMENTS:
+                conn.execute(sql, params).fetchall()
+    return op_pooled
+
+
+def run(op, db_filename, ops, threads):
+    """
+    Run `ops` operations split across `threads` threads and return ops/sec.
+    """
+    per_thread = ops // threads
+
+    def worker():
+        for _ in range(per_thread):
+            op(db_filename)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("database", nargs="?", default=DEFAULT_DB)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_filename = os.path.join(tmp, "bench.db")
+        shutil.copyfile(args.database, db_filename)
+
+        pool = ConnectionPool(db_filename)
+        # Warm the pool so WAL conversion is not part of the measurement
+        with pool.connection():
+            pass
+
+        before = run(op_unpooled, db_filename, args.ops, args.threads)
+        after = run(make_op_pooled(pool), db_filename, args.ops, args.threads)
+        pool.close_all()
+
+    print(f"{'mode':<10} | {'ops/sec':>12}")
+    print("-" * 25)
+    print(f"{'unpooled':<10} | {before:>12,.0f}")
+    print(f"{'pooled':<10} | {after:>12,.0f}")
+    print(f"speedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Measure password verification throughput: logins per second, per core.
+
+Usage: python benchmarks/bench_login.py [--logins N] [--clients C] [--workers 1,2,4]
+
+For each password scheme at the configured cost (TWITTER_PASSWORD_*), 50
+users get a hash, then C client threads log them in N times in total
+through the passwords hashing pool, once per pool size in --workers.
+Each run is reported twice:
+- cold: login cache disabled, so every login derives a key
+- cached: clients log in as a few users repeatedly, so the login cache
+  answers with one HMAC
+
+logins/s/core divides by the number of hashing threads that had a core to
+run on, min(workers, cores).
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import passwords  # noqa: E402
+import settings  # noqa: E402
+from cache import login_cache  # noqa: E402
+
+SCHEMES = ["scrypt", "pbkdf2_sha256"]
+USERS = 50
+
+
+def run(hashes, logins, clients, seed):
+    """
+    Log in `logins` times from `clients` threads; returns elapsed seconds.
+    """
+    per_client = logins // clients
+    barrier = threading.Barrier(clients + 1)
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        barrier.wait()
+        for _ in range(per_client):
+            usr = rng.randrange(len(hashes))
+            matches, _rehash = passwords.run(passwords.verify_password, f"pass{usr}", hashes[usr])
+            assert matches
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--workers", default=None, help="comma-separated pool sizes (default: 1 and the core count)")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    pool_sizes = [int(w) for w in args.workers.split(",")] if args.workers else sorted({1, cores})
+    # The clients wait on the pool; let them all queue
+    settings.PASSWORD_MAX_PENDING = max(settings.PASSWORD_MAX_PENDING, args.clients)
+
+    print(f"{cores} core(s), {args.clients} clients, {args.logins} logins per run")
+    print(f"{'scheme':<14} | {'cost':<18} | {'workers':>7} | {'cache':<6} | {'logins/s':>9} | {'logins/s/core':>13} | {'ms/login':>8}")
+    print("-" * 92)
+    for scheme in SCHEMES:
+        settings.PASSWORD_SCHEME = scheme
+        if scheme == "scrypt":
+            cost = f"n={settings.PASSWORD_SCRYPT_N} r={settings.PASSWORD_SCRYPT_R} p={settings.PASSWORD_SCRYPT_P}"
+        else:
+            cost = f"{settings.PASSWORD_PBKDF2_ITERATIONS} iterations"
+        hashes = [passwords.hash_password(f"pass{usr}") for usr in range(USERS)]
+
+        for workers in pool_sizes:
+            settings.PASSWORD_WORKERS = workers
+            passwords.shutdown()
+            for label, users in (("cold", hashes), ("cached", hashes[:10])):
+                login_cache.clear()
+                login_cache.max_entries = 0 if label == "cold" else settings.LOGIN_CACHE_ENTRIES
+                elapsed = run(users, args.logins, args.clients, seed=workers)
+                done = args.logins // args.clients * args.clients
+                rate = done / elapsed
+                print(f"{scheme:<14} | {cost:<18} | {workers:>7} | {label:<6} | {rate:>9.0f} | "
+                      f"{rate / min(workers, cores):>13.1f} | {elapsed * 1000 / done:>8.2f}")
+    passwords.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Measure who-to-follow precompute and reads: SQL per user against the CSR graph.
+
+Usage: python benchmarks/bench_recommend.py [--scale NAME] [--workers N] [--reads N] [--data-dir DIR]
+
+On a copy of a datagen.py database:
+- batch: score every user with the live SQL query (one 2-hop join per user),
+  with FollowGraph in this process, and with recommend.precompute on 1 and
+  --workers processes (which also writes the table); checks they agree
+- read: one user's recommendations from follow_recommendations against the
+  live SQL query a stale user gets
+
+The process pool only pays off with more than one core; os.cpu_count() is
+printed with the results.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+import recommend  # noqa: E402
+from connection_pool import close_all_pools, get_pool  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def report(label, users, elapsed):
+    print(f"{label:<14} | {elapsed:>8.2f} | {users / elapsed:>9,.0f}")
+
+
+def time_reads(conn, user_ids, query, params_of):
+    timings = []
+    for usr in user_ids:
+        start = time.perf_counter()
+        conn.execute(query, params_of(usr)).fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="small")
+    parser.add_argument("--workers", type=int, default=max(2, os.cpu_count() or 1))
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--data-dir", help="keep and reuse the generated database here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        source_db = os.path.join(data_dir, f"bench-{args.scale}-seed0.db")
+        if not os.path.exists(source_db):
+            print(f"Generating the {args.scale} database...")
+            users, tweets = datagen.SCALES[args.scale]
+            datagen.generate(source_db, users, tweets, 0, log=lambda message: None)
+
+        db_filename = os.path.join(tmp, "recommend.db")
+        shutil.copyfile(source_db, db_filename)
+        pool = get_pool(db_filename)
+        with pool.connection() as conn:
+            # A kept --data-dir database may predate the recommendation tables
+            migrate(conn)
+        conn = pool.get()
+        user_ids = [row[0] for row in conn.execute("SELECT usr FROM users ORDER BY usr")]
+        follows = conn.execute("SELECT COUNT(*) FROM follows").fetchone()[0]
+        print(f"{len(user_ids):,} users, {follows:,} follows, {os.cpu_count()} CPU(s)\n")
+
+        print(f"{'batch':<14} | {'seconds':>8} | {'users/s':>9}")
+        print("-" * 37)
+        start = time.perf_counter()
+        expected = {usr: [tuple(row) for row in conn.execute(
+            recommend._CANDIDATES_QUERY, {"usr": usr, "limit": recommend.RECOMMEND_LIMIT})]
+            for usr in user_ids}
+        report("SQL per user", len(user_ids), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        graph = recommend.FollowGraph.load(conn)
+        scored = {usr: graph.candidates(usr, recommend.RECOMMEND_LIMIT) for usr in user_ids}
+        report("CSR in-process", len(user_ids), time.perf_counter() - start)
+        assert scored == expected, "CSR and SQL disagree"
+
+        for workers in sorted({1, args.workers}):
+            start = time.perf_counter()
+            recommend.precompute(db_filename, workers, log=lambda message: None)
+            report(f"precompute x{workers}", len(user_ids), time.perf_counter() - start)
+        stored = {usr: [] for usr in user_ids}
+        for usr, candidate, mutual in conn.execute(
+                "SELECT usr, candidate, mutual FROM follow_recommendations ORDER BY usr, rank"):
+            stored[usr].append((candidate, mutual))
+        assert stored == expected, "stored recommendations and SQL disagree"
+
+        sample = random.Random(0).choices(user_ids, k=args.reads)
+        stored_us = time_reads(conn, sample, recommend._STORED_QUERY,
+                               lambda usr: (usr, recommend.RECOMMEND_LIMIT))
+        live_us = time_reads(conn, sample, recommend._CANDIDATES_QUERY,
+                             lambda usr: {"usr": usr, "limit": recommend.RECOMMEND_LIMIT})
+        print(f"\n{'read':<14} | {'median us':>9}")
+        print("-" * 26)
+        print(f"{'stored':<14} | {stored_us:>9.1f}")
+        print(f"{'live SQL':<14} | {live_us:>9.1f}")
+        close_all_pools()
+
+
+if __name__ == "__main__":
+    main()
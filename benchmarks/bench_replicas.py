@@ -0,0 +1,161 @@
+"""
+Measure read replicas: posting latency while heavy reads run, with and without replicas.
+
+Usage: python benchmarks/bench_replicas.py [--scale NAME] [--readers T] [--seconds S] [--replicas N]
+                                           [--configs LIST] [--data-dir DIR]
+
+Each configuration runs on a fresh copy of a datagen.py database in this
+process. T reader threads run keyword searches with LIKE scans (the heavy
+"analytical" screen) and profile pages through replicas.read_connection,
+while one writer thread posts tweets through replicas.write_connection and
+reads its own profile back (read-your-writes) for S seconds:
+- wal/primary, delete/primary: no replicas, every read on the primary
+- wal/replicas, delete/replicas: N replicas refreshed every
+  REPLICA_REFRESH_MS, reads within REPLICA_MAX_LAG_MS
+
+Reported per configuration: posts per second, post p50/p99 latency, reads
+per second, the largest primary WAL seen, the share of the reader threads'
+reads served by replicas and the mean refresh time. Every post must be
+visible to the writer's next read; the benchmark fails otherwise.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+import replicas  # noqa: E402
+import service  # noqa: E402
+import settings  # noqa: E402
+from connection_pool import close_all_pools  # noqa: E402
+
+CONFIGS = {
+    "wal/primary": ("WAL", 0),
+    "wal/replicas": ("WAL", None),
+    "delete/primary": ("DELETE", 0),
+    "delete/replicas": ("DELETE", None),
+}
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def run_config(db_filename, users, readers, seconds):
+    stop = threading.Event()
+    reads = [0] * readers
+    errors = []
+
+    def reader(index):
+        rng = random.Random(index)
+        try:
+            while not stop.is_set():
+                # Other users' reads: only the staleness bound applies to them
+                with replicas.read_connection(db_filename) as conn:
+                    service.search_tweets(conn, [rng.choice(datagen.WORDS)])
+                    service.get_user_profile(conn, rng.randint(1, users), viewer_id=rng.randint(1, users))
+                reads[index] += 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+
+    rng = random.Random(-1)
+    latencies = []
+    wal_bytes = 0
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < seconds and not errors:
+            usr = rng.randint(1, users)
+            began = time.perf_counter()
+            with replicas.write_connection(db_filename, usr) as conn:
+                tweet = service.post_tweet(conn, usr, f"replica bench {len(latencies)}")
+            latencies.append(time.perf_counter() - began)
+            with replicas.read_connection(db_filename, usr) as conn:
+                if service.get_user_tweets(conn, usr, limit=1)[0].tid != tweet.tid:
+                    errors.append(AssertionError(f"user {usr} did not read their own post {tweet.tid}"))
+            if os.path.exists(db_filename + "-wal"):
+                wal_bytes = max(wal_bytes, os.path.getsize(db_filename + "-wal"))
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+    replica_set = replicas.get_replicas(db_filename)
+    stats = replica_set.stats() if replica_set is not None else None
+    latencies.sort()
+    return {
+        "posts_per_s": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.5) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "reads_per_s": sum(reads) / elapsed,
+        "wal_kb": wal_bytes / 1024,
+        # The writer's reads follow its own posts, so they are always on the primary
+        "replica_share": stats["replica_reads"] / max(1, sum(reads)) if stats else 0.0,
+        "refresh_ms": stats["mean_refresh_ms"] if stats else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="small")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--replicas", type=int, default=2)
+    parser.add_argument("--configs", default=",".join(CONFIGS), help="comma-separated subset of " + ", ".join(CONFIGS))
+    parser.add_argument("--data-dir", help="keep and reuse the generated database here")
+    args = parser.parse_args()
+
+    # Keyword searches as LIKE scans: the long reads replicas are meant to take off the primary
+    settings.SEARCH_BACKEND = "like"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        source_db = os.path.join(data_dir, f"bench-{args.scale}-seed0.db")
+        if not os.path.exists(source_db):
+            print(f"Generating the {args.scale} database...")
+            users, tweets = datagen.SCALES[args.scale]
+            datagen.generate(source_db, users, tweets, 0, log=lambda message: None)
+        users = datagen.SCALES[args.scale][0]
+
+        print(f"{'config':<16} | {'posts/s':>8} | {'p50 ms':>7} | {'p99 ms':>7} | {'reads/s':>8} | "
+              f"{'WAL KiB':>8} | {'replica':>7} | {'refresh ms':>10}")
+        print("-" * 96)
+        for name in args.configs.split(","):
+            journal_mode, count = CONFIGS[name]
+            db_filename = os.path.join(tmp, f"{name.replace('/', '-')}.db")
+            shutil.copyfile(source_db, db_filename)
+            # Leaving WAL needs the file to itself, so switch before any pool or replica opens it
+            conn = sqlite3.connect(db_filename)
+            conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+            conn.close()
+            settings.DB_JOURNAL_MODE = journal_mode
+            settings.REPLICAS = args.replicas if count is None else count
+            try:
+                result = run_config(db_filename, users, args.readers, args.seconds)
+            finally:
+                replicas.close_replicas()
+                close_all_pools()
+            print(f"{name:<16} | {result['posts_per_s']:>8.1f} | {result['p50_ms']:>7.2f} | "
+                  f"{result['p99_ms']:>7.2f} | {result['reads_per_s']:>8.1f} | {result['wal_kb']:>8.0f} | "
+                  f"{result['replica_share']:>7.0%} | {result['refresh_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
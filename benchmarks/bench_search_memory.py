@@ -0,0 +1,122 @@
+"""
+Measure peak RSS of tweet and user search: fetchall() versus keyset pages.
+
+Usage: python benchmarks/bench_search_memory.py [--tweets N] [--users U] [--keyword K]
+
+Builds a synthetic database in a temporary directory where the keyword
+matches (almost) every tweet and user name. Each mode then runs in a fresh
+child process, so ru_maxrss belongs to that mode alone:
+- fetchall: the old behaviour, loading every match and showing the first page
+- paged: one LIMIT-bounded page plus the lookahead row
+
+The paged peak stays flat as --tweets grows; the fetchall peak grows with it.
+"""
+import argparse
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCHEMA_FILE = os.path.join(ROOT, "db_schema_W25.sql")
+WORDS = ["database", "project", "query", "index", "sqlite", "tweet", "follow", "search", "page", "cursor"]
+
+
+def build_database(db_filename, tweets, users):
+    rng = random.Random(42)
+    conn = sqlite3.connect(db_filename)
+    with open(SCHEMA_FILE) as f:
+        conn.executescript(f.read())
+    conn.executemany("INSERT INTO users (usr, name, email, phone, pwd) VALUES (?, ?, ?, ?, ?)",
+                     ((u, f"user{u} " + rng.choice(WORDS), f"u{u}@example.com", 5550000 + u, "pwd")
+                      for u in range(1, users + 1)))
+    conn.executemany("INSERT INTO tweets (tid, writer_id, text, tdate, ttime) VALUES (?, ?, ?, ?, ?)",
+                     ((t, rng.randint(1, users), " ".join(rng.choices(WORDS, k=20)),
+                       f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                       f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00")
+                      for t in range(1, tweets + 1)))
+    conn.executemany("INSERT INTO follows (flwer, flwee, start_date) VALUES (?, ?, '2024-01-01')",
+                     ((u, 1) for u in range(2, users + 1)))
+    conn.commit()
+    conn.close()
+
+    # Indexes, counters and the search index, as the app would create them
+    import MiniProject
+    sys.argv = [sys.argv[0], db_filename]
+    MiniProject.Set_Database()
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(mode, db_filename, keyword):
+    """
+    Run one search mode and print: rows_shown peak_before_kb peak_after_kb seconds.
+    """
+    import service
+    from connection_pool import get_pool
+    from tweet_search import find_tweets
+
+    pool = get_pool(db_filename)
+    with pool.connection() as conn:
+        conn.execute("SELECT 1").fetchall()
+    before = peak_rss_kb()
+
+    start = time.perf_counter()
+    with pool.connection() as conn:
+        if mode == "fetchall":
+            tweets = find_tweets(conn, [keyword])
+            users = conn.execute('''
+                SELECT usr, name FROM users WHERE name LIKE ? COLLATE NOCASE
+                ORDER BY LENGTH(name) ASC, name ASC
+            ''', ('%' + keyword + '%',)).fetchall()
+            followers = conn.execute('''
+                SELECT u.usr, u.name FROM follows f JOIN users u ON f.flwer = u.usr
+                WHERE f.flwee = ? ORDER BY u.name ASC
+            ''', (1,)).fetchall()
+            shown = len(tweets[:5]) + len(users[:5]) + len(followers[:5])
+        else:
+            shown = (len(service.search_tweets(conn, [keyword]).items)
+                     + len(service.search_users(conn, keyword).items)
+                     + len(service.list_followers(conn, 1).items))
+    elapsed = time.perf_counter() - start
+    print(shown, before, peak_rss_kb(), f"{elapsed:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tweets", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--keyword", default="e", help="a keyword that matches nearly everything")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "DATABASE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1], args.keyword)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_filename = os.path.join(tmp, "search.db")
+        print(f"Building {args.tweets:,} tweets and {args.users:,} users...")
+        build_database(db_filename, args.tweets, args.users)
+
+        print(f"{'mode':<10} | {'rows shown':>10} | {'peak RSS MB':>11} | {'growth MB':>9} | {'seconds':>7}")
+        print("-" * 61)
+        for mode in ("fetchall", "paged"):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--keyword", args.keyword, "--child", mode, db_filename],
+                check=True, capture_output=True, text=True,
+            ).stdout.split()
+            shown, before, after, seconds = int(output[0]), int(output[1]), int(output[2]), float(output[3])
+            print(f"{mode:<10} | {shown:>10} | {after / 1024:>11.1f} | {(after - before) / 1024:>9.1f} | {seconds:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
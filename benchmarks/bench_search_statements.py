@@ -0,0 +1,109 @@
+"""
+Measure how much of a repeated tweet search is statement parsing and planning.
+
+Usage: python benchmarks/bench_search_statements.py [--scale NAME] [--searches N] [--data-dir DIR]
+
+Builds a datagen.py database and draws a seeded workload of first-page
+searches: one to four keywords mixing "#tags", words and short fragments.
+The same workload then runs on two connections:
+- cached: the pool's settings, so the fixed search statements stay prepared
+- uncached: cached_statements=0, so every search is parsed and planned again,
+  as it was when the SQL text changed with every keyword combination
+
+The difference per search is the prepare cost the fixed statements remove.
+The run also reports how many distinct SQL texts the workload produced.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+import settings  # noqa: E402
+from tweet_search import SEARCH_PAGE_SIZE, _use_fts, build_search_query  # noqa: E402
+
+
+def make_workload(rng, searches):
+    hashtags = datagen.Zipf(datagen.HASHTAG_VOCABULARY, 1.0, rng)
+    workload = []
+    for _ in range(searches):
+        keywords = []
+        for _ in range(rng.randint(1, 4)):
+            kind = rng.random()
+            if kind < 0.4:
+                keywords.append(f"#tag{hashtags.draw()}")
+            elif kind < 0.8:
+                keywords.append(rng.choice(datagen.WORDS))
+            else:
+                # Too short for the trigram index, so it takes the LIKE branch
+                keywords.append(rng.choice(datagen.WORDS)[:2])
+        workload.append((keywords, rng.choice(("date", "rank"))))
+    return workload
+
+
+def run(db_filename, workload, cached_statements):
+    conn = sqlite3.connect(db_filename, cached_statements=cached_statements)
+    conn.row_factory = sqlite3.Row
+    use_fts = _use_fts(conn)
+    # Warm the page cache so both runs read from memory
+    for keywords, order_by in workload[:50]:
+        conn.execute(*build_search_query(keywords, use_fts, order_by, None, SEARCH_PAGE_SIZE + 1)).fetchall()
+
+    timings = []
+    for keywords, order_by in workload:
+        start = time.perf_counter()
+        query, params = build_search_query(keywords, use_fts, order_by, None, SEARCH_PAGE_SIZE + 1)
+        conn.execute(query, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1e6)
+    conn.close()
+    timings.sort()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="small")
+    parser.add_argument("--searches", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="keep and reuse the generated database here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        db_filename = os.path.join(data_dir, f"bench-{args.scale}-seed{args.seed}.db")
+        if not os.path.exists(db_filename):
+            print(f"Generating the {args.scale} database...")
+            users, tweets = datagen.SCALES[args.scale]
+            datagen.generate(db_filename, users, tweets, args.seed, log=lambda message: None)
+
+        workload = make_workload(random.Random(args.seed), args.searches)
+        conn = sqlite3.connect(db_filename)
+        use_fts = _use_fts(conn)
+        conn.close()
+        texts = {build_search_query(keywords, use_fts, order_by, None, 1)[0] for keywords, order_by in workload}
+        print(f"{len(workload):,} searches, {len({tuple(k) for k, _ in workload}):,} distinct keyword lists, "
+              f"{len(texts)} distinct SQL texts")
+
+        results = {}
+        print(f"{'statements':<10} | {'mean us':>9} | {'p50 us':>9} | {'p99 us':>9}")
+        print("-" * 46)
+        for label, size in (("cached", settings.STATEMENT_CACHE_SIZE), ("uncached", 0)):
+            timings = results[label] = run(db_filename, workload, size)
+            p99 = timings[min(len(timings) - 1, int(0.99 * len(timings)))]
+            print(f"{label:<10} | {statistics.fmean(timings):>9.1f} | {statistics.median(timings):>9.1f} | {p99:>9.1f}")
+
+        saved = statistics.median(results["uncached"]) - statistics.median(results["cached"])
+        print(f"Parse/plan cost removed per search: {saved:.1f} us at p50 "
+              f"({saved / statistics.median(results['uncached']):.0%} of an uncached search)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Measure sharding.py: scatter-gather reads, concurrent posting, splitting and rebalancing.
+
+Usage: python benchmarks/bench_sharding.py [--scale NAME] [--shards LIST] [--writers T] [--seconds S]
+                                           [--reads N] [--id-block N] [--data-dir DIR]
+
+A datagen.py database is split into each --shards count (1 is the database
+itself, through the service layer) and every configuration is measured:
+- split: sharding.split time
+- feed, search: median first-page latency of get_feed for --reads users and
+  of search_tweets (date order) for --reads keywords; every page must match
+  the unsharded database's
+- posts/s: T writer threads post as random users for S seconds, tweet ids
+  reserved --id-block at a time (TWEET_ID_BLOCK_SIZE) in both cases
+- rebalance: one shard is added and users are moved until every shard is
+  within 5% of the mean; reported with the largest shard's share before and
+  after
+
+One CPU runs the per-shard queries one at a time; os.cpu_count() is printed
+with the results.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+import service  # noqa: E402
+import settings  # noqa: E402
+import sharding  # noqa: E402
+from connection_pool import close_all_pools, get_pool  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def median_us(calls):
+    timings = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def post_rate(post, users, writers, seconds):
+    """
+    Run `writers` threads calling post(usr, text) for `seconds`; returns posts per second.
+    """
+    stop = threading.Event()
+    counts = [0] * writers
+    errors = []
+
+    def writer(index):
+        rng = random.Random(index)
+        try:
+            while not stop.is_set():
+                post(rng.randint(1, users), f"shard bench {index} {counts[index]}")
+                counts[index] += 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def largest_share(db):
+    loads = [sum(weight for _usr, weight in users) for users in db.user_weights().values()]
+    return max(loads) / sum(loads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="small")
+    parser.add_argument("--shards", default="1,2,4", help="comma-separated shard counts")
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--id-block", type=int, default=100)
+    parser.add_argument("--data-dir", help="keep and reuse the generated database here")
+    args = parser.parse_args()
+
+    settings.TWEET_ID_BLOCK_SIZE = args.id_block
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        source_db = os.path.join(data_dir, f"bench-{args.scale}-seed0.db")
+        if not os.path.exists(source_db):
+            print(f"Generating the {args.scale} database...")
+            users, tweets = datagen.SCALES[args.scale]
+            datagen.generate(source_db, users, tweets, 0, log=lambda message: None)
+        users = datagen.SCALES[args.scale][0]
+
+        # The reference: one file, read through the service layer
+        single_db = os.path.join(tmp, "single.db")
+        shutil.copyfile(source_db, single_db)
+        pool = get_pool(single_db)
+        with pool.connection() as conn:
+            migrate(conn)
+        rng = random.Random(0)
+        readers = [rng.randint(1, users) for _ in range(args.reads)]
+        keywords = [[rng.choice(datagen.WORDS)] for _ in range(args.reads)]
+        with pool.connection() as conn:
+            expected_feeds = [service.get_feed(conn, usr) for usr in readers]
+            expected_searches = [service.search_tweets(conn, kws) for kws in keywords]
+
+        print(f"CPUs: {os.cpu_count()}\n")
+        print(f"{'shards':>6} | {'split s':>7} | {'feed us':>8} | {'search us':>9} | {'posts/s':>8} | "
+              f"{'rebalance s':>11} | {'largest before/after':>20}")
+        print("-" * 90)
+        for count in [int(n) for n in args.shards.split(",")]:
+            if count == 1:
+                def read_feed(usr):
+                    with pool.connection() as conn:
+                        return service.get_feed(conn, usr)
+
+                def read_search(kws):
+                    with pool.connection() as conn:
+                        return service.search_tweets(conn, kws)
+
+                def post(usr, text):
+                    with pool.connection(immediate=True) as conn:
+                        service.post_tweet(conn, usr, text)
+
+                split_s = 0.0
+                db = None
+            else:
+                shard_dir = os.path.join(tmp, f"shards{count}")
+                os.mkdir(shard_dir)
+                map_filename = os.path.join(shard_dir, "bench.shards")
+                start = time.perf_counter()
+                sharding.split(source_db, map_filename, count, log=lambda message: None)
+                split_s = time.perf_counter() - start
+                db = sharding.ShardedDatabase(map_filename)
+                read_feed, read_search, post = db.get_feed, db.search_tweets, db.post_tweet
+
+            assert [read_feed(usr) for usr in readers] == expected_feeds, f"{count} shards: feeds differ"
+            assert [read_search(kws) for kws in keywords] == expected_searches, f"{count} shards: searches differ"
+            feed_us = median_us(lambda usr=usr: read_feed(usr) for usr in readers)
+            search_us = median_us(lambda kws=kws: read_search(kws) for kws in keywords)
+            posts = post_rate(post, users, args.writers, args.seconds)
+
+            rebalance = "-"
+            if db is not None:
+                before = largest_share(db)
+                db.close()
+                start = time.perf_counter()
+                sharding.rebalance(map_filename, count + 1, log=lambda message: None)
+                elapsed = time.perf_counter() - start
+                db = sharding.ShardedDatabase(map_filename)
+                rebalance = f"{elapsed:>11.2f} | {before:>9.0%} -> {largest_share(db):>6.0%}"
+                db.close()
+            print(f"{count:>6} | {split_s:>7.2f} | {feed_us:>8.0f} | {search_us:>9.0f} | {posts:>8.0f} | {rebalance}")
+            close_all_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Measure spam.py: bulk scoring and flagging, and feed reads with the partial index.
+
+Usage: python benchmarks/bench_spam.py [--scale NAME] [--bots N] [--campaigns N] [--reads N] [--data-dir DIR]
+
+On a copy of a datagen.py database with injected spam:
+- bots: --bots users each retweet 3 x SPAM_BURST_PER_DAY tweets on one day
+- campaigns: --campaigns texts each posted by 2 x SPAM_DUPLICATE_WRITERS
+  users and retweeted by others
+
+classify: spam.classify_spam scoring time and flags written per second,
+checked against the injected rows (which must all be flagged).
+
+feed: median first-page latency of the pull feed for the --reads users who
+follow the most bots, with idx_retweets_feed (spam = 0 rows only) and with
+the covering idx_retweets_retweeter it replaced; the retweets branch of the
+feed query is also timed alone.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+import settings  # noqa: E402
+import spam  # noqa: E402
+from connection_pool import close_all_pools  # noqa: E402
+from feed import _RETWEETS_BRANCH, _pull_rows  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+def connect(db_filename):
+    conn = sqlite3.connect(db_filename)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+
+def inject_spam(conn, bots, campaigns, rng):
+    """
+    Add bot retweet bursts and copy-paste campaigns; returns the (tid, retweeter_id) keys they add.
+    """
+    users = conn.execute("SELECT MAX(usr) FROM users").fetchone()[0]
+    tweets = conn.execute("SELECT MAX(tid) FROM tweets").fetchone()[0]
+    days = [row[0] for row in conn.execute("SELECT DISTINCT tdate FROM tweets")]
+    expected = set()
+    per_bot = 3 * settings.SPAM_BURST_PER_DAY
+    for bot in rng.sample(range(1, users + 1), bots):
+        day = rng.choice(days)
+        for tid in rng.sample(range(1, tweets + 1), per_bot):
+            inserted = conn.execute('''
+                INSERT OR IGNORE INTO retweets (tid, retweeter_id, writer_id, spam, rdate)
+                SELECT tid, ?, writer_id, 0, ? FROM tweets WHERE tid = ?
+            ''', (bot, day, tid)).rowcount
+            if inserted:
+                expected.add((tid, bot))
+    next_tid = tweets + 1
+    for campaign in range(campaigns):
+        text = f"Win a FREE prize   number {campaign} click now"
+        for writer in rng.sample(range(1, users + 1), 2 * settings.SPAM_DUPLICATE_WRITERS):
+            # Case and spacing vary between copies; the normalized hash does not
+            conn.execute('''
+                INSERT INTO tweets (tid, writer_id, text, tdate, ttime) VALUES (?, ?, ?, ?, '12:00:00')
+            ''', (next_tid, writer, text.upper() if writer % 2 else text, rng.choice(days)))
+            for retweeter in rng.sample(range(1, users + 1), 5):
+                if retweeter != writer:
+                    conn.execute('''
+                        INSERT INTO retweets (tid, retweeter_id, writer_id, spam, rdate)
+                        SELECT tid, ?, writer_id, 0, tdate FROM tweets WHERE tid = ?
+                    ''', (retweeter, next_tid))
+                    expected.add((next_tid, retweeter))
+            next_tid += 1
+    conn.commit()
+    return expected
+
+
+def time_reads(user_ids, read):
+    timings = []
+    for usr in user_ids:
+        start = time.perf_counter()
+        read(usr)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def time_feeds(conn, user_ids):
+    """
+    Return the median (feed page, retweets branch alone) latency in microseconds.
+    """
+    branch = _RETWEETS_BRANCH.format(after="")
+    return (time_reads(user_ids, lambda usr: _pull_rows(conn, usr, None, 6)),
+            time_reads(user_ids, lambda usr: conn.execute(branch, (usr, 6)).fetchall()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="small")
+    parser.add_argument("--bots", type=int, default=50)
+    parser.add_argument("--campaigns", type=int, default=20)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--data-dir", help="keep and reuse the generated database here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        source_db = os.path.join(data_dir, f"bench-{args.scale}-seed0.db")
+        if not os.path.exists(source_db):
+            print(f"Generating the {args.scale} database...")
+            users, tweets = datagen.SCALES[args.scale]
+            datagen.generate(source_db, users, tweets, 0, log=lambda message: None)
+
+        db_filename = os.path.join(tmp, "spam.db")
+        shutil.copyfile(source_db, db_filename)
+        conn = connect(db_filename)
+        # A kept --data-dir database may predate the partial index
+        migrate(conn)
+        expected = inject_spam(conn, args.bots, args.campaigns, random.Random(0))
+        before = conn.execute("SELECT COUNT(*) FROM retweets WHERE spam != 0").fetchone()[0]
+        total = conn.execute("SELECT COUNT(*) FROM retweets").fetchone()[0]
+        conn.close()
+        print(f"{total:,} retweets, {before:,} already flagged, {len(expected):,} injected\n")
+
+        start = time.perf_counter()
+        flagged = spam.classify_spam(db_filename, log=lambda message: print(f"  {message}"))
+        elapsed = time.perf_counter() - start
+        close_all_pools()
+        print(f"classify: {elapsed:.2f}s, {flagged:,} flagged, {flagged / elapsed:,.0f} flags/s overall")
+
+        conn = connect(db_filename)
+        missed = sum(1 for tid, retweeter in expected if not conn.execute(
+            "SELECT 1 FROM retweets WHERE tid = ? AND retweeter_id = ? AND spam = 1", (tid, retweeter)).fetchone())
+        print(f"Injected spam left unflagged: {missed}")
+        assert spam.classify_spam(db_filename, log=lambda message: None) == 0, "a second run flagged more"
+        close_all_pools()
+
+        readers = [row[0] for row in conn.execute('''
+            SELECT f.flwer FROM follows f
+            JOIN (SELECT retweeter_id FROM retweets GROUP BY retweeter_id ORDER BY SUM(spam) DESC LIMIT ?) b
+              ON b.retweeter_id = f.flwee
+            GROUP BY f.flwer ORDER BY COUNT(*) DESC LIMIT ?
+        ''', (args.bots, args.reads))]
+        partial = time_feeds(conn, readers)
+        expected_rows = [[tuple(row) for row in _pull_rows(conn, usr, None, 6)] for usr in readers]
+        conn.execute("DROP INDEX idx_retweets_feed")
+        conn.execute("CREATE INDEX idx_retweets_retweeter ON retweets (retweeter_id, rdate, tid, spam)")
+        full = time_feeds(conn, readers)
+        assert expected_rows == [[tuple(row) for row in _pull_rows(conn, usr, None, 6)] for usr in readers]
+        conn.close()
+
+        print(f"\n{'feed index':<24} | {'page us':>9} | {'retweets us':>11}")
+        print("-" * 50)
+        for label, (page, branch) in (("idx_retweets_feed", partial), ("idx_retweets_retweeter", full)):
+            print(f"{label:<24} | {page:>9.1f} | {branch:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
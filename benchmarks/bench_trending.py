@@ -0,0 +1,145 @@
+"""
+Measure trending hashtags: update cost per tweet and top-K query latency.
+
+Usage: python benchmarks/bench_trending.py [--scale NAME] [--tweets N] [--queries N] [--data-dir DIR]
+
+On copies of a datagen.py database:
+- update: post N tweets with one to three hashtags through service.post_tweet,
+  with and without the trending triggers; the difference is what the
+  incremental counts add per tweet
+- query: top 10 of the 1h, 24h and 7d windows from trending_totals, against
+  the GROUP BY over hashtag_mentions and tweets it replaces
+- advance: moving the windows forward one hour at a time over a week
+
+The generated tweets end in 2024, so "now" is the hour of the latest tweet.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+import service  # noqa: E402
+import trending  # noqa: E402
+from migrations import migrate  # noqa: E402
+from trending import _TWEET_HOUR, TRENDING_WINDOWS  # noqa: E402
+
+_GROUP_BY = f'''
+    SELECT LOWER(h.term) AS term, COUNT(*) AS mentions
+    FROM hashtag_mentions h
+    JOIN tweets t ON t.tid = h.tid
+    WHERE {_TWEET_HOUR} > ? AND {_TWEET_HOUR} <= ?
+    GROUP BY LOWER(h.term)
+    ORDER BY mentions DESC, term
+    LIMIT 10
+'''
+
+
+def connect(db_filename):
+    conn = sqlite3.connect(db_filename)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def post_tweets(db_filename, count, users, seed, triggers):
+    conn = connect(db_filename)
+    # New tweets are dated now: put the window heads there so every mention updates the totals
+    trending.rebuild_trending(conn)
+    if not triggers:
+        conn.execute("DROP TRIGGER trending_ai")
+        conn.execute("DROP TRIGGER trending_ad")
+    conn.commit()
+    rng = random.Random(seed)
+    tags = datagen.Zipf(datagen.HASHTAG_VOCABULARY, 1.0, rng)
+    timings = []
+    for _ in range(count):
+        terms = {f"#tag{tags.draw()}" for _ in range(rng.randint(1, 3))}
+        text = " ".join(rng.choices(datagen.WORDS, k=5) + sorted(terms))
+        start = time.perf_counter()
+        service.post_tweet(conn, rng.randint(1, users), text)
+        conn.commit()
+        timings.append(time.perf_counter() - start)
+    conn.close()
+    return statistics.median(timings) * 1e6
+
+
+def time_queries(conn, queries, fn):
+    timings = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="small")
+    parser.add_argument("--tweets", type=int, default=2000, help="tweets posted per update run")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--data-dir", help="keep and reuse the generated database here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        source_db = os.path.join(data_dir, f"bench-{args.scale}-seed0.db")
+        if not os.path.exists(source_db):
+            print(f"Generating the {args.scale} database...")
+            users, tweets = datagen.SCALES[args.scale]
+            datagen.generate(source_db, users, tweets, 0, log=lambda message: None)
+        users = datagen.SCALES[args.scale][0]
+
+        db_filename = os.path.join(tmp, "trending.db")
+        shutil.copyfile(source_db, db_filename)
+        conn = connect(db_filename)
+        # A kept --data-dir database may predate the trending tables
+        migrate(conn)
+        now_hour = conn.execute(f"SELECT MAX({_TWEET_HOUR}) FROM tweets t").fetchone()[0]
+        start = time.perf_counter()
+        trending.rebuild_trending(conn, now_hour * 3600)
+        conn.commit()
+        print(f"rebuild_trending: {time.perf_counter() - start:.2f}s")
+
+        print(f"\n{'query':<10} | {'top-K us':>9} | {'GROUP BY us':>11} | {'speedup':>7}")
+        print("-" * 46)
+        for window, hours in TRENDING_WINDOWS.items():
+            fast = time_queries(conn, args.queries,
+                                lambda: trending.top_trending(conn, window, 10, now_hour * 3600))
+            slow = time_queries(conn, max(1, args.queries // 10),
+                                lambda: conn.execute(_GROUP_BY, (now_hour - hours, now_hour)).fetchall())
+            expected = [tuple(row) for row in conn.execute(_GROUP_BY, (now_hour - hours, now_hour))]
+            assert trending.top_trending(conn, window, 10, now_hour * 3600) == expected, window
+            print(f"{window:<10} | {fast:>9.1f} | {slow:>11.1f} | {slow / fast:>6.0f}x")
+
+        start = time.perf_counter()
+        steps = max(TRENDING_WINDOWS.values())
+        for step in range(1, steps + 1):
+            trending.advance_windows(conn, (now_hour + step) * 3600)
+            conn.commit()
+        print(f"\nadvance: {(time.perf_counter() - start) / steps * 1000:.2f} ms per hour over {steps} hours")
+        conn.close()
+
+        print(f"\n{'update':<10} | {'us/tweet':>9}")
+        print("-" * 22)
+        results = {}
+        for label, triggers in (("without", False), ("with", True)):
+            copy = os.path.join(tmp, f"update-{label}.db")
+            shutil.copyfile(db_filename, copy)
+            results[label] = post_tweets(copy, args.tweets, users, seed=1, triggers=triggers)
+            print(f"{label:<10} | {results[label]:>9.1f}")
+        print(f"Trending counts add {results['with'] - results['without']:.1f} us per tweet (median).")
+
+
+if __name__ == "__main__":
+    main()
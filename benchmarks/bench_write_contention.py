@@ -0,0 +1,230 @@
+"""
+Measure write contention between processes sharing one database file.
+
+Usage: python benchmarks/bench_write_contention.py [--scale NAME] [--writers P] [--threads T]
+                                                   [--writes N] [--readers R] [--configs LIST] [--data-dir DIR]
+
+Each configuration runs on a fresh copy of a datagen.py database. P writer
+processes with T threads each perform N writes per thread (mostly tweet
+posts, plus retweets and follows), while R reader processes page home feeds
+until the writers finish. The configurations are:
+- delete/direct: rollback journal, every write its own deferred transaction
+  (the behaviour before WAL and the write queue)
+- wal/direct: WAL, every write its own BEGIN IMMEDIATE transaction
+- wal/queue: WAL, each writer process funnels its threads through a
+  WriteQueue that commits them in batches
+
+Reported per configuration: committed writes per second, "database is
+locked" failures, write and feed-read p50/p99 latency, feed reads per second
+and the mean number of writes per commit.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+
+CONFIGS = {
+    "delete/direct": ("DELETE", "direct"),
+    "wal/direct": ("WAL", "immediate"),
+    "wal/queue": ("WAL", "queue"),
+}
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+# ========================
+# Child Processes
+# ========================
+# Children import the app only after the parent has set TWITTER_DB_JOURNAL_MODE.
+
+def _write(service, conn, rng, users):
+    user = rng.randint(1, users)
+    kind = rng.random()
+    if kind < 0.7:
+        service.post_tweet(conn, user, f"contention test {rng.random():.6f} #bench", None)
+    elif kind < 0.85:
+        service.retweet(conn, user, rng.randint(1, 1000))
+    else:
+        service.follow(conn, user, rng.randint(1, users))
+
+
+def writer(db_filename, mode, threads, writes, users, start_at, seed):
+    import service
+    from connection_pool import get_pool
+    from write_queue import WriteQueue
+
+    pool = get_pool(db_filename)
+    write_queue = WriteQueue(db_filename) if mode == "queue" else None
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def work(thread_seed):
+        rng = random.Random(thread_seed)
+        local = []
+        failed = 0
+        while time.time() < start_at:
+            time.sleep(0.001)
+        for _ in range(writes):
+            start = time.perf_counter()
+            try:
+                if write_queue is not None:
+                    write_queue.call(lambda conn: _write(service, conn, rng, users))
+                else:
+                    with pool.connection(immediate=mode == "immediate") as conn:
+                        _write(service, conn, rng, users)
+            except sqlite3.OperationalError:
+                failed += 1
+            except service.ServiceError:
+                # Duplicate retweet or follow: a normal outcome, not contention
+                pass
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=work, args=(seed * 1000 + i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    stats = write_queue.stats() if write_queue is not None else {"batches": 0, "jobs": 0}
+    if write_queue is not None:
+        write_queue.close()
+    print(json.dumps({"latencies": latencies, "errors": errors[0], **stats}))
+
+
+def reader(db_filename, users, start_at, stop_file, seed):
+    import service
+    from connection_pool import get_pool
+
+    pool = get_pool(db_filename)
+    rng = random.Random(seed)
+    latencies = []
+    errors = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    while not os.path.exists(stop_file):
+        start = time.perf_counter()
+        try:
+            with pool.connection() as conn:
+                service.get_feed(conn, rng.randint(1, users))
+        except sqlite3.OperationalError:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(json.dumps({"latencies": latencies, "errors": errors}))
+
+
+# ========================
+# Driver
+# ========================
+
+def run_config(name, source_db, work_dir, args, users):
+    journal_mode, mode = CONFIGS[name]
+    db_filename = os.path.join(work_dir, name.replace("/", "-") + ".db")
+    shutil.copyfile(source_db, db_filename)
+    conn = sqlite3.connect(db_filename)
+    conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.close()
+
+    stop_file = db_filename + ".stop"
+    env = {**os.environ, "TWITTER_DB_JOURNAL_MODE": journal_mode}
+    start_at = time.time() + 1.0
+    script = os.path.abspath(__file__)
+    common = [sys.executable, script, "--child", db_filename, "--users", str(users), "--start-at", str(start_at)]
+    writers = [subprocess.Popen(common + ["--role", "writer", "--mode", mode, "--threads", str(args.threads),
+                                          "--writes", str(args.writes), "--seed", str(i)],
+                                stdout=subprocess.PIPE, text=True, env=env)
+               for i in range(args.writers)]
+    readers = [subprocess.Popen(common + ["--role", "reader", "--stop-file", stop_file, "--seed", str(100 + i)],
+                                stdout=subprocess.PIPE, text=True, env=env)
+               for i in range(args.readers)]
+
+    writer_results = [json.loads(process.communicate()[0]) for process in writers]
+    elapsed = time.time() - start_at
+    open(stop_file, "w").close()
+    reader_results = [json.loads(process.communicate()[0]) for process in readers]
+
+    write_ms = sorted(ms for result in writer_results for ms in result["latencies"])
+    read_ms = sorted(ms for result in reader_results for ms in result["latencies"])
+    failed = sum(result["errors"] for result in writer_results)
+    batches = sum(result["batches"] for result in writer_results)
+    jobs = sum(result["jobs"] for result in writer_results)
+    return {
+        "writes_per_sec": (len(write_ms) - failed) / elapsed,
+        "locked": failed + sum(result["errors"] for result in reader_results),
+        "write_p50": _percentile(write_ms, 0.5),
+        "write_p99": _percentile(write_ms, 0.99),
+        "read_p50": _percentile(read_ms, 0.5),
+        "read_p99": _percentile(read_ms, 0.99),
+        "reads_per_sec": len(read_ms) / elapsed,
+        "per_commit": jobs / batches if batches else 1.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="tiny")
+    parser.add_argument("--writers", type=int, default=4, help="writer processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per writer process")
+    parser.add_argument("--writes", type=int, default=100, help="writes per thread")
+    parser.add_argument("--readers", type=int, default=2, help="reader processes")
+    parser.add_argument("--configs", default=",".join(CONFIGS), help="comma-separated subset of " + ", ".join(CONFIGS))
+    parser.add_argument("--data-dir", help="keep and reuse the generated database here")
+    parser.add_argument("--child", metavar="DATABASE", help=argparse.SUPPRESS)
+    parser.add_argument("--role", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--users", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--stop-file", help=argparse.SUPPRESS)
+    parser.add_argument("--seed", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.role == "writer":
+            writer(args.child, args.mode, args.threads, args.writes, args.users, args.start_at, args.seed)
+        else:
+            reader(args.child, args.users, args.start_at, args.stop_file, args.seed)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        source_db = os.path.join(data_dir, f"bench-{args.scale}-seed0.db")
+        if not os.path.exists(source_db):
+            print(f"Generating the {args.scale} database...")
+            users, tweets = datagen.SCALES[args.scale]
+            datagen.generate(source_db, users, tweets, 0, log=lambda message: None)
+        users = datagen.SCALES[args.scale][0]
+
+        print(f"{args.writers} writer processes x {args.threads} threads x {args.writes} writes, "
+              f"{args.readers} reader processes")
+        print(f"{'config':<14} | {'writes/s':>8} | {'locked':>6} | {'write p50':>9} | {'write p99':>9} | "
+              f"{'read p50':>8} | {'read p99':>8} | {'reads/s':>7} | {'per commit':>10}")
+        print("-" * 106)
+        with tempfile.TemporaryDirectory() as work_dir:
+            for name in args.configs.split(","):
+                r = run_config(name.strip(), source_db, work_dir, args, users)
+                print(f"{name:<14} | {r['writes_per_sec']:>8.0f} | {r['locked']:>6} | {r['write_p50']:>9.2f} | "
+                      f"{r['write_p99']:>9.2f} | {r['read_p50']:>8.2f} | {r['read_p99']:>8.2f} | "
+                      f"{r['reads_per_sec']:>7.0f} | {r['per_commit']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
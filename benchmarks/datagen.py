@@ -0,0 +1,241 @@
+"""
+Generate a synthetic database for the schema in db_schema_W25.sql.
+
+Usage: python benchmarks/datagen.py <database> [--scale NAME] [--users N] [--tweets N] [--seed S]
+
+The output is deterministic for a given seed and scale:
+- Follows have a power-law (Zipf) followee distribution, so a few users
+  have huge audiences and most have a handful.
+- Tweets have Zipf-distributed authors, and a share of them are replies to
+  earlier tweets.
+- Hashtags come from a Zipf vocabulary written in mixed case.
+- Retweets carry a small spam share. Favorite lists hold some tweets.
+- Passwords are "pass<usr>", like the sample database.
+
+Rows are written in batches with the app's triggers not yet installed. Then
+Set_Database builds the indexes, counters, hashtag dictionary and search
+index in bulk, exactly as it would for an existing database.
+"""
+import argparse
+import array
+import itertools
+import os
+import random
+import sqlite3
+import sys
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCHEMA_FILE = os.path.join(ROOT, "db_schema_W25.sql")
+
+# name -> (users, tweets)
+SCALES = {
+    "tiny": (200, 2000),
+    "small": (2000, 50000),
+    "medium": (20000, 1000000),
+    "large": (200000, 10000000),
+}
+
+BATCH_SIZE = 10000
+
+WORDS = [
+    "database", "project", "query", "index", "sqlite", "tweet", "follow", "search", "page", "cursor",
+    "coffee", "music", "game", "weather", "monday", "weekend", "news", "travel", "photo", "code",
+    "python", "exam", "lab", "lecture", "deadline", "team", "idea", "design", "bug", "release",
+]
+FIRST_NAMES = ["John", "Emma", "Leo", "Ava", "Noah", "Mia", "Liam", "Zoe", "Omar", "Ivy", "Sam", "Kai"]
+LAST_NAMES = ["Smith", "Lee", "Brown", "Garcia", "Khan", "Nguyen", "Martin", "Wilson", "Chen", "Singh"]
+
+REPLY_RATIO = 0.15
+RETWEET_RATIO = 0.3
+SPAM_RATIO = 0.05
+HASHTAG_VOCABULARY = 5000
+FOLLOWS_PER_USER = 40
+START_DATE = date(2024, 1, 1)
+DAYS = 366
+
+
+class Zipf:
+    """
+    Draw integers 1..n with probability roughly proportional to 1 / rank ** alpha.
+    Uses the inverse CDF of the continuous power law, so it needs no table
+    and stays O(1) per draw at any n.
+    """
+
+    def __init__(self, n, alpha, rng):
+        self.n = n
+        self.alpha = alpha
+        self.rng = rng
+
+    def draw(self):
+        u = self.rng.random()
+        if self.alpha == 1:
+            x = self.n ** u
+        else:
+            one_minus = 1 - self.alpha
+            x = ((self.n ** one_minus - 1) * u + 1) ** (1 / one_minus)
+        return min(self.n, int(x))
+
+
+DATES = [date.fromordinal(START_DATE.toordinal() + day).isoformat() for day in range(DAYS)]
+
+
+def _date(rng):
+    return rng.choice(DATES)
+
+
+def _time(rng):
+    return f"{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}"
+
+
+def _batched(rows, size=BATCH_SIZE):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _insert(conn, sql, rows):
+    count = 0
+    for batch in _batched(rows):
+        conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def generate(db_filename, users, tweets, seed=0, log=print):
+    """
+    Fill a new database with `users` users and `tweets` tweets; returns row counts.
+    """
+    if os.path.exists(db_filename):
+        raise FileExistsError(db_filename)
+    rng = random.Random(seed)
+    counts = {}
+
+    conn = sqlite3.connect(db_filename)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    with open(SCHEMA_FILE) as f:
+        conn.executescript(f.read())
+
+    log(f"users: {users:,}")
+    counts["users"] = _insert(conn, "INSERT INTO users (usr, name, email, phone, pwd) VALUES (?, ?, ?, ?, ?)", (
+        (u, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", f"user{u}@example.com",
+         5550000000 + u, f"pass{u}")
+        for u in range(1, users + 1)
+    ))
+
+    # Popular accounts are popular as followees and as authors
+    popularity = Zipf(users, 1.1, rng)
+
+    log("follows")
+
+    def follow_rows():
+        for flwer in range(1, users + 1):
+            followees = {popularity.draw() for _ in range(rng.randint(1, 2 * FOLLOWS_PER_USER))}
+            followees.discard(flwer)
+            for flwee in sorted(followees):
+                yield flwer, flwee, _date(rng)
+    counts["follows"] = _insert(conn, "INSERT INTO follows (flwer, flwee, start_date) VALUES (?, ?, ?)", follow_rows())
+
+    log(f"tweets: {tweets:,}")
+
+    # Dates grow with tid, so replies and retweets never predate their tweet
+    def _tweet_day(tid):
+        return (tid - 1) * DAYS // tweets
+
+    def _tweet_date(tid):
+        return DATES[_tweet_day(tid)]
+
+    writers = array.array("i", [0]) * (tweets + 1)
+    hashtag_rank = Zipf(HASHTAG_VOCABULARY, 1.0, rng)
+    mentions = []
+
+    def tweet_rows():
+        for tid in range(1, tweets + 1):
+            writer = popularity.draw() if rng.random() < 0.5 else rng.randint(1, users)
+            writers[tid] = writer
+            replyto = rng.randint(1, tid - 1) if tid > 1 and rng.random() < REPLY_RATIO else None
+
+            words = rng.choices(WORDS, k=rng.randint(3, 15))
+            tags = {}
+            for _ in range(rng.choice((0, 0, 1, 1, 2, 3))):
+                term = f"tag{hashtag_rank.draw()}"
+                # Same term, different case, as users would type it
+                tags.setdefault(term, "#" + (term.upper() if rng.random() < 0.1 else term.capitalize()))
+            mentions.extend((tid, tag) for tag in tags.values())
+            yield tid, writer, " ".join(words + list(tags.values())), _tweet_date(tid), _time(rng), replyto
+
+    counts["tweets"] = 0
+    counts["hashtag_mentions"] = 0
+    for batch in _batched(tweet_rows()):
+        conn.executemany('''
+            INSERT INTO tweets (tid, writer_id, text, tdate, ttime, replyto_tid) VALUES (?, ?, ?, ?, ?, ?)
+        ''', batch)
+        conn.executemany("INSERT INTO hashtag_mentions (tid, term) VALUES (?, ?)", mentions)
+        counts["tweets"] += len(batch)
+        counts["hashtag_mentions"] += len(mentions)
+        mentions.clear()
+
+    log("retweets")
+    tweet_popularity = Zipf(tweets, 0.9, rng)
+
+    def retweet_rows():
+        for _ in range(int(tweets * RETWEET_RATIO)):
+            # Zipf rank counted from the newest tweet: recent tweets get most retweets
+            tid = tweets + 1 - tweet_popularity.draw()
+            retweeter = rng.randint(1, users)
+            if retweeter != writers[tid]:
+                rdate = DATES[rng.randint(_tweet_day(tid), DAYS - 1)]
+                yield tid, retweeter, writers[tid], int(rng.random() < SPAM_RATIO), rdate
+    # OR IGNORE drops repeated (tid, retweeter) draws without tracking them in memory
+    _insert(conn, '''
+        INSERT OR IGNORE INTO retweets (tid, retweeter_id, writer_id, spam, rdate) VALUES (?, ?, ?, ?, ?)
+    ''', retweet_rows())
+    counts["retweets"] = conn.execute("SELECT COUNT(*) FROM retweets").fetchone()[0]
+
+    log("lists")
+    list_rows = []
+    include_rows = []
+    for owner in range(1, users + 1):
+        for lname in rng.sample(["Favorites", "Later", "Funny", "Work"], rng.choice((0, 1, 1, 2))):
+            list_rows.append((owner, lname))
+            for tid in {rng.randint(1, tweets) for _ in range(rng.randint(0, 10))}:
+                include_rows.append((owner, lname, tid))
+    counts["lists"] = _insert(conn, "INSERT INTO lists (owner_id, lname) VALUES (?, ?)", list_rows)
+    counts["include"] = _insert(conn, "INSERT INTO include (owner_id, lname, tid) VALUES (?, ?, ?)", include_rows)
+
+    conn.commit()
+    conn.close()
+
+    log("indexes, counters and search index")
+    import MiniProject
+    argv = sys.argv
+    sys.argv = [argv[0], db_filename]
+    try:
+        MiniProject.Set_Database()
+    finally:
+        sys.argv = argv
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("database")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--users", type=int, help="overrides the scale's user count")
+    parser.add_argument("--tweets", type=int, help="overrides the scale's tweet count")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    users, tweets = SCALES[args.scale]
+    counts = generate(args.database, args.users or users, args.tweets or tweets, args.seed)
+    print(", ".join(f"{table}: {count:,}" for table, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Load generator for server.py reporting throughput and p50/p99 latency.
+
+Usage: python benchmarks/load_server.py [database] [--clients C] [--requests N]
+                                        [--workers W] [--write-ratio R] [--url URL]
+
+User ids for the workload are read from the database argument. Without
+--url, the database (the sample database by default) is copied to a
+temporary directory and served by a server.py subprocess, so the file
+passed in is never modified. Each client holds one keep-alive connection and sends
+a mix of feed, tweet search and user search reads, plus tweet posts for the
+--write-ratio share of requests.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote, urlsplit
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DB = os.path.join(ROOT, "prj-sample_W2025.db")
+
+SEARCH_WORDS = ["#database", "project", "data", "the", "#cmput291project", "hello", "sql"]
+NAME_WORDS = ["a", "e", "jo", "li", "an"]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def request(reader, writer, host, method, path, payload=None):
+    """
+    Send one keep-alive request and return (status, body bytes).
+    """
+    body = json.dumps(payload).encode() if payload is not None else b""
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n"
+    if body:
+        head += "Content-Type: application/json\r\n"
+    writer.write((head + "\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+def next_request(rng, users, write_ratio):
+    """
+    Pick (operation, method, path, payload) from the workload mix.
+    """
+    user = rng.choice(users)
+    if rng.random() < write_ratio:
+        return "post", "POST", "/tweets", {"user": user, "text": f"load test {rng.random():.6f} #load"}
+    roll = rng.random()
+    if roll < 0.5:
+        return "feed", "GET", f"/feed?user={user}", None
+    if roll < 0.8:
+        return "search tweets", "GET", "/search/tweets?q=" + quote(rng.choice(SEARCH_WORDS)), None
+    return "search users", "GET", "/search/users?q=" + quote(rng.choice(NAME_WORDS)), None
+
+
+async def client(host, port, count, users, write_ratio, seed, latencies, errors):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(count):
+            op, method, path, payload = next_request(rng, users, write_ratio)
+            start = time.perf_counter()
+            status, _body = await request(reader, writer, host, method, path, payload)
+            latencies.setdefault(op, []).append((time.perf_counter() - start) * 1000)
+            if status >= 500:
+                errors[op] = errors.get(op, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, clients, total, users, write_ratio):
+    latencies = {}
+    errors = {}
+    per_client = max(1, total // clients)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, per_client, users, write_ratio, seed, latencies, errors)
+        for seed in range(clients)
+    ))
+    return time.perf_counter() - start, latencies, errors
+
+
+def wait_for_port(host, port, process, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server.py exited during startup")
+        try:
+            socket.create_connection((host, port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server.py did not start listening")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def report(elapsed, latencies, errors):
+    total = sum(len(v) for v in latencies.values())
+    print(f"{'operation':<15} | {'requests':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'5xx':>5}")
+    print("-" * 56)
+    everything = []
+    for op in sorted(latencies):
+        values = sorted(latencies[op])
+        everything.extend(values)
+        print(f"{op:<15} | {len(values):>8} | {percentile(values, 0.5):>8.2f} | "
+              f"{percentile(values, 0.99):>8.2f} | {errors.get(op, 0):>5}")
+    everything.sort()
+    print("-" * 56)
+    print(f"{'all':<15} | {total:>8} | {percentile(everything, 0.5):>8.2f} | "
+          f"{percentile(everything, 0.99):>8.2f} | {sum(errors.values()):>5}")
+    print(f"throughput: {total / elapsed:,.0f} requests/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("database", nargs="?", default=DEFAULT_DB)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent keep-alive connections")
+    parser.add_argument("--requests", type=int, default=4000, help="total requests across all clients")
+    parser.add_argument("--workers", type=int, default=8, help="server database worker threads")
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--url", help="load an already running server instead of starting one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_filename = os.path.join(tmp, "load.db")
+        shutil.copyfile(args.database, db_filename)
+        conn = sqlite3.connect(db_filename)
+        users = [row[0] for row in conn.execute("SELECT usr FROM users")]
+        conn.close()
+
+        process = None
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            host, port = "127.0.0.1", free_port()
+            process = subprocess.Popen([
+                sys.executable, os.path.join(ROOT, "server.py"), db_filename,
+                "--host", host, "--port", str(port), "--workers", str(args.workers),
+            ], stdout=subprocess.DEVNULL)
+        try:
+            if process:
+                wait_for_port(host, port, process)
+            elapsed, latencies, errors = asyncio.run(
+                run_load(host, port, args.clients, args.requests, users, args.write_ratio))
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+
+    print(f"clients: {args.clients}, server workers: {args.workers}, write ratio: {args.write_ratio}")
+    report(elapsed, latencies, errors)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Time every data-access function at several data scales and write a JSON report.
+
+Usage: python benchmarks/run_benchmarks.py [--scales tiny,small] [--iterations N]
+                                           [--data-dir DIR] [--output FILE] [--compare OLD.json]
+
+Each scale's database is generated by datagen.py (seeded, so every run sees
+identical data). With --data-dir the databases are kept and reused, which
+matters for the medium and large scales. Each function runs --iterations
+times with arguments drawn from a seeded RNG. The report stores
+mean/p50/p95/p99 milliseconds per function and scale, plus the commit,
+Python, SQLite and settings it ran with.
+
+Write functions run inside a savepoint that is rolled back, so the data
+stays identical between functions and runs. Their timings therefore
+exclude the commit itself.
+
+--compare prints the p50 change against an earlier report. With
+TWITTER_QUERY_PROFILE=1 each scale also lists its top statements by total
+time (the timings then include the profiler's own overhead).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen  # noqa: E402
+import service  # noqa: E402
+import settings  # noqa: E402
+from connection_pool import get_pool  # noqa: E402
+from query_profiler import get_profile  # noqa: E402
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# ========================
+# Workload
+# ========================
+# Each benchmark is (name, writes, make_args, call). make_args(rng, ctx)
+# draws the arguments outside the timed region; call(conn, *args) is timed.
+
+def _feed_deep_cursor(conn, user):
+    # Cursor of the 4th page, so "feed page 5" measures a resumed keyset read
+    page = service.get_feed(conn, user)
+    for _ in range(3):
+        if page.next_cursor is None:
+            break
+        page = service.get_feed(conn, user, page.next_cursor)
+    return page.next_cursor
+
+
+BENCHMARKS = [
+    # Generated users hold legacy plaintext passwords, so this is a first login:
+    # the check plus the rehash and its UPDATE (rolled back like the other writes)
+    ("login", True,
+     lambda rng, ctx: (ctx.user(rng),),
+     lambda conn, usr: service.authenticate(conn, usr, f"pass{usr}")),
+    ("search_tweets keyword", False,
+     lambda rng, ctx: ([rng.choice(datagen.WORDS)],),
+     lambda conn, keywords: service.search_tweets(conn, keywords)),
+    ("search_tweets hashtag", False,
+     lambda rng, ctx: ([f"#tag{rng.randint(1, 50)}"],),
+     lambda conn, keywords: service.search_tweets(conn, keywords)),
+    ("search_tweets rank", False,
+     lambda rng, ctx: ([rng.choice(datagen.WORDS), rng.choice(datagen.WORDS)],),
+     lambda conn, keywords: service.search_tweets(conn, keywords, order_by="rank")),
+    ("search_users", False,
+     lambda rng, ctx: (rng.choice(datagen.FIRST_NAMES)[:3],),
+     lambda conn, keyword: service.search_users(conn, keyword)),
+    ("get_feed", False,
+     lambda rng, ctx: (ctx.user(rng),),
+     lambda conn, usr: service.get_feed(conn, usr)),
+    ("get_feed page 5", False,
+     lambda rng, ctx: ctx.deep_feed(rng),
+     lambda conn, usr, cursor: service.get_feed(conn, usr, cursor)),
+    ("get_user_profile", False,
+     lambda rng, ctx: (ctx.popular_user(rng), ctx.user(rng)),
+     lambda conn, usr, viewer: service.get_user_profile(conn, usr, viewer_id=viewer)),
+    ("get_user_profiles page", False,
+     lambda rng, ctx: ([ctx.user(rng) for _ in range(service.USER_PAGE_SIZE)], ctx.user(rng)),
+     lambda conn, users, viewer: service.get_user_profiles(conn, users, viewer_id=viewer)),
+    ("get_user_tweets", False,
+     lambda rng, ctx: (ctx.popular_user(rng),),
+     lambda conn, usr: service.get_user_tweets(conn, usr)),
+    ("list_followers", False,
+     lambda rng, ctx: (ctx.popular_user(rng),),
+     lambda conn, usr: service.list_followers(conn, usr)),
+    ("get_favorite_lists", False,
+     lambda rng, ctx: (ctx.user(rng),),
+     lambda conn, usr: service.get_favorite_lists(conn, usr)),
+    ("get_tweet_details", False,
+     lambda rng, ctx: (ctx.tweet(rng),),
+     lambda conn, tid: service.get_tweet_details(conn, tid)),
+    ("post_tweet", True,
+     lambda rng, ctx: (ctx.user(rng), f"benchmark {rng.choice(datagen.WORDS)} #tag{rng.randint(1, 50)}"),
+     lambda conn, usr, text: service.post_tweet(conn, usr, text)),
+    ("retweet", True,
+     lambda rng, ctx: (ctx.user(rng), ctx.tweet(rng)),
+     lambda conn, usr, tid: service.retweet(conn, usr, tid)),
+    ("follow", True,
+     lambda rng, ctx: (ctx.user(rng), ctx.popular_user(rng)),
+     lambda conn, flwer, flwee: service.follow(conn, flwer, flwee)),
+    ("add_to_list", True,
+     lambda rng, ctx: ctx.list_entry(rng),
+     lambda conn, usr, lname, tid: service.add_to_list(conn, usr, lname, tid)),
+]
+
+
+class Context:
+    """
+    Argument sources for one database.
+    """
+
+    def __init__(self, pool, users, tweets):
+        self.pool = pool
+        self.users = users
+        self.tweets = tweets
+        with pool.connection() as conn:
+            self.lists = conn.execute("SELECT owner_id, lname FROM lists LIMIT 10000").fetchall()
+
+    def user(self, rng):
+        return rng.randint(1, self.users)
+
+    def popular_user(self, rng):
+        # Profiles and follower lists are mostly opened for well-followed accounts
+        return datagen.Zipf(self.users, 1.1, rng).draw()
+
+    def tweet(self, rng):
+        return rng.randint(1, self.tweets)
+
+    def deep_feed(self, rng):
+        usr = self.user(rng)
+        with self.pool.connection() as conn:
+            return usr, _feed_deep_cursor(conn, usr)
+
+    def list_entry(self, rng):
+        owner, lname = rng.choice(self.lists) if self.lists else (1, "Favorites")
+        return owner, lname, self.tweet(rng)
+
+
+def time_function(pool, ctx, writes, make_args, call, iterations, rng):
+    """
+    Return (sorted latencies in ms, error count).
+    """
+    latencies = []
+    errors = 0
+    # The first runs warm the page cache and statement cache and are not recorded
+    warmup = max(1, iterations // 10)
+    for i in range(warmup + iterations):
+        args = make_args(rng, ctx)
+        with pool.connection() as conn:
+            if writes:
+                conn.execute("SAVEPOINT bench")
+            start = time.perf_counter()
+            try:
+                call(conn, *args)
+                failed = False
+            except service.ServiceError:
+                failed = True
+            elapsed = (time.perf_counter() - start) * 1000
+            if writes:
+                conn.execute("ROLLBACK TO bench")
+                conn.execute("RELEASE bench")
+        if i >= warmup:
+            latencies.append(elapsed)
+            errors += failed
+    latencies.sort()
+    return latencies, errors
+
+
+def run_scale(db_filename, iterations, seed):
+    pool = get_pool(db_filename)
+    with pool.connection() as conn:
+        rows = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("users", "follows", "tweets", "retweets", "hashtag_mentions", "lists", "include")}
+        max_tid = conn.execute("SELECT MAX(tid) FROM tweets").fetchone()[0]
+    ctx = Context(pool, rows["users"], max_tid)
+
+    results = {}
+    for name, writes, make_args, call in BENCHMARKS:
+        rng = random.Random(f"{seed}:{name}")
+        latencies, errors = time_function(pool, ctx, writes, make_args, call, iterations, rng)
+        results[name] = {
+            "iterations": len(latencies),
+            "errors": errors,
+            "mean_ms": round(sum(latencies) / len(latencies), 4),
+            "p50_ms": round(_percentile(latencies, 0.5), 4),
+            "p95_ms": round(_percentile(latencies, 0.95), 4),
+            "p99_ms": round(_percentile(latencies, 0.99), 4),
+        }
+        print(f"  {name:<24} p50 {results[name]['p50_ms']:>9.3f} ms   p99 {results[name]['p99_ms']:>9.3f} ms")
+    return {"rows": rows, "functions": results}
+
+
+def database_for(scale, seed, data_dir):
+    """
+    Return the path of the scale's database, generating it if needed.
+    """
+    db_filename = os.path.join(data_dir, f"{scale}-seed{seed}.db")
+    if not os.path.exists(db_filename):
+        users, tweets = datagen.SCALES[scale]
+        print(f"Generating {scale} ({users:,} users, {tweets:,} tweets)...")
+        datagen.generate(db_filename, users, tweets, seed, log=lambda message: None)
+    else:
+        # Bring a kept database up to the current schema
+        import MiniProject
+        argv, sys.argv = sys.argv, [sys.argv[0], db_filename]
+        try:
+            MiniProject.Set_Database()
+        finally:
+            sys.argv = argv
+    return db_filename
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "settings": {
+            "FEED_MODE": settings.FEED_MODE,
+            "SEARCH_BACKEND": settings.SEARCH_BACKEND,
+            "DB_JOURNAL_MODE": settings.DB_JOURNAL_MODE,
+            "TWEET_ID_BLOCK_SIZE": settings.TWEET_ID_BLOCK_SIZE,
+            "CACHE_PROFILE_ENTRIES": settings.CACHE_PROFILE_ENTRIES,
+            "CACHE_TWEET_STATS_ENTRIES": settings.CACHE_TWEET_STATS_ENTRIES,
+            "CACHE_TTL_SECONDS": settings.CACHE_TTL_SECONDS,
+            "PASSWORD_SCHEME": settings.PASSWORD_SCHEME,
+            "PASSWORD_SCRYPT_N": settings.PASSWORD_SCRYPT_N,
+            "PASSWORD_PBKDF2_ITERATIONS": settings.PASSWORD_PBKDF2_ITERATIONS,
+        },
+    }
+
+
+def compare(old_report, new_report):
+    print(f"\n{'scale':<8} | {'function':<24} | {'old p50':>9} | {'new p50':>9} | {'change':>7}")
+    print("-" * 70)
+    for scale, new in new_report["scales"].items():
+        old = old_report.get("scales", {}).get(scale)
+        if not old:
+            continue
+        for name, stats in new["functions"].items():
+            before = old["functions"].get(name)
+            if not before or not before["p50_ms"]:
+                continue
+            change = (stats["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+            print(f"{scale:<8} | {name:<24} | {before['p50_ms']:>9.3f} | {stats['p50_ms']:>9.3f} | {change:>+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", default="tiny,small", help=f"comma-separated, from {', '.join(datagen.SCALES)}")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="keep generated databases here and reuse them")
+    parser.add_argument("--output", default="benchmark-report.json")
+    parser.add_argument("--compare", help="earlier report to diff p50 against")
+    args = parser.parse_args()
+
+    scales = [scale.strip() for scale in args.scales.split(",") if scale.strip()]
+    unknown = [scale for scale in scales if scale not in datagen.SCALES]
+    if unknown:
+        parser.error(f"unknown scale(s): {', '.join(unknown)}")
+
+    report = {"meta": metadata(), "iterations": args.iterations, "seed": args.seed, "scales": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        for scale in scales:
+            db_filename = database_for(scale, args.seed, data_dir)
+            print(f"Scale {scale}:")
+            report["scales"][scale] = run_scale(db_filename, args.iterations, args.seed)
+            if settings.QUERY_PROFILE:
+                # Per-statement totals for this scale, to see which query a regression came from
+                report["scales"][scale]["statements"] = get_profile().summary(top=settings.QUERY_PROFILE_TOP)
+                get_profile().reset()
+            get_pool(db_filename).close_all()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
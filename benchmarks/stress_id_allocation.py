@@ -0,0 +1,100 @@
+"""
+Stress test for tweet id allocation under multi-process write load.
+
+Usage: python benchmarks/stress_id_allocation.py [--procs P] [--posts N] [--block B] [--legacy]
+
+Each process posts N tweets (tweet row plus one hashtag row) into a fresh
+database. The run passes when every post succeeded and every tid is unique.
+--legacy uses the old SELECT MAX(tid) + 1 allocation for comparison.
+Exits with status 1 on any failed or duplicate insert.
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings  # noqa: E402
+from connection_pool import ConnectionPool  # noqa: E402
+from id_allocator import allocate_id  # noqa: E402
+
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db_schema_W25.sql")
+
+
+def legacy_allocate(conn):
+    return (conn.execute("SELECT MAX(tid) FROM tweets").fetchone()[0] or 0) + 1
+
+
+def poster(db_filename, worker, posts, block, legacy):
+    """
+    Post `posts` tweets as user `worker`; return the number of failed posts.
+    """
+    settings.TWEET_ID_BLOCK_SIZE = block
+    pool = ConnectionPool(db_filename)
+    failures = 0
+    for i in range(posts):
+        try:
+            with pool.connection() as conn:
+                tid = legacy_allocate(conn) if legacy else allocate_id(conn, "tweets")
+                conn.execute('''
+                    INSERT INTO tweets (tid, writer_id, text, tdate, ttime)
+                    VALUES (?, ?, ?, DATE('now'), TIME('now'))
+                ''', (tid, worker, f"post {i} #w{worker}"))
+                conn.execute("INSERT INTO hashtag_mentions (tid, term) VALUES (?, ?)", (tid, f"#w{worker}"))
+        except sqlite3.Error:
+            failures += 1
+    pool.close_all()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--procs", type=int, default=8)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--block", type=int, default=1, help="tweet ids reserved per round trip")
+    parser.add_argument("--legacy", action="store_true", help="use SELECT MAX(tid) + 1")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_filename = os.path.join(tmp, "stress.db")
+        conn = sqlite3.connect(db_filename)
+        with open(SCHEMA_FILE) as f:
+            conn.executescript(f.read())
+        conn.executemany("INSERT INTO users (usr, name) VALUES (?, ?)",
+                         [(w, f"poster{w}") for w in range(1, args.procs + 1)])
+        conn.commit()
+        conn.close()
+
+        # Run migrations (id_sequences, WAL) once before the workers start
+        import MiniProject
+        sys.argv = [sys.argv[0], db_filename]
+        MiniProject.Set_Database()
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.procs) as workers:
+            failures = sum(workers.starmap(poster, [
+                (db_filename, w, args.posts, args.block, args.legacy) for w in range(1, args.procs + 1)
+            ]))
+        elapsed = time.perf_counter() - start
+
+        conn = sqlite3.connect(db_filename)
+        rows, distinct = conn.execute("SELECT COUNT(*), COUNT(DISTINCT tid) FROM tweets").fetchone()
+        conn.close()
+
+    expected = args.procs * args.posts
+    print(f"mode: {'legacy MAX+1' if args.legacy else f'sequence, block {args.block}'}")
+    print(f"posts attempted: {expected}, stored: {rows}, distinct tids: {distinct}, failed: {failures}")
+    print(f"throughput: {rows / elapsed:,.0f} posts/sec")
+    if failures or rows != expected or distinct != rows:
+        print("FAIL")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
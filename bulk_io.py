@@ -0,0 +1,459 @@
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import settings
+from feed import rebuild_timelines, timelines_built
+from recommend import mark_all_stale
+from stats import reconcile_stats
+from trending import rebuild_trending
+from tweet_search import fts_available, rebuild_hashtag_dictionary
+
+
+# ========================
+# Bulk Import / Export
+# ========================
+# Moves the seven base tables in and out of a database as CSV (with a
+# header row) or NDJSON (one JSON object per line), one file per table,
+# named <table>.csv or <table>.ndjson.
+#
+# Import streams each file through executemany, BULK_COMMIT_ROWS rows per
+# transaction, with foreign keys off. Before the first row it drops the
+# secondary indexes and triggers of the tables being loaded, so each row
+# costs one primary-key insert. The finish step then, in one transaction:
+# - recreates the indexes, each built in one sorted pass
+# - recomputes what the triggers would have maintained: the counters, the
+#   hashtag dictionary and trending counts, the search index and, in fanout
+#   mode, the timelines; recommendations are marked stale for recommend.py
+# - recreates the triggers
+# - runs PRAGMA foreign_key_check on the loaded tables and reports violations
+#
+# The dropped definitions are saved in bulk_load_pending in the same
+# transaction that drops them. If an import dies halfway, the next import
+# (or `python bulk_io.py <database> finish`) runs the finish step first.
+# Run imports while the app is stopped: app writes made during the load
+# would skip the triggers. The finish step repairs the counters, but not
+# timeline entries or caches.
+#
+# CSV has no NULL, so an empty field imports as NULL and NULL exports as an
+# empty field. Passwords load as they are; plaintext ones are hashed on the
+# user's next login (see passwords.py).
+#
+# Export reads every table in one read transaction, a consistent snapshot
+# that does not block writers in WAL mode, and writes rows as the cursor
+# yields them.
+
+# Load order: parents before children
+TABLES = ["users", "follows", "lists", "tweets", "include", "retweets", "hashtag_mentions"]
+
+FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+ON_CONFLICT = {"abort": "INSERT", "ignore": "INSERT OR IGNORE", "replace": "INSERT OR REPLACE"}
+
+PENDING_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS bulk_load_pending (
+        type TEXT NOT NULL,
+        name TEXT NOT NULL,
+        sql TEXT,
+        PRIMARY KEY (type, name)
+    )
+'''
+
+
+class BulkError(Exception):
+    """
+    An input file does not match the table it is loaded into.
+    """
+
+
+def bulk_connection(db_filename):
+    """
+    Open a connection for loading: foreign keys off and a large page cache.
+    """
+    # Autocommit mode: transactions are opened and committed explicitly
+    conn = sqlite3.connect(db_filename, timeout=settings.DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute(f"PRAGMA busy_timeout = {int(settings.DB_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA cache_size = {-1024 * settings.BULK_CACHE_MB}")
+    if conn.execute("PRAGMA journal_mode").fetchone()[0].upper() == "WAL":
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def source_format(path):
+    """
+    Return "csv" or "ndjson" from a file's extension.
+    """
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise BulkError(f"{path}: unknown format, expected one of {', '.join(FORMATS)}")
+    return fmt
+
+
+def find_sources(paths, table=None):
+    """
+    Resolve import paths to (table, path, format), in load order.
+    A directory contributes its <table>.<ext> files; a file's table comes
+    from its name unless table is given ("-" reads stdin and needs table).
+    """
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                stem, ext = os.path.splitext(name)
+                if stem in TABLES and ext.lower() in FORMATS:
+                    sources.append((stem, os.path.join(path, name), FORMATS[ext.lower()]))
+            continue
+        name = table or os.path.splitext(os.path.basename(path))[0]
+        if name not in TABLES:
+            raise BulkError(f"{path}: not one of the tables {', '.join(TABLES)}")
+        if path == "-" and table is None:
+            raise BulkError("reading stdin needs --table")
+        sources.append((name, path, "csv" if path == "-" else source_format(path)))
+    sources.sort(key=lambda source: TABLES.index(source[0]))
+    return sources
+
+
+# ========================
+# Readers
+# ========================
+# Each reader yields value tuples in the table's column order, so
+# executemany consumes the file as it is read.
+
+def _read_csv(f, path, columns):
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    unknown = [name for name in header if name not in columns]
+    if unknown:
+        raise BulkError(f"{path}: unknown column(s) {', '.join(unknown)}")
+    positions = [header.index(name) if name in header else None for name in columns]
+    for values in reader:
+        if len(values) != len(header):
+            raise BulkError(f"{path}:{reader.line_num}: expected {len(header)} fields, got {len(values)}")
+        yield tuple((values[i] or None) if i is not None else None for i in positions)
+
+
+def _read_ndjson(f, path, columns):
+    known = set(columns)
+    for line_num, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise BulkError(f"{path}:{line_num}: {e}") from None
+        if not isinstance(record, dict):
+            raise BulkError(f"{path}:{line_num}: expected a JSON object")
+        unknown = record.keys() - known
+        if unknown:
+            raise BulkError(f"{path}:{line_num}: unknown column(s) {', '.join(sorted(unknown))}")
+        yield tuple(record.get(name) for name in columns)
+
+
+def _open_source(path):
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+# ========================
+# Deferred Indexes and Triggers
+# ========================
+
+def defer_schema(conn, tables):
+    """
+    Drop the secondary indexes and triggers of tables, saving their SQL in
+    bulk_load_pending, together with the tables themselves.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(PENDING_SCHEMA)
+        placeholders = ", ".join("?" * len(tables))
+        objects = conn.execute(f'''
+            SELECT type, name, sql FROM sqlite_master
+            WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+        ''', tables).fetchall()
+        for kind, name, sql in objects:
+            conn.execute("INSERT OR IGNORE INTO bulk_load_pending (type, name, sql) VALUES (?, ?, ?)",
+                         (kind, name, sql))
+            conn.execute(f'DROP {kind.upper()} "{name}"')
+        conn.executemany("INSERT OR IGNORE INTO bulk_load_pending (type, name) VALUES ('table', ?)",
+                         [(table,) for table in tables])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _pending(conn):
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'bulk_load_pending'").fetchone():
+        return []
+    return conn.execute("SELECT type, name, sql FROM bulk_load_pending").fetchall()
+
+
+def finish_load(conn, log=print):
+    """
+    Rebuild what an interrupted or completed import deferred (see above).
+    Returns {table: foreign key violations} for the loaded tables that have any.
+    """
+    pending = _pending(conn)
+    if not pending:
+        return {}
+    loaded = {name for kind, name, _sql in pending if kind == "table"}
+
+    def step(label, fn, *args):
+        start = time.perf_counter()
+        fn(*args)
+        log(f"{label}: {time.perf_counter() - start:.2f}s")
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        step("indexes", _run_pending, conn, pending, "index")
+        if loaded & {"tweets", "retweets", "follows"}:
+            step("counters", reconcile_stats, conn)
+        if "hashtag_mentions" in loaded:
+            step("hashtag dictionary", rebuild_hashtag_dictionary, conn)
+        if loaded & {"tweets", "hashtag_mentions"}:
+            step("trending counts", rebuild_trending, conn)
+        if "tweets" in loaded and fts_available(conn):
+            step("search index", conn.execute, "INSERT INTO tweets_fts (tweets_fts) VALUES ('rebuild')")
+        if loaded & {"tweets", "retweets", "follows"} and timelines_built(conn):
+            step("timelines", rebuild_timelines, conn)
+        if loaded & {"users", "follows"}:
+            step("recommendations marked stale", mark_all_stale, conn)
+        _run_pending(conn, pending, "trigger")
+        conn.execute("DROP TABLE bulk_load_pending")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    violations = {}
+    for table in sorted(loaded, key=TABLES.index):
+        count = sum(1 for _row in conn.execute(f"PRAGMA foreign_key_check({table})"))
+        if count:
+            violations[table] = count
+    return violations
+
+
+def _run_pending(conn, pending, kind):
+    for pending_kind, name, sql in pending:
+        if pending_kind == kind:
+            # Set_Database may have recreated it since (ensure_timeline's trigger, for one)
+            conn.execute(f'DROP {kind.upper()} IF EXISTS "{name}"')
+            conn.execute(sql)
+
+
+# ========================
+# Import
+# ========================
+
+def _load(conn, table, rows, on_conflict):
+    """
+    Insert rows (value tuples in column order) BULK_COMMIT_ROWS per transaction.
+    Returns (rows read, rows inserted).
+    """
+    columns = table_columns(conn, table)
+    sql = (f"{ON_CONFLICT[on_conflict]} INTO {table} ({', '.join(columns)}) "
+           f"VALUES ({', '.join('?' * len(columns))})")
+    per_commit = max(1, settings.BULK_COMMIT_ROWS)
+    read = inserted = 0
+    rows = iter(rows)
+    while True:
+        # executemany does not report how many parameter rows it consumed
+        taken = [0]
+
+        def chunk():
+            for row in itertools.islice(rows, per_commit):
+                taken[0] += 1
+                yield row
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.executemany(sql, chunk())
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        read += taken[0]
+        inserted += max(cursor.rowcount, 0)
+        if taken[0] < per_commit:
+            return read, inserted
+
+
+def import_tables(db_filename, sources, on_conflict="abort", log=print):
+    """
+    Load (table, path, format) sources, as returned by find_sources.
+    Returns ({table: (rows read, rows inserted)}, {table: foreign key violations}).
+    """
+    conn = bulk_connection(db_filename)
+    try:
+        if _pending(conn):
+            log("finishing an earlier import")
+            finish_load(conn, log)
+
+        tables = sorted({table for table, _path, _fmt in sources}, key=TABLES.index)
+        counts = {}
+        defer_schema(conn, tables)
+        try:
+            for table, path, fmt in sources:
+                columns = table_columns(conn, table)
+                start = time.perf_counter()
+                with _open_source(path) as f:
+                    reader = _read_csv if fmt == "csv" else _read_ndjson
+                    read, inserted = _load(conn, table, reader(f, path, columns), on_conflict)
+                elapsed = time.perf_counter() - start
+                before = counts.get(table, (0, 0))
+                counts[table] = (before[0] + read, before[1] + inserted)
+                log(f"{table}: {read:,} rows ({inserted:,} inserted) in {elapsed:.2f}s, "
+                    f"{read / elapsed if elapsed else 0:,.0f} rows/s")
+        finally:
+            violations = finish_load(conn, log)
+        return counts, violations
+    finally:
+        conn.close()
+
+
+# ========================
+# Export
+# ========================
+
+def _write_csv(f, columns, rows):
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _write_ndjson(f, columns, rows):
+    count = 0
+    for row in rows:
+        f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def export_tables(db_filename, out, tables=None, fmt="csv", log=print):
+    """
+    Write tables to <out>/<table>.<fmt>, or a single table to stdout when out is "-".
+    Returns {table: rows written}.
+    """
+    tables = tables or TABLES
+    if out == "-" and len(tables) != 1:
+        raise BulkError("writing to stdout needs exactly one --table")
+    writer = _write_csv if fmt == "csv" else _write_ndjson
+    conn = bulk_connection(db_filename)
+    counts = {}
+    try:
+        # One read transaction: every table comes from the same snapshot
+        conn.execute("BEGIN")
+        for table in tables:
+            columns = table_columns(conn, table)
+            rows = conn.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            start = time.perf_counter()
+            if out == "-":
+                f = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="")
+                counts[table] = writer(f, columns, rows)
+                f.flush()
+                f.detach()
+            else:
+                with open(os.path.join(out, f"{table}.{fmt}"), "w", encoding="utf-8", newline="") as f:
+                    counts[table] = writer(f, columns, rows)
+            elapsed = time.perf_counter() - start
+            log(f"{table}: {counts[table]:,} rows in {elapsed:.2f}s, "
+                f"{counts[table] / elapsed if elapsed else 0:,.0f} rows/s")
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return counts
+
+
+# ========================
+# Command Line
+# ========================
+# Usage: python bulk_io.py <database> import <file or directory>... [--table T] [--on-conflict abort|ignore|replace]
+#        python bulk_io.py <database> export <directory or -> [--table T]... [--format csv|ndjson]
+#        python bulk_io.py <database> finish
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import and export of the base tables.")
+    parser.add_argument("database")
+    parser.add_argument("command", choices=["import", "export", "finish"])
+    parser.add_argument("paths", nargs="*", help="import: files or directories; export: a directory or -")
+    parser.add_argument("--table", action="append", choices=TABLES,
+                        help="import: the table of every file; export: a table to write (repeatable)")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv", help="export format")
+    parser.add_argument("--on-conflict", choices=sorted(ON_CONFLICT), default="abort",
+                        help="what to do with rows whose key already exists")
+    args = parser.parse_args()
+
+    # Progress goes to stderr so an export to stdout stays clean
+    def log(message):
+        print(message, file=sys.stderr)
+
+    # Set_Database creates the tables (and the feed/search objects) and migrates
+    import MiniProject
+    MiniProject.Set_Database()
+    from connection_pool import close_all_pools
+    close_all_pools()
+
+    try:
+        if args.command == "import":
+            if not args.paths:
+                parser.error("import needs at least one file or directory")
+            if args.table and len(args.table) > 1:
+                parser.error("import takes at most one --table")
+            sources = find_sources(args.paths, args.table[0] if args.table else None)
+            if not sources:
+                parser.error("no <table>.csv or <table>.ndjson files found")
+            start = time.perf_counter()
+            counts, violations = import_tables(args.database, sources, args.on_conflict, log)
+            elapsed = time.perf_counter() - start
+            total = sum(read for read, _inserted in counts.values())
+            log(f"Imported {total:,} rows in {elapsed:.2f}s, {total / elapsed if elapsed else 0:,.0f} rows/s overall.")
+        elif args.command == "export":
+            if len(args.paths) != 1:
+                parser.error("export needs one directory, or - for stdout")
+            if args.paths[0] != "-":
+                os.makedirs(args.paths[0], exist_ok=True)
+            start = time.perf_counter()
+            counts = export_tables(args.database, args.paths[0], args.table, args.format, log)
+            elapsed = time.perf_counter() - start
+            total = sum(counts.values())
+            log(f"Exported {total:,} rows in {elapsed:.2f}s, {total / elapsed if elapsed else 0:,.0f} rows/s overall.")
+            violations = {}
+        else:
+            conn = bulk_connection(args.database)
+            try:
+                violations = finish_load(conn, log)
+            finally:
+                conn.close()
+    except (BulkError, sqlite3.DatabaseError) as e:
+        log(f"Error: {e}")
+        sys.exit(1)
+
+    if violations:
+        log("Foreign key violations (rows were kept):")
+        for table, count in violations.items():
+            log(f"- {table}: {count:,} row(s)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+
+import settings
+
+
+# ========================
+# Read-Model Cache
+# ========================
+# A bounded in-process cache for small read models (profiles, tweet counts).
+# Entries are evicted least-recently-used first once the cache is full, and
+# expire TTL seconds after they were loaded. The write paths invalidate the
+# keys they change. Other processes writing to the same database are only
+# seen once their entries expire, so the TTL bounds staleness across processes.
+
+_MISSING = object()
+
+
+class LRUTTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ttl_seconds.
+    max_entries = 0 disables caching (every lookup is a miss).
+    """
+
+    def __init__(self, name, max_entries, ttl_seconds, clock=time.monotonic):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value, version=None):
+        """
+        Store a value. With the version returned by version(key) before loading,
+        the value is dropped if the key was invalidated while it was being loaded.
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if version is not None and self._versions.get(key, 0) != version:
+                return
+            self._entries[key] = (value, self._clock() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def version(self, key):
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, or call loader() and cache its result.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            version = self.version(key)
+            value = loader()
+            self.put(key, value, version)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            # Versions only need to outlive loads in flight; drop them with the cache
+            if self.max_entries > 0:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                if len(self._versions) > 4 * self.max_entries:
+                    self._versions.clear()
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# User profiles without the viewer-specific is_following flag, keyed by usr
+profile_cache = LRUTTLCache("profiles", settings.CACHE_PROFILE_ENTRIES, settings.CACHE_TTL_SECONDS)
+
+# (replies, retweets) keyed by tid
+tweet_stats_cache = LRUTTLCache("tweet_stats", settings.CACHE_TWEET_STATS_ENTRIES, settings.CACHE_TTL_SECONDS)
+
+# HMAC tokens of recently verified passwords keyed by the stored hash (see passwords.py)
+login_cache = LRUTTLCache("logins", settings.LOGIN_CACHE_ENTRIES, settings.CACHE_TTL_SECONDS)
+
+CACHES = [profile_cache, tweet_stats_cache, login_cache]
+
+
+def cache_stats():
+    """
+    Return hit/miss counters for every cache, for monitoring.
+    """
+    return [cache.stats() for cache in CACHES]
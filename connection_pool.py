@@ -0,0 +1,211 @@
+import sqlite3
+import sys
+import threading
+import traceback
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+import settings
+from query_profiler import ProfilingConnection
+
+
+# ========================
+# Connection Pool
+# ========================
+
+class ConnectionPool:
+    """
+    Hand out one reusable sqlite3 connection per thread for a database file.
+    PRAGMAs are applied when a connection is first opened instead of on every use.
+    With read_only the file is opened with mode=ro (replica snapshots, see replicas.py).
+    Without foreign_keys their enforcement is off (shards, whose references cross files; see sharding.py).
+    """
+
+    def __init__(self, db_filename, busy_timeout_ms=None, journal_mode=None, read_only=False, foreign_keys=True):
+        self.db_filename = db_filename
+        self.read_only = read_only
+        self.foreign_keys = foreign_keys
+        self.busy_timeout_ms = settings.DB_BUSY_TIMEOUT_MS if busy_timeout_ms is None else busy_timeout_ms
+        self.journal_mode = settings.DB_JOURNAL_MODE if journal_mode is None else journal_mode
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._journal_mode_set = False
+
+    def _open(self):
+        """
+        Open a new connection and apply the per-connection PRAGMAs.
+        """
+        conn = sqlite3.connect(
+            f"file:{pathname2url(self.db_filename)}?mode=ro" if self.read_only else self.db_filename,
+            uri=self.read_only,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            # Search and the feed run a fixed set of statements, so they all stay prepared
+            cached_statements=settings.STATEMENT_CACHE_SIZE,
+            # Times every statement for the slow query log (TWITTER_QUERY_PROFILE=1)
+            factory=ProfilingConnection if settings.QUERY_PROFILE else sqlite3.Connection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA foreign_keys = {'ON' if self.foreign_keys else 'OFF'}")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+
+        # The journal mode is stored in the database file, so it only needs to be set once
+        with self._lock:
+            if not self._journal_mode_set and not self.read_only:
+                conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+                self._journal_mode_set = True
+            self._connections.append(conn)
+
+        if self.journal_mode == "WAL":
+            conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def get(self):
+        """
+        Return the calling thread's connection, opening it on first use.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def connection(self, immediate=False, callbacks=None):
+        """
+        Yield the calling thread's connection.
+        The outermost block commits on success and rolls back on error; nested blocks
+        (for example compose_tweet called from show_tweet_details) share its transaction.
+        Callbacks registered with after_commit() run once the outermost block ends,
+        or are appended to `callbacks` for a caller that runs them itself later
+        (with run_callbacks). A failing callback is logged and does not fail the block.
+        With immediate, a block that is not yet in a transaction takes the write lock
+        up front (BEGIN IMMEDIATE).
+        """
+        conn = self.get()
+        outermost = self._local.depth == 0
+        if outermost:
+            self._local.after_commit = []
+            _open_blocks().append(self)
+        self._local.depth += 1
+        try:
+            if immediate and not conn.in_transaction:
+                # A transaction that reads before it writes would otherwise fail
+                # with "database is locked" when another process commits in between,
+                # without waiting on busy_timeout. Waiting for the lock first avoids that.
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+        except BaseException:
+            if outermost and conn.in_transaction:
+                conn.rollback()
+            raise
+        else:
+            if outermost and conn.in_transaction:
+                conn.commit()
+        finally:
+            self._local.depth -= 1
+            if outermost:
+                _open_blocks().remove(self)
+                registered, self._local.after_commit = self._local.after_commit, []
+                if callbacks is not None:
+                    callbacks.extend(registered)
+                else:
+                    run_callbacks(registered)
+
+    @contextmanager
+    def savepoint(self, conn, name="sp"):
+        """
+        Run a block inside a savepoint of the current connection() block.
+        If the block raises, the savepoint is rolled back and the after_commit()
+        callbacks registered inside it are dropped.
+        """
+        registered = self._local.after_commit
+        mark = len(registered)
+        conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            del registered[mark:]
+            raise
+        conn.execute(f"RELEASE {name}")
+
+    def close_all(self):
+        """
+        Close every connection the pool has opened, across all threads.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+# Pools with an open connection() block, per thread
+_active = threading.local()
+
+
+def _open_blocks():
+    blocks = getattr(_active, "pools", None)
+    if blocks is None:
+        blocks = _active.pools = []
+    return blocks
+
+
+def run_callbacks(callbacks):
+    """
+    Run after_commit() callbacks in order; one that raises is logged to stderr
+    and the rest still run, since the transaction is already over.
+    """
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            print("after_commit callback failed:", file=sys.stderr)
+            traceback.print_exc()
+
+
+def after_commit(conn, callback):
+    """
+    Run callback when the pooled transaction conn is in ends (committed or rolled back),
+    or right away if conn is not inside a pool.connection() block on this thread.
+    Used to invalidate caches only once other threads can see the new rows.
+    """
+    for pool in reversed(_open_blocks()):
+        if getattr(pool._local, "conn", None) is conn:
+            pool._local.after_commit.append(callback)
+            return
+    callback()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_filename):
+    """
+    Return the shared pool for a database file, creating it on first use.
+    """
+    with _pools_lock:
+        pool = _pools.get(db_filename)
+        if pool is None:
+            pool = ConnectionPool(db_filename)
+            _pools[db_filename] = pool
+        return pool
+
+
+def close_all_pools():
+    """
+    Close every pooled connection; called when the program exits.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
@@ -0,0 +1,83 @@
+# ========================
+# Conversation Trees
+# ========================
+# A tweet's conversation is the chain of tweets it replies to (its ancestors,
+# up to the root) followed by the tree of replies below it. fetch_thread
+# reads all of it with one recursive query:
+# - `up` follows replyto_tid from the tweet towards the root, at most
+#   THREAD_MAX_ANCESTORS steps.
+# - `down` walks the replies depth-first. Each row carries a path of sort
+#   keys from the tweet down to it, and ORDER BY path makes SQLite take
+#   rows off the recursion queue in pre-order, so the LIMIT keeps the first
+#   THREAD_MAX_NODES nodes in display order.
+# The outer query sorts the result by (ancestor depth, path): the ancestors
+# root first, then the tweet (path '') and its replies in pre-order. That is
+# at most THREAD_MAX_ANCESTORS + THREAD_MAX_NODES rows.
+# Each node lists at most THREAD_MAX_WIDTH replies (the earliest), through a
+# LIMIT subquery on idx_tweets_reply_order, and the walk stops
+# THREAD_MAX_DEPTH levels below the tweet. The limits also end the walk if
+# replyto_tid ever forms a cycle.
+
+THREAD_MAX_ANCESTORS = 50
+THREAD_MAX_DEPTH = 8
+THREAD_MAX_WIDTH = 10
+THREAD_MAX_NODES = 200
+
+# idx_tweets_reply_order (replies of a tweet in display order; also serves reply
+# counts) is created by migration 5 (migrations.py).
+
+_THREAD_QUERY = '''
+    WITH RECURSIVE
+        up (tid, replyto_tid, depth) AS (
+            SELECT tid, replyto_tid, 0 FROM tweets WHERE tid = :tid
+            UNION ALL
+            SELECT t.tid, t.replyto_tid, up.depth - 1
+            FROM up
+            CROSS JOIN tweets t ON t.tid = up.replyto_tid
+            WHERE up.depth > -:max_ancestors
+        ),
+        down (tid, depth, path) AS (
+            SELECT tid, 0, '' FROM tweets WHERE tid = :tid
+            UNION ALL
+            SELECT c.tid, down.depth + 1,
+                   down.path || printf('%s %s %012d/', c.tdate, COALESCE(c.ttime, ''), c.tid)
+            FROM down
+            CROSS JOIN tweets c ON c.tid IN (
+                SELECT tid FROM tweets
+                WHERE replyto_tid = down.tid
+                ORDER BY tdate, ttime, tid
+                LIMIT :max_width
+            )
+            WHERE down.depth < :max_depth
+            ORDER BY 3
+            LIMIT :max_nodes
+        ),
+        nodes (tid, depth, ancestor_depth, path) AS (
+            SELECT tid, depth, depth, '' FROM up WHERE depth < 0
+            UNION ALL
+            SELECT tid, depth, 0, path FROM down
+        )
+    SELECT nodes.depth, t.tid, t.writer_id, t.tdate, t.ttime, t.text, COALESCE(s.replies, 0) AS replies
+    FROM nodes
+    CROSS JOIN tweets t ON t.tid = nodes.tid
+    LEFT JOIN tweet_stats s ON s.tid = nodes.tid
+    ORDER BY nodes.ancestor_depth, nodes.path
+'''
+
+
+def fetch_thread(conn, tid, max_depth=THREAD_MAX_DEPTH, max_width=THREAD_MAX_WIDTH,
+                 max_nodes=THREAD_MAX_NODES, max_ancestors=THREAD_MAX_ANCESTORS):
+    """
+    Return a cursor over the conversation of tid in display order: ancestors
+    from the root down (negative depth), then tid itself (depth 0), then its
+    replies depth-first (positive depth). Each row has depth, the tweet
+    columns and `replies`, the node's full reply count, which can exceed
+    the replies listed under it. Iterate the cursor to stream the rows.
+    """
+    return conn.execute(_THREAD_QUERY, {
+        "tid": tid,
+        "max_depth": max_depth,
+        "max_width": max_width,
+        "max_nodes": max_nodes,
+        "max_ancestors": max_ancestors,
+    })
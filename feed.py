@@ -0,0 +1,482 @@
+import sys
+
+import settings
+
+
+# ========================
+# Home Feed
+# ========================
+# The feed is every tweet and non-spam retweet from users the viewer follows,
+# newest first. Pages are read by keyset: each page remembers the sort key of
+# its last row, and the next page starts strictly after it. No COUNT(*) and
+# no OFFSET, so page 100 costs the same as page 1.
+#
+# Sort key, all descending: (date, time, tid, retweeter). Retweets have no
+# time, which sorts as '' (after every tweet of the same day, as before), and
+# tweets use retweeter -1 so a tweet and its retweets never share a key.
+# A missing date sorts as '' too, so those rows come last and can be paged
+# to like any other; the timeline stores the same keys.
+
+FEED_PAGE_SIZE = 5
+
+_TWEETS_BRANCH = '''
+    SELECT 'tweet' AS type, t.tid, t.tdate, t.ttime, 0 AS spam,
+           COALESCE(t.tdate, '') AS sort_date, COALESCE(t.ttime, '') AS sort_time, -1 AS sort_rid
+    FROM follows f
+    JOIN tweets t ON t.writer_id = f.flwee
+    WHERE f.flwer = ? {after}
+    ORDER BY sort_date DESC, sort_time DESC, t.tid DESC
+    LIMIT ?
+'''
+
+_RETWEETS_BRANCH = '''
+    SELECT 'retweet' AS type, r.tid, r.rdate AS tdate, NULL AS ttime, r.spam,
+           COALESCE(r.rdate, '') AS sort_date, '' AS sort_time, r.retweeter_id AS sort_rid
+    FROM follows f
+    JOIN retweets r ON r.retweeter_id = f.flwee
+    WHERE f.flwer = ? AND r.spam = 0 {after}
+    ORDER BY sort_date DESC, r.tid DESC, r.retweeter_id DESC
+    LIMIT ?
+'''
+
+_TWEETS_AFTER = "AND (COALESCE(t.tdate, ''), COALESCE(t.ttime, ''), t.tid, -1) < (?, ?, ?, ?)"
+_RETWEETS_AFTER = "AND (COALESCE(r.rdate, ''), '', r.tid, r.retweeter_id) < (?, ?, ?, ?)"
+
+# The plain date bound lets SQLite seek each followee's rows by date; the
+# row-value comparison then resolves ties within the cursor's date. It also
+# skips rows without a date, so a page that runs out of dated rows is
+# finished without it (see _pull_rows).
+_TWEETS_BOUND = "AND t.tdate <= ?"
+_RETWEETS_BOUND = "AND r.rdate <= ?"
+
+
+def _feed_query(has_cursor, date_bound=True):
+    tweets_after = retweets_after = ""
+    if has_cursor:
+        tweets_after = f"{_TWEETS_BOUND} {_TWEETS_AFTER}" if date_bound else _TWEETS_AFTER
+        retweets_after = f"{_RETWEETS_BOUND} {_RETWEETS_AFTER}" if date_bound else _RETWEETS_AFTER
+    return f'''
+        SELECT type, tid, tdate, ttime, spam, sort_date, sort_time, sort_rid FROM (
+            {_TWEETS_BRANCH.format(after=tweets_after)}
+        )
+        UNION ALL
+        SELECT type, tid, tdate, ttime, spam, sort_date, sort_time, sort_rid FROM (
+            {_RETWEETS_BRANCH.format(after=retweets_after)}
+        )
+        ORDER BY sort_date DESC, sort_time DESC, tid DESC, sort_rid DESC
+        LIMIT ?
+    '''
+
+
+def row_cursor(row):
+    """
+    Return the keyset cursor (tdate, time, tid, retweeter) for a feed row.
+    """
+    return (row["tdate"] or "", row["sort_time"], row["tid"], row["sort_rid"])
+
+
+def _pull_rows(conn, user_id, cursor, fetch):
+    """
+    Compute up to `fetch` feed rows after `cursor` from follows, tweets and retweets.
+    """
+    if cursor is None:
+        params = [user_id, fetch, user_id, fetch, fetch]
+        return conn.execute(_feed_query(False), params).fetchall()
+
+    rows = []
+    if cursor[0] != "":
+        after = [cursor[0], *cursor]
+        params = [user_id, *after, fetch, user_id, *after, fetch, fetch]
+        rows = conn.execute(_feed_query(True), params).fetchall()
+        if len(rows) >= fetch:
+            return rows
+        cursor = row_cursor(rows[-1]) if rows else cursor
+
+    # Past the dated rows: rows without a date are left, read like a first page
+    params = [user_id, *cursor, fetch - len(rows), user_id, *cursor, fetch - len(rows), fetch - len(rows)]
+    return rows + conn.execute(_feed_query(True, date_bound=False), params).fetchall()
+
+
+def fetch_feed_page(conn, user_id, cursor=None, limit=FEED_PAGE_SIZE):
+    """
+    Fetch one page of a user's feed starting after `cursor` (None for the first page).
+    Returns (rows, next_cursor); next_cursor is None when there is nothing more.
+    Rows have type, tid, tdate, ttime and spam.
+    """
+    # One extra row tells us whether another page exists
+    fetch = limit + 1
+    if settings.FEED_MODE == "fanout":
+        rows = _timeline_rows(conn, user_id, cursor, fetch)
+    else:
+        rows = _pull_rows(conn, user_id, cursor, fetch)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = row_cursor(rows[-1]) if has_more else None
+    return rows, next_cursor
+
+
+# ========================
+# Fan-out-on-write Timeline
+# ========================
+# In "fanout" mode every tweet and retweet is copied into the timeline of each
+# follower when it is written, so reading a feed is one index range scan of
+# the reader's own rows. Each timeline keeps about TIMELINE_LENGTH entries.
+#
+# Once a timeline has been trimmed (or a backfill could not copy a followee's
+# whole history) it is only complete down to its horizon key. Pages below the
+# horizon are served by the pull query above, as are the feeds of users who
+# have no timeline yet.
+#
+# Writes keep the timelines current whenever the database has them built,
+# whatever this process's FEED_MODE, so processes in either mode can share a
+# database. FEED_MODE picks the read path; dropping the timelines is an
+# explicit admin step (`python feed.py <database> clear`).
+#
+# A user's timeline is materialized once they have a timeline_owners row:
+# rebuild_timelines gives every follower one and backfill_follow adds it on
+# a first follow. Fan-out only writes to those followers.
+
+TIMELINE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS timeline (
+        owner_id INTEGER NOT NULL,
+        tdate DATE NOT NULL,
+        sort_time TEXT NOT NULL,
+        tid INTEGER NOT NULL,
+        sort_rid INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        ttime TIME,
+        src_id INTEGER NOT NULL,
+        PRIMARY KEY (owner_id, tdate, sort_time, tid, sort_rid)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_timeline_owner_src ON timeline (owner_id, src_id)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS timeline_owners (
+        owner_id INTEGER PRIMARY KEY,
+        entries INTEGER NOT NULL,
+        h_date DATE,
+        h_time TEXT,
+        h_tid INTEGER,
+        h_rid INTEGER
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS timeline_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        built INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS timeline_size_ai AFTER INSERT ON timeline BEGIN
+        INSERT INTO timeline_owners (owner_id, entries) VALUES (new.owner_id, 1)
+        ON CONFLICT (owner_id) DO UPDATE SET entries = entries + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS timeline_size_ad AFTER DELETE ON timeline BEGIN
+        UPDATE timeline_owners SET entries = entries - 1 WHERE owner_id = old.owner_id;
+    END
+    ''',
+    # Unfollowing (directly or through a cascading user delete) drops that user's entries
+    '''
+    CREATE TRIGGER IF NOT EXISTS timeline_unfollow AFTER DELETE ON follows BEGIN
+        DELETE FROM timeline WHERE owner_id = old.flwer AND src_id = old.flwee;
+    END
+    ''',
+]
+
+
+def _trim_slack():
+    # Entries arrive one per post, so trimming only once a timeline is this far
+    # over the limit keeps the amortized cost per fanned-out entry constant.
+    return max(1, settings.TIMELINE_LENGTH // 10)
+
+
+# Stale entries (deleted tweets, retweets later flagged as spam) are skipped at read time
+_TIMELINE_QUERY = '''
+    SELECT tl.type, tl.tid, NULLIF(tl.tdate, '') AS tdate, tl.ttime, 0 AS spam, tl.sort_time, tl.sort_rid
+    FROM timeline tl
+    WHERE tl.owner_id = ? {after} {horizon}
+      AND CASE tl.type
+            WHEN 'tweet' THEN EXISTS (SELECT 1 FROM tweets t WHERE t.tid = tl.tid)
+            ELSE EXISTS (SELECT 1 FROM retweets r
+                         WHERE r.tid = tl.tid AND r.retweeter_id = tl.sort_rid AND r.spam = 0)
+          END
+    ORDER BY tl.tdate DESC, tl.sort_time DESC, tl.tid DESC, tl.sort_rid DESC
+    LIMIT ?
+'''
+_TIMELINE_AFTER = "AND (tl.tdate, tl.sort_time, tl.tid, tl.sort_rid) < (?, ?, ?, ?)"
+_TIMELINE_HORIZON = "AND (tl.tdate, tl.sort_time, tl.tid, tl.sort_rid) >= (?, ?, ?, ?)"
+
+# The newest rows of one source user, in timeline form
+_SOURCE_ROWS = '''
+    SELECT * FROM (
+        SELECT COALESCE(tdate, '') AS tdate, COALESCE(ttime, '') AS sort_time, tid, -1 AS sort_rid,
+               'tweet' AS type, ttime, writer_id AS src_id
+        FROM tweets
+        WHERE writer_id = :src
+        ORDER BY tdate DESC, sort_time DESC, tid DESC
+        LIMIT :n
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT COALESCE(rdate, '') AS tdate, '' AS sort_time, tid, retweeter_id AS sort_rid,
+               'retweet' AS type, NULL AS ttime, retweeter_id AS src_id
+        FROM retweets
+        WHERE retweeter_id = :src AND spam = 0
+        ORDER BY rdate DESC, tid DESC
+        LIMIT :n
+    )
+'''
+
+
+def ensure_timeline(conn):
+    """
+    Create the timeline tables, and in fanout mode build every timeline once.
+    Pull mode leaves built timelines in place; see clear_timelines.
+    """
+    for statement in TIMELINE_SCHEMA:
+        conn.execute(statement)
+
+    if settings.FEED_MODE == "fanout" and not timelines_built(conn):
+        rebuild_timelines(conn)
+
+
+# Databases known to have the timeline tables. Nothing drops them, so only a
+# positive answer is kept; the built flag is still read on every write.
+_timeline_tables = set()
+
+
+def _has_timeline_tables(conn):
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    if path in _timeline_tables:
+        return True
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'timeline_state'").fetchone():
+        return False
+    # In-memory databases all have an empty path
+    if path:
+        _timeline_tables.add(path)
+    return True
+
+
+def timelines_built(conn):
+    """
+    Return True if the database has built timelines that writes must keep current.
+    """
+    if not _has_timeline_tables(conn):
+        return False
+    row = conn.execute("SELECT built FROM timeline_state WHERE id = 1").fetchone()
+    return bool(row and row[0])
+
+
+def rebuild_timelines(conn):
+    """
+    Rebuild every user's timeline from follows, tweets and retweets.
+    """
+    conn.execute("DELETE FROM timeline")
+    conn.execute("DELETE FROM timeline_owners")
+    conn.execute("INSERT INTO timeline_owners (owner_id, entries) SELECT DISTINCT flwer, 0 FROM follows")
+    follows = conn.execute("SELECT flwer, flwee FROM follows ORDER BY flwer").fetchall()
+    for flwer, flwee in follows:
+        backfill_follow(conn, flwer, flwee, force=True)
+    conn.execute("INSERT OR REPLACE INTO timeline_state (id, built) VALUES (1, 1)")
+
+
+def clear_timelines(conn):
+    """
+    Drop every timeline entry and stop fanning out writes, for databases that
+    will only be served in pull mode. A fanout process rebuilds them on its next start.
+    """
+    conn.execute("DELETE FROM timeline")
+    conn.execute("DELETE FROM timeline_owners")
+    conn.execute("INSERT OR REPLACE INTO timeline_state (id, built) VALUES (1, 0)")
+
+
+def _horizon(conn, owner_id):
+    row = conn.execute('''
+        SELECT entries, h_date, h_time, h_tid, h_rid FROM timeline_owners WHERE owner_id = ?
+    ''', (owner_id,)).fetchone()
+    if row is None or row["h_date"] is None:
+        return None
+    return (row["h_date"], row["h_time"], row["h_tid"], row["h_rid"])
+
+
+def _raise_horizon(conn, owner_id, key):
+    """
+    Mark the timeline complete only down to `key` and drop the entries below it.
+    """
+    current = _horizon(conn, owner_id)
+    if current is not None and tuple(current) >= tuple(key):
+        key = current
+    else:
+        conn.execute('''
+            INSERT INTO timeline_owners (owner_id, entries, h_date, h_time, h_tid, h_rid)
+            VALUES (?, 0, ?, ?, ?, ?)
+            ON CONFLICT (owner_id) DO UPDATE SET
+                h_date = excluded.h_date, h_time = excluded.h_time,
+                h_tid = excluded.h_tid, h_rid = excluded.h_rid
+        ''', (owner_id, *key))
+    conn.execute('''
+        DELETE FROM timeline
+        WHERE owner_id = ? AND (tdate, sort_time, tid, sort_rid) < (?, ?, ?, ?)
+    ''', (owner_id, *key))
+
+
+def _trim_owner(conn, owner_id):
+    """
+    Keep only the newest TIMELINE_LENGTH entries of one timeline.
+    """
+    last_kept = conn.execute('''
+        SELECT tdate, sort_time, tid, sort_rid
+        FROM timeline
+        WHERE owner_id = ?
+        ORDER BY tdate DESC, sort_time DESC, tid DESC, sort_rid DESC
+        LIMIT 1 OFFSET ?
+    ''', (owner_id, settings.TIMELINE_LENGTH - 1)).fetchone()
+    if last_kept is not None:
+        _raise_horizon(conn, owner_id, tuple(last_kept))
+
+
+def _trim_followers(conn, src_id):
+    owners = conn.execute('''
+        SELECT o.owner_id
+        FROM follows f
+        JOIN timeline_owners o ON o.owner_id = f.flwer
+        WHERE f.flwee = ? AND o.entries > ?
+    ''', (src_id, settings.TIMELINE_LENGTH + _trim_slack())).fetchall()
+    for (owner_id,) in owners:
+        _trim_owner(conn, owner_id)
+
+
+def fan_out_tweet(conn, tid):
+    """
+    Push a newly written tweet into the materialized timeline of each of its writer's followers.
+    Does nothing while the timelines are not built.
+    """
+    if not timelines_built(conn):
+        return
+    conn.execute('''
+        INSERT OR IGNORE INTO timeline (owner_id, tdate, sort_time, tid, sort_rid, type, ttime, src_id)
+        SELECT f.flwer, COALESCE(t.tdate, ''), COALESCE(t.ttime, ''), t.tid, -1, 'tweet', t.ttime, t.writer_id
+        FROM tweets t
+        JOIN follows f ON f.flwee = t.writer_id
+        JOIN timeline_owners o ON o.owner_id = f.flwer
+        WHERE t.tid = ?
+    ''', (tid,))
+    writer = conn.execute("SELECT writer_id FROM tweets WHERE tid = ?", (tid,)).fetchone()
+    if writer:
+        _trim_followers(conn, writer[0])
+
+
+def fan_out_retweet(conn, tid, retweeter_id):
+    """
+    Push a new non-spam retweet into the materialized timeline of each of the retweeter's followers.
+    Does nothing while the timelines are not built.
+    """
+    if not timelines_built(conn):
+        return
+    conn.execute('''
+        INSERT OR IGNORE INTO timeline (owner_id, tdate, sort_time, tid, sort_rid, type, ttime, src_id)
+        SELECT f.flwer, COALESCE(r.rdate, ''), '', r.tid, r.retweeter_id, 'retweet', NULL, r.retweeter_id
+        FROM retweets r
+        JOIN follows f ON f.flwee = r.retweeter_id
+        JOIN timeline_owners o ON o.owner_id = f.flwer
+        WHERE r.tid = ? AND r.retweeter_id = ? AND r.spam = 0
+    ''', (tid, retweeter_id))
+    _trim_followers(conn, retweeter_id)
+
+
+def backfill_follow(conn, flwer, flwee, force=False):
+    """
+    Copy the newly followed user's recent tweets and retweets into the follower's timeline.
+    A follower without a materialized timeline gets one, from every user they follow.
+    Does nothing while the timelines are not built unless forced (as rebuild_timelines does).
+    """
+    if not force and not timelines_built(conn):
+        return
+    created = conn.execute(
+        "INSERT OR IGNORE INTO timeline_owners (owner_id, entries) VALUES (?, 0)", (flwer,)
+    ).rowcount
+    if created:
+        # Fan-out skipped this follower so far, so none of their followees' posts can be assumed present
+        sources = [row[0] for row in conn.execute(
+            "SELECT flwee FROM follows WHERE flwer = ? UNION SELECT ?", (flwer, flwee)
+        )]
+    else:
+        sources = [flwee]
+    for src_id in sources:
+        _backfill_source(conn, flwer, src_id)
+
+
+def _backfill_source(conn, flwer, flwee):
+    params = {"owner": flwer, "src": flwee, "n": settings.TIMELINE_LENGTH}
+    conn.execute(f'''
+        INSERT OR IGNORE INTO timeline (owner_id, tdate, sort_time, tid, sort_rid, type, ttime, src_id)
+        SELECT :owner, tdate, sort_time, tid, sort_rid, type, ttime, src_id FROM ({_SOURCE_ROWS})
+    ''', params)
+
+    # If the followee has more history than was copied, the timeline is only
+    # complete down to the oldest copy. Copies below an existing horizon are dropped.
+    oldest_copied = conn.execute(f'''
+        SELECT tdate, sort_time, tid, sort_rid FROM ({_SOURCE_ROWS})
+        ORDER BY tdate DESC, sort_time DESC, tid DESC, sort_rid DESC
+        LIMIT 1 OFFSET :n - 1
+    ''', params).fetchone()
+    horizon = tuple(oldest_copied) if oldest_copied is not None else _horizon(conn, flwer)
+    if horizon is not None:
+        _raise_horizon(conn, flwer, horizon)
+
+    row = conn.execute("SELECT entries FROM timeline_owners WHERE owner_id = ?", (flwer,)).fetchone()
+    if row and row[0] > settings.TIMELINE_LENGTH:
+        _trim_owner(conn, flwer)
+
+
+def _timeline_rows(conn, user_id, cursor, fetch):
+    """
+    Read up to `fetch` feed rows after `cursor` from the user's timeline,
+    continuing with the pull query below the timeline's horizon.
+    Users with no timeline (none built yet, or cleared) are served by the pull query.
+    """
+    if not conn.execute("SELECT 1 FROM timeline_owners WHERE owner_id = ?", (user_id,)).fetchone():
+        return _pull_rows(conn, user_id, cursor, fetch)
+    horizon = _horizon(conn, user_id)
+    params = [user_id]
+    if cursor is not None:
+        params += cursor
+    if horizon is not None:
+        params += horizon
+    params.append(fetch)
+
+    query = _TIMELINE_QUERY.format(
+        after=_TIMELINE_AFTER if cursor is not None else "",
+        horizon=_TIMELINE_HORIZON if horizon is not None else "",
+    )
+    rows = conn.execute(query, params).fetchall()
+    if len(rows) >= fetch or horizon is None:
+        return rows
+
+    last = row_cursor(rows[-1]) if rows else cursor
+    return rows + _pull_rows(conn, user_id, last, fetch - len(rows))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[2] not in ("rebuild", "clear"):
+        print("Usage: python feed.py <database> rebuild|clear")
+        sys.exit(2)
+
+    from connection_pool import get_pool
+    from migrations import migrate
+
+    with get_pool(sys.argv[1]).connection(immediate=True) as conn:
+        migrate(conn)
+        for statement in TIMELINE_SCHEMA:
+            conn.execute(statement)
+        if sys.argv[2] == "rebuild":
+            rebuild_timelines(conn)
+        else:
+            clear_timelines(conn)
+    print(f"Timelines {'rebuilt' if sys.argv[2] == 'rebuild' else 'cleared'}.")
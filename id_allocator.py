@@ -0,0 +1,93 @@
+import os
+import threading
+
+import settings
+
+
+# ========================
+# ID Allocation
+# ========================
+# New user and tweet ids come from the id_sequences table. A single
+# INSERT ... ON CONFLICT DO UPDATE ... RETURNING statement both reads and
+# advances a sequence. It takes the database write lock before it reads, so
+# two processes can never be handed the same id. That replaces the racy
+# SELECT MAX(...) + 1 followed by a separate INSERT.
+#
+# A process may reserve a block of ids at once and hand them out locally;
+# the sequence never moves backwards past ids that rows already use, so
+# rows inserted by other tools (bulk loads, older clients) are skipped.
+
+SEQUENCE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS id_sequences (
+        name TEXT PRIMARY KEY,
+        next_id INTEGER NOT NULL
+    )
+    ''',
+]
+
+# Sequence name -> (table, id column)
+SEQUENCES = {
+    "users": ("users", "usr"),
+    "tweets": ("tweets", "tid"),
+}
+
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def _block_size(name):
+    # User ids stay dense ("the integer after the current largest user")
+    if name == "users":
+        return 1
+    return max(1, settings.TWEET_ID_BLOCK_SIZE)
+
+
+def _reserve(conn, name, count, first_id=None):
+    """
+    Advance a sequence by `count` and return the first id of the reserved range.
+    A sequence without a row starts after the largest id in its table, or at
+    first_id if given (for a database whose rows live elsewhere, like the shard map).
+    """
+    table, column = SEQUENCES[name]
+    first = f"(SELECT COALESCE(MAX({column}), 0) + 1 FROM {table})" if first_id is None else ":first_id"
+    rows = conn.execute(f'''
+        INSERT INTO id_sequences (name, next_id)
+        VALUES (:name, {first} + :count)
+        ON CONFLICT (name) DO UPDATE SET
+            next_id = MAX(next_id, excluded.next_id - :count) + :count
+        RETURNING next_id - :count
+    ''', {"name": name, "count": count, "first_id": first_id}).fetchall()
+    return rows[0][0]
+
+
+def _database_key(conn, name):
+    # Blocks belong to one process and one database file
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    return (os.getpid(), path, name)
+
+
+def allocate_id(conn, name):
+    """
+    Return a new unique id for the "users" or "tweets" sequence.
+
+    Inside an open transaction only a single id is reserved, so a rollback
+    cannot leave this process holding a block other processes may reuse.
+    Otherwise a block of TWEET_ID_BLOCK_SIZE ids is reserved and committed
+    immediately, and later calls are served without touching the database.
+    """
+    count = _block_size(name)
+    if count == 1 or conn.in_transaction:
+        return _reserve(conn, name, 1)
+
+    key = _database_key(conn, name)
+    with _blocks_lock:
+        block = _blocks.get(key)
+        if block is None or block[0] >= block[1]:
+            start = _reserve(conn, name, count)
+            conn.commit()
+            block = [start, start + count]
+            _blocks[key] = block
+        new_id = block[0]
+        block[0] += 1
+        return new_id
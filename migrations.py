@@ -0,0 +1,430 @@
+import re
+import sys
+
+from connection_pool import get_pool
+from stats import reconcile_stats
+from trending import rebuild_trending
+from tweet_search import rebuild_hashtag_dictionary
+
+
+# ========================
+# Schema Migrations
+# ========================
+# The schema version lives in PRAGMA user_version. Each migration runs once,
+# in its own transaction together with the version bump, so a database is
+# always at exactly one version. Steps are SQL strings or callables taking
+# the connection. Append new migrations; never edit one that has shipped.
+# The SQL is copied in as it shipped rather than taken from the modules'
+# live schema lists, so later schema changes need a migration of their own.
+# Callables only rebuild derived data from the base tables.
+
+MIGRATIONS = [
+    (1, "secondary indexes for the hot read paths", [
+        # Profile counts, recent/all tweets of a user, and the feed's tweets branch
+        "CREATE INDEX IF NOT EXISTS idx_tweets_writer ON tweets (writer_id, tdate, ttime, tid)",
+        # Reply counts in show_tweet_details
+        "CREATE INDEX IF NOT EXISTS idx_tweets_replyto ON tweets (replyto_tid)",
+        # Follower counts and list_followers (the primary key only covers flwer)
+        "CREATE INDEX IF NOT EXISTS idx_follows_flwee ON follows (flwee, flwer)",
+        # The feed's retweets branch; retweets WHERE tid = ? already uses the primary key
+        "CREATE INDEX IF NOT EXISTS idx_retweets_retweeter ON retweets (retweeter_id, rdate, tid, spam)",
+    ]),
+    (2, "trigger-maintained reply, retweet, tweet and follow counters", [
+        '''
+        CREATE TABLE IF NOT EXISTS tweet_stats (
+            tid INTEGER PRIMARY KEY,
+            replies INTEGER NOT NULL DEFAULT 0,
+            retweets INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            usr INTEGER PRIMARY KEY,
+            tweets INTEGER NOT NULL DEFAULT 0,
+            following INTEGER NOT NULL DEFAULT 0,
+            followers INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_tweets_ai AFTER INSERT ON tweets BEGIN
+            INSERT INTO user_stats (usr, tweets) SELECT new.writer_id, 1 WHERE new.writer_id IS NOT NULL
+            ON CONFLICT (usr) DO UPDATE SET tweets = tweets + 1;
+            INSERT INTO tweet_stats (tid, replies) SELECT new.replyto_tid, 1 WHERE new.replyto_tid IS NOT NULL
+            ON CONFLICT (tid) DO UPDATE SET replies = replies + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_tweets_ad AFTER DELETE ON tweets BEGIN
+            UPDATE user_stats SET tweets = tweets - 1 WHERE usr = old.writer_id;
+            UPDATE tweet_stats SET replies = replies - 1 WHERE tid = old.replyto_tid;
+            DELETE FROM tweet_stats WHERE tid = old.tid;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_tweets_au AFTER UPDATE OF writer_id, replyto_tid ON tweets BEGIN
+            UPDATE user_stats SET tweets = tweets - 1 WHERE usr = old.writer_id;
+            INSERT INTO user_stats (usr, tweets) SELECT new.writer_id, 1 WHERE new.writer_id IS NOT NULL
+            ON CONFLICT (usr) DO UPDATE SET tweets = tweets + 1;
+            UPDATE tweet_stats SET replies = replies - 1 WHERE tid = old.replyto_tid;
+            INSERT INTO tweet_stats (tid, replies) SELECT new.replyto_tid, 1 WHERE new.replyto_tid IS NOT NULL
+            ON CONFLICT (tid) DO UPDATE SET replies = replies + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_retweets_ai AFTER INSERT ON retweets BEGIN
+            INSERT INTO tweet_stats (tid, retweets) SELECT new.tid, 1 WHERE new.tid IS NOT NULL
+            ON CONFLICT (tid) DO UPDATE SET retweets = retweets + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_retweets_ad AFTER DELETE ON retweets BEGIN
+            UPDATE tweet_stats SET retweets = retweets - 1 WHERE tid = old.tid;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_retweets_au AFTER UPDATE OF tid ON retweets BEGIN
+            UPDATE tweet_stats SET retweets = retweets - 1 WHERE tid = old.tid;
+            INSERT INTO tweet_stats (tid, retweets) SELECT new.tid, 1 WHERE new.tid IS NOT NULL
+            ON CONFLICT (tid) DO UPDATE SET retweets = retweets + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_follows_ai AFTER INSERT ON follows BEGIN
+            INSERT INTO user_stats (usr, following) SELECT new.flwer, 1 WHERE new.flwer IS NOT NULL
+            ON CONFLICT (usr) DO UPDATE SET following = following + 1;
+            INSERT INTO user_stats (usr, followers) SELECT new.flwee, 1 WHERE new.flwee IS NOT NULL
+            ON CONFLICT (usr) DO UPDATE SET followers = followers + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_follows_ad AFTER DELETE ON follows BEGIN
+            UPDATE user_stats SET following = following - 1 WHERE usr = old.flwer;
+            UPDATE user_stats SET followers = followers - 1 WHERE usr = old.flwee;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS stats_follows_au AFTER UPDATE OF flwer, flwee ON follows BEGIN
+            UPDATE user_stats SET following = following - 1 WHERE usr = old.flwer;
+            UPDATE user_stats SET followers = followers - 1 WHERE usr = old.flwee;
+            INSERT INTO user_stats (usr, following) SELECT new.flwer, 1 WHERE new.flwer IS NOT NULL
+            ON CONFLICT (usr) DO UPDATE SET following = following + 1;
+            INSERT INTO user_stats (usr, followers) SELECT new.flwee, 1 WHERE new.flwee IS NOT NULL
+            ON CONFLICT (usr) DO UPDATE SET followers = followers + 1;
+        END
+        ''',
+        reconcile_stats,
+    ]),
+    (3, "id sequences replacing SELECT MAX(...) + 1", [
+        '''
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL
+        )
+        ''',
+    ]),
+    (4, "normalized hashtag dictionary for indexed #tag lookups", [
+        '''
+        CREATE TABLE IF NOT EXISTS hashtag_terms (
+            term_id INTEGER PRIMARY KEY,
+            term TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS hashtag_tweets (
+            term_id INTEGER NOT NULL,
+            tid INTEGER NOT NULL,
+            PRIMARY KEY (term_id, tid)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS hashtag_terms_ai AFTER INSERT ON hashtag_mentions BEGIN
+            INSERT OR IGNORE INTO hashtag_terms (term) VALUES (LOWER(new.term));
+            INSERT OR IGNORE INTO hashtag_tweets (term_id, tid)
+            SELECT term_id, new.tid FROM hashtag_terms WHERE term = LOWER(new.term);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS hashtag_terms_ad AFTER DELETE ON hashtag_mentions
+        WHEN NOT EXISTS (SELECT 1 FROM hashtag_mentions WHERE tid = old.tid AND LOWER(term) = LOWER(old.term))
+        BEGIN
+            DELETE FROM hashtag_tweets
+            WHERE tid = old.tid
+              AND term_id = (SELECT term_id FROM hashtag_terms WHERE term = LOWER(old.term));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS hashtag_terms_au AFTER UPDATE OF tid, term ON hashtag_mentions BEGIN
+            DELETE FROM hashtag_tweets
+            WHERE tid = old.tid
+              AND term_id = (SELECT term_id FROM hashtag_terms WHERE term = LOWER(old.term))
+              AND NOT EXISTS (SELECT 1 FROM hashtag_mentions WHERE tid = old.tid AND LOWER(term) = LOWER(old.term));
+            INSERT OR IGNORE INTO hashtag_terms (term) VALUES (LOWER(new.term));
+            INSERT OR IGNORE INTO hashtag_tweets (term_id, tid)
+            SELECT term_id, new.tid FROM hashtag_terms WHERE term = LOWER(new.term);
+        END
+        ''',
+        rebuild_hashtag_dictionary,
+    ]),
+    (5, "reply index in display order for conversation trees", [
+        "CREATE INDEX IF NOT EXISTS idx_tweets_reply_order ON tweets (replyto_tid, tdate, ttime, tid)",
+        "DROP INDEX IF EXISTS idx_tweets_replyto",
+    ]),
+    (6, "hourly hashtag counts and sliding-window totals for trending tags", [
+        '''
+        CREATE TABLE IF NOT EXISTS trending_buckets (
+            term TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            mentions INTEGER NOT NULL,
+            PRIMARY KEY (hour, term)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS trending_windows (
+            hours INTEGER PRIMARY KEY,
+            head INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS trending_totals (
+            hours INTEGER NOT NULL,
+            term TEXT NOT NULL,
+            mentions INTEGER NOT NULL,
+            PRIMARY KEY (hours, term)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_trending_top ON trending_totals (hours, mentions DESC, term)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS trending_ai AFTER INSERT ON hashtag_mentions BEGIN
+            INSERT INTO trending_buckets (term, hour, mentions)
+            SELECT LOWER(new.term), m.hour, 1
+            FROM (SELECT CAST(strftime('%s', t.tdate || ' ' || COALESCE(t.ttime, '00:00:00')) AS INTEGER) / 3600 AS hour
+                  FROM tweets t WHERE t.tid = new.tid) m
+            WHERE m.hour IS NOT NULL
+            ON CONFLICT (hour, term) DO UPDATE SET mentions = mentions + 1;
+            INSERT INTO trending_totals (hours, term, mentions)
+            SELECT w.hours, LOWER(new.term), 1
+            FROM (SELECT CAST(strftime('%s', t.tdate || ' ' || COALESCE(t.ttime, '00:00:00')) AS INTEGER) / 3600 AS hour
+                  FROM tweets t WHERE t.tid = new.tid) m, trending_windows w
+            WHERE m.hour > w.head - w.hours AND m.hour <= w.head
+            ON CONFLICT (hours, term) DO UPDATE SET mentions = mentions + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trending_ad AFTER DELETE ON hashtag_mentions BEGIN
+            UPDATE trending_buckets SET mentions = mentions - 1
+            WHERE term = LOWER(old.term)
+              AND hour = (SELECT CAST(strftime('%s', t.tdate || ' ' || COALESCE(t.ttime, '00:00:00')) AS INTEGER) / 3600
+                          FROM tweets t WHERE t.tid = old.tid);
+            UPDATE trending_totals SET mentions = mentions - 1
+            WHERE term = LOWER(old.term)
+              AND hours IN (
+                  SELECT w.hours
+                  FROM (SELECT CAST(strftime('%s', t.tdate || ' ' || COALESCE(t.ttime, '00:00:00')) AS INTEGER)
+                               / 3600 AS hour
+                        FROM tweets t WHERE t.tid = old.tid) m, trending_windows w
+                  WHERE m.hour > w.head - w.hours AND m.hour <= w.head
+              );
+        END
+        ''',
+        rebuild_trending,
+    ]),
+    (7, "precomputed who-to-follow recommendations with stale marks", [
+        '''
+        CREATE TABLE IF NOT EXISTS follow_recommendations (
+            usr INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            candidate INTEGER NOT NULL,
+            mutual INTEGER NOT NULL,
+            PRIMARY KEY (usr, rank)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS recommendation_stale (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            usr INTEGER NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS recommend_follows_ai AFTER INSERT ON follows BEGIN
+            INSERT OR REPLACE INTO recommendation_stale (usr)
+            SELECT new.flwer UNION SELECT flwer FROM follows WHERE flwee = new.flwer;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS recommend_follows_ad AFTER DELETE ON follows BEGIN
+            INSERT OR REPLACE INTO recommendation_stale (usr)
+            SELECT old.flwer UNION SELECT flwer FROM follows WHERE flwee = old.flwer;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS recommend_follows_au AFTER UPDATE OF flwer, flwee ON follows BEGIN
+            INSERT OR REPLACE INTO recommendation_stale (usr)
+            SELECT old.flwer UNION SELECT new.flwer
+            UNION SELECT flwer FROM follows WHERE flwee IN (old.flwer, new.flwer);
+        END
+        ''',
+        "INSERT OR REPLACE INTO recommendation_stale (usr) SELECT usr FROM users",
+    ]),
+    (8, "partial index of non-spam retweets for the feed", [
+        "DROP INDEX IF EXISTS idx_retweets_retweeter",
+        "CREATE INDEX IF NOT EXISTS idx_retweets_day ON retweets (retweeter_id, rdate)",
+        "CREATE INDEX IF NOT EXISTS idx_retweets_feed ON retweets (retweeter_id, rdate, tid, spam) WHERE spam = 0",
+    ]),
+    (9, "recommendation triggers mark only the follower", [
+        "DROP TRIGGER IF EXISTS recommend_follows_ai",
+        "DROP TRIGGER IF EXISTS recommend_follows_ad",
+        "DROP TRIGGER IF EXISTS recommend_follows_au",
+        '''
+        CREATE TABLE IF NOT EXISTS recommendation_changed (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            usr INTEGER NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS recommend_follows_ai AFTER INSERT ON follows BEGIN
+            INSERT OR REPLACE INTO recommendation_stale (usr) VALUES (new.flwer);
+            INSERT OR REPLACE INTO recommendation_changed (usr) VALUES (new.flwer);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS recommend_follows_ad AFTER DELETE ON follows BEGIN
+            INSERT OR REPLACE INTO recommendation_stale (usr) VALUES (old.flwer);
+            INSERT OR REPLACE INTO recommendation_changed (usr) VALUES (old.flwer);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS recommend_follows_au AFTER UPDATE OF flwer, flwee ON follows BEGIN
+            INSERT OR REPLACE INTO recommendation_stale (usr) SELECT old.flwer UNION SELECT new.flwer;
+            INSERT OR REPLACE INTO recommendation_changed (usr) SELECT old.flwer UNION SELECT new.flwer;
+        END
+        ''',
+    ]),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Apply every migration newer than the database's user_version, in order.
+    Returns the list of versions applied.
+    """
+    applied = []
+    current = schema_version(conn)
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("SAVEPOINT migrate")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+        except BaseException:
+            conn.execute("ROLLBACK TO migrate")
+            conn.execute("RELEASE migrate")
+            raise
+        conn.execute("RELEASE migrate")
+        applied.append(version)
+    return applied
+
+
+# ========================
+# Query Plan Check
+# ========================
+# Usage: python migrations.py <database>
+# Migrates the database, then runs EXPLAIN QUERY PLAN on every hot query the
+# app ships and exits with status 1 if any of them scans a whole table.
+
+def hot_queries():
+    """
+    Return (name, sql, params) for the shipped queries that must never scan.
+    Keyword searches (LIKE '%kw%') and user name searches are expected to scan
+    and are not listed.
+    """
+    from conversation import _THREAD_QUERY
+    from feed import _SOURCE_ROWS, _TIMELINE_AFTER, _TIMELINE_QUERY, _feed_query
+    from recommend import _CANDIDATES_QUERY, _IS_STALE_QUERY, _STORED_QUERY
+    from service import (_FOLLOWERS_AFTER, _FOLLOWERS_QUERY, _IS_FOLLOWING_QUERY, _LIST_TWEETS_QUERY,
+                         _LISTS_QUERY, _PASSWORD_QUERY, _PROFILES_QUERY, _USER_TWEETS_QUERY, _WRITER_QUERY)
+    from stats import _TWEET_STATS_QUERY, _USER_STATS_QUERY
+    from trending import _TOP_QUERY
+    from tweet_search import _HASHTAG_EXACT
+
+    after = ["2024-01-01", "2024-01-01", "12:00:00", 1, -1]
+    return [
+        ("login", _PASSWORD_QUERY, [1]),
+        ("tweet stats", _TWEET_STATS_QUERY, [1]),
+        ("user stats", _USER_STATS_QUERY, [1]),
+        ("tweet writer", _WRITER_QUERY, [1]),
+        ("recent tweets", _USER_TWEETS_QUERY, [1, 3]),
+        ("is following", _IS_FOLLOWING_QUERY, [1, 2]),
+        ("profiles", _PROFILES_QUERY, {"users": "[1, 2]", "viewer": 3, "recent": 3}),
+        ("followers", _FOLLOWERS_QUERY.format(after=_FOLLOWERS_AFTER), [1, "a", 1, 6]),
+        ("posts by user", _SOURCE_ROWS, {"src": 1, "n": 100}),
+        ("favorite lists", _LISTS_QUERY, [1]),
+        ("list tweets", _LIST_TWEETS_QUERY, [1]),
+        ("conversation", _THREAD_QUERY, {"tid": 1, "max_depth": 8, "max_width": 10, "max_nodes": 200,
+                                         "max_ancestors": 50}),
+        ("trending", _TOP_QUERY, [24, 10]),
+        ("is stale", _IS_STALE_QUERY, [1]),
+        ("recommendations", _STORED_QUERY, [1, 20]),
+        ("live recommendations", _CANDIDATES_QUERY, {"usr": 1, "limit": 20}),
+        ("hashtag search", _HASHTAG_EXACT, {"tags": '["#x"]'}),
+        ("feed first page", _feed_query(False), [1, 6, 1, 6, 6]),
+        ("feed next page", _feed_query(True), [1, *after, 6, 1, *after, 6, 6]),
+        ("feed past the dates", _feed_query(True, date_bound=False), [1, *after[1:], 6, 1, *after[1:], 6, 6]),
+        ("timeline page", _TIMELINE_QUERY.format(after=_TIMELINE_AFTER, horizon=""), [1, *after[1:], 6]),
+    ]
+
+
+# Names defined in a WITH clause: "name AS (" or "name (col, ...) AS ("
+_CTE_NAME = re.compile(r"(\w+)\s*(?:\([^()]*\))?\s+AS\s*(?:NOT\s+)?(?:MATERIALIZED\s*)?\(", re.IGNORECASE)
+
+
+def _is_table_scan(detail, cte_names=()):
+    # "SCAN (subquery-1)", "SCAN CONSTANT ROW" and scans of the query's own
+    # CTEs read intermediate results, not tables, and a VIRTUAL TABLE scan
+    # reads a parameter list (json_each) or an FTS index
+    if not detail.startswith("SCAN ") or detail.startswith(("SCAN (", "SCAN CONSTANT ROW")):
+        return False
+    return "VIRTUAL TABLE" not in detail and detail.split()[1] not in cte_names
+
+
+def find_table_scans(conn):
+    """
+    Return (name, plan detail) for every hot query whose plan scans a table.
+    """
+    scans = []
+    for name, sql, params in hot_queries():
+        cte_names = set(_CTE_NAME.findall(sql))
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[3]
+            if _is_table_scan(detail, cte_names):
+                scans.append((name, detail))
+    return scans
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python migrations.py <database>")
+        sys.exit(2)
+
+    # Set_Database creates the tables (and the feed/search objects) and migrates
+    import MiniProject
+    MiniProject.Set_Database()
+
+    with get_pool(sys.argv[1]).connection() as conn:
+        print(f"Schema version: {schema_version(conn)}")
+        scans = find_table_scans(conn)
+
+    if scans:
+        print("Query plan regressions:")
+        for name, detail in scans:
+            print(f"- {name}: {detail}")
+        sys.exit(1)
+    print("All hot queries use indexes.")
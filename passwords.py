@@ -0,0 +1,203 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import settings
+from cache import login_cache
+
+
+# ========================
+# Password Hashing
+# ========================
+# users.pwd holds a salted hash in one of these formats:
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+# with base64 salt and hash. Rows written before hashing existed still hold
+# the plaintext password. verify_password accepts them and reports that they
+# need a rehash, and service.authenticate replaces them on the next
+# successful login. The same happens to hashes made with older cost settings,
+# so raising TWITTER_PASSWORD_* upgrades users as they log in.
+#
+# hashlib releases the GIL while it derives a key, so hashing runs on a
+# thread pool of TWITTER_PASSWORD_WORKERS threads (one per core by default).
+# That caps the CPU a login storm can take. At most TWITTER_PASSWORD_MAX_PENDING
+# verifications may wait for the pool; beyond that submit() raises
+# VerifierBusy instead of queueing without bound.
+#
+# A successful verification is remembered in login_cache for the cache TTL,
+# keyed by the stored hash, so a user who logs in repeatedly costs one HMAC
+# instead of a key derivation. The cached token is an HMAC of the password
+# under a per-process random key. Set TWITTER_LOGIN_CACHE_ENTRIES=0 to disable it.
+#
+# A user with no stored hash (including an unknown user id) is checked
+# against a dummy hash made with the current settings, on the same pool, so
+# rejecting them takes as long as rejecting a wrong password.
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+_CACHE_KEY = os.urandom(32)
+
+_dummy_hash = None
+
+
+class VerifierBusy(Exception):
+    """
+    Too many password checks are already waiting for the hashing pool.
+    """
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password, salt, n, r, p):
+    # scrypt uses about 128 * n * r bytes; leave headroom for OpenSSL's own accounting
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p + 2 ** 20, dklen=HASH_BYTES)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, HASH_BYTES)
+
+
+def hash_password(password):
+    """
+    Return a salted hash of password using the configured scheme and cost.
+    """
+    salt = os.urandom(SALT_BYTES)
+    if settings.PASSWORD_SCHEME == "pbkdf2_sha256":
+        iterations = settings.PASSWORD_PBKDF2_ITERATIONS
+        return f"pbkdf2_sha256${iterations}${_b64(salt)}${_b64(_pbkdf2(password, salt, iterations))}"
+    n, r, p = settings.PASSWORD_SCRYPT_N, settings.PASSWORD_SCRYPT_R, settings.PASSWORD_SCRYPT_P
+    return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def _parse(stored):
+    """
+    Return (scheme, cost params, salt, hash) for a stored hash, or None for a legacy plaintext value.
+    """
+    parts = stored.split("$")
+    try:
+        if parts[0] == "scrypt" and len(parts) == 6:
+            return "scrypt", tuple(int(x) for x in parts[1:4]), base64.b64decode(parts[4]), base64.b64decode(parts[5])
+        if parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+            return "pbkdf2_sha256", (int(parts[1]),), base64.b64decode(parts[2]), base64.b64decode(parts[3])
+    except ValueError:
+        pass
+    return None
+
+
+def _current_params(scheme):
+    if scheme == "pbkdf2_sha256":
+        return (settings.PASSWORD_PBKDF2_ITERATIONS,)
+    return (settings.PASSWORD_SCRYPT_N, settings.PASSWORD_SCRYPT_R, settings.PASSWORD_SCRYPT_P)
+
+
+def _derive(password, scheme, params, salt):
+    if scheme == "scrypt":
+        return _scrypt(password, salt, *params)
+    return _pbkdf2(password, salt, *params)
+
+
+def _dummy_parsed():
+    global _dummy_hash
+    parsed = _parse(_dummy_hash) if _dummy_hash is not None else None
+    if parsed is None or parsed[:2] != (settings.PASSWORD_SCHEME, _current_params(settings.PASSWORD_SCHEME)):
+        _dummy_hash = hash_password(_b64(os.urandom(SALT_BYTES)))
+        parsed = _parse(_dummy_hash)
+    return parsed
+
+
+def _cache_token(stored, password):
+    return hmac.new(_CACHE_KEY, stored.encode() + b"\0" + password.encode(), hashlib.sha256).digest()
+
+
+def verify_password(password, stored):
+    """
+    Check password against a stored value.
+    Returns (matches, needs_rehash); needs_rehash is True for a matching
+    plaintext row or a hash made with other scheme or cost settings.
+    """
+    if stored is None:
+        scheme, params, salt, expected = _dummy_parsed()
+        hmac.compare_digest(_derive(password, scheme, params, salt), expected)
+        return False, False
+    parsed = _parse(stored)
+    if parsed is None:
+        # Legacy plaintext row
+        matches = hmac.compare_digest(password.encode(), stored.encode())
+        return matches, matches
+
+    scheme, params, salt, expected = parsed
+    needs_rehash = scheme != settings.PASSWORD_SCHEME or params != _current_params(scheme)
+    token = _cache_token(stored, password)
+    cached = login_cache.get(stored)
+    if cached is not None and hmac.compare_digest(cached, token):
+        return True, needs_rehash
+
+    matches = hmac.compare_digest(_derive(password, scheme, params, salt), expected)
+    if matches:
+        login_cache.put(stored, token)
+    return matches, matches and needs_rehash
+
+
+# ========================
+# Hashing Pool
+# ========================
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, settings.PASSWORD_WORKERS),
+                                           thread_name_prefix="pwhash")
+        return _executor
+
+
+def _done(_future):
+    global _pending
+    with _executor_lock:
+        _pending -= 1
+
+
+def submit(fn, *args):
+    """
+    Run fn(*args) (verify_password or hash_password) on the hashing pool and return a Future.
+    Raises VerifierBusy when TWITTER_PASSWORD_MAX_PENDING calls are already waiting.
+    """
+    global _pending
+    executor = _get_executor()
+    with _executor_lock:
+        if _pending >= settings.PASSWORD_MAX_PENDING:
+            raise VerifierBusy("Too many logins in progress, please retry shortly.")
+        _pending += 1
+    future = executor.submit(fn, *args)
+    future.add_done_callback(_done)
+    return future
+
+
+def run(fn, *args):
+    """
+    Run fn(*args) on the hashing pool and wait for its result.
+    """
+    return submit(fn, *args).result()
+
+
+def shutdown():
+    """
+    Stop the hashing pool; the next submit() starts a new one with the current settings.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
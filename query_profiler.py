@@ -0,0 +1,298 @@
+import atexit
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import settings
+
+
+# ========================
+# Query Profiler
+# ========================
+# With TWITTER_QUERY_PROFILE=1 the connection pool opens ProfilingConnection
+# instead of sqlite3.Connection. Every statement run through it is timed from
+# execute() until its last row is fetched (or the cursor is reused, closed or
+# dropped). The profiler records the time, the rows returned (or changed),
+# the SQLite VM steps and the first call site outside the database layer.
+#
+# Statements slower than TWITTER_SLOW_QUERY_MS are written to the slow query
+# log (TWITTER_SLOW_QUERY_LOG, stderr by default) as soon as they finish.
+# At exit the top statements by total time go to the same place.
+# get_profile().summary() returns the same data to code.
+
+# The progress handler fires every this many SQLite VM instructions
+PROGRESS_STEPS = 1000
+
+# Frames in these files are the database layer, not the caller we want to report
+_INTERNAL_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "connection_pool.py"),
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """
+    Collapse whitespace so the same statement groups together wherever it is written.
+    """
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def _call_site():
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if os.path.abspath(filename) not in _INTERNAL_FILES and not filename.endswith("contextlib.py"):
+            return f"{os.path.basename(filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+class StatementStats:
+    __slots__ = ("sql", "calls", "total_ms", "max_ms", "rows", "steps", "sites")
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.steps = 0
+        self.sites = {}
+
+    def as_dict(self):
+        return {
+            "sql": self.sql,
+            "calls": self.calls,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "vm_steps": self.steps,
+            "call_sites": dict(sorted(self.sites.items(), key=lambda item: -item[1])),
+        }
+
+
+class QueryProfile:
+    """
+    Per-process statement statistics and the slow query log.
+    """
+
+    def __init__(self, slow_ms=None, log_path=None):
+        self.slow_ms = settings.SLOW_QUERY_MS if slow_ms is None else slow_ms
+        self.log_path = settings.SLOW_QUERY_LOG if log_path is None else log_path
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, sql, elapsed_ms, rows, steps, site):
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = StatementStats(key)
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.rows += rows
+            stats.steps += steps
+            stats.sites[site] = stats.sites.get(site, 0) + 1
+
+        if self.slow_ms >= 0 and elapsed_ms >= self.slow_ms:
+            self._log(f"slow query {elapsed_ms:.1f} ms, {rows} row(s), ~{steps} VM steps at {site}: {key}")
+
+    def summary(self, top=None, by="total_ms"):
+        """
+        Return statement stats as dicts, highest `by` first (total_ms, max_ms, calls, rows or vm_steps).
+        """
+        with self._lock:
+            rows = [stats.as_dict() for stats in self._stats.values()]
+        rows.sort(key=lambda row: row[by], reverse=True)
+        return rows[:top] if top else rows
+
+    def format_summary(self, top=None):
+        top = settings.QUERY_PROFILE_TOP if top is None else top
+        lines = [f"Top {top} statements by total time:",
+                 f"{'total ms':>10} | {'calls':>7} | {'mean ms':>9} | {'max ms':>9} | {'rows':>9} | statement"]
+        for row in self.summary(top):
+            sql = row["sql"] if len(row["sql"]) <= 100 else row["sql"][:97] + "..."
+            site = next(iter(row["call_sites"]), "?")
+            lines.append(f"{row['total_ms']:>10.1f} | {row['calls']:>7} | {row['mean_ms']:>9.2f} | "
+                         f"{row['max_ms']:>9.2f} | {row['rows']:>9} | {sql}  [{site}]")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def dump(self):
+        """
+        Write the summary to the slow query log (used at exit).
+        """
+        if self._stats:
+            self._log(self.format_summary())
+
+    def _log(self, message):
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        if self.log_path:
+            with self._lock, open(self.log_path, "a") as f:
+                print(f"[{stamp}] {message}", file=f)
+        else:
+            print(f"[{stamp}] {message}", file=sys.stderr)
+
+
+_profile = None
+_profile_lock = threading.Lock()
+
+
+def get_profile():
+    """
+    Return the process-wide QueryProfile, creating it (and its exit dump) on first use.
+    """
+    global _profile
+    with _profile_lock:
+        if _profile is None:
+            _profile = QueryProfile()
+            atexit.register(_profile.dump)
+        return _profile
+
+
+# ========================
+# Profiling Connection
+# ========================
+
+class ProfilingCursor(sqlite3.Cursor):
+    """
+    A cursor that reports each statement to the QueryProfile once it finishes.
+    """
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self._statement = None
+
+    def _begin(self, sql):
+        self._finish()
+        self._statement = [sql, _call_site(), 0.0, 0, self.connection._steps]
+
+    def _add(self, elapsed, rows):
+        statement = self._statement
+        if statement is not None:
+            statement[2] += elapsed
+            statement[3] += rows
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is None:
+            return
+        sql, site, elapsed, rows, steps_before = statement
+        if rows == 0 and self.rowcount > 0:
+            # INSERT/UPDATE/DELETE: report rows changed
+            rows = self.rowcount
+        # Interleaved cursors on one connection share the counter, so this is approximate
+        steps = (self.connection._steps - steps_before) * PROGRESS_STEPS
+        get_profile().record(sql, elapsed * 1000, rows, steps, site)
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql)
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._add(time.perf_counter() - start, 0)
+        if self.description is None:
+            # Nothing to fetch, so the statement is already complete
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql)
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add(time.perf_counter() - start, 0)
+            self._finish()
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add(time.perf_counter() - start, row is not None)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._add(time.perf_counter() - start, len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add(time.perf_counter() - start, len(rows))
+        self._finish()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add(time.perf_counter() - start, 0)
+            self._finish()
+            raise
+        self._add(time.perf_counter() - start, 1)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # A cursor dropped before its last row still reports what it did
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection whose cursors (including conn.execute) are profiled.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._steps = 0
+        self.set_progress_handler(self._tick, PROGRESS_STEPS)
+
+    def _tick(self):
+        self._steps += 1
+        return 0
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        site = _call_site()
+        steps_before = self._steps
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            get_profile().record(sql_script, (time.perf_counter() - start) * 1000, 0,
+                                 (self._steps - steps_before) * PROGRESS_STEPS, site)
@@ -0,0 +1,319 @@
+import argparse
+import array
+import heapq
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import settings
+from connection_pool import after_commit, close_all_pools, get_pool
+
+
+# ========================
+# Who to Follow
+# ========================
+# A user's candidates are the users followed by the users they follow
+# (friends of friends), minus themselves and the users they already follow.
+# A candidate scores one per followee that follows it ("mutual"), with ties
+# going to the candidate with more followers, then the lower id.
+#
+# The top RECOMMEND_LIMIT candidates of every user are precomputed into
+# follow_recommendations by `python recommend.py <database>`:
+# - follows is loaded once into a FollowGraph, a compressed sparse row (CSR)
+#   adjacency: the followees of user u are targets[offsets[u]:offsets[u + 1]],
+#   in two flat int arrays (about 4 bytes per follow).
+# - Users are scored in chunks on a process pool of RECOMMEND_WORKERS
+#   processes. Each gets the graph once, as two pickled arrays.
+# - The parent writes each chunk's results in one transaction.
+#
+# A follow or unfollow by u changes the candidates of u and of everyone who
+# follows u. Triggers on follows mark u in recommendation_stale: for a stale
+# user, recommendations() computes the answer with one SQL query (a few
+# thousand index rows even for users who follow many) instead of trusting
+# the table. follow() refreshes u's row once its transaction has committed.
+# The triggers also record u in recommendation_changed, and
+# `recommend.py <database> --stale` refreshes up to
+# RECOMMEND_STALE_FOLLOWERS followers of each recorded user, in the
+# background. Until then, and beyond the cap until the next precompute,
+# those followers are served their stored rows. Marking them stale instead
+# would cost one row per follower on every follow and send all of their
+# reads to the live query.
+#
+# Marks carry an increasing seq. A refresh or precompute only clears the
+# marks it saw in its own snapshot, so a follow made while it runs stays
+# marked. Stored rows of users who are not stale keep the follower-count
+# tie-break of their last refresh until the next precompute.
+# Migrations 7 and 9 (migrations.py) create the tables and triggers.
+
+# Candidates kept per user
+RECOMMEND_LIMIT = 20
+
+# One user's candidates straight from follows (used while the user is stale)
+_CANDIDATES_QUERY = '''
+    SELECT f2.flwee AS candidate, COUNT(*) AS mutual
+    FROM follows f1
+    CROSS JOIN follows f2 ON f2.flwer = f1.flwee
+    LEFT JOIN user_stats s ON s.usr = f2.flwee
+    WHERE f1.flwer = :usr
+      AND f2.flwee != :usr
+      AND NOT EXISTS (SELECT 1 FROM follows x WHERE x.flwer = :usr AND x.flwee = f2.flwee)
+    GROUP BY f2.flwee
+    ORDER BY mutual DESC, COALESCE(MAX(s.followers), 0) DESC, f2.flwee
+    LIMIT :limit
+'''
+
+_IS_STALE_QUERY = "SELECT 1 FROM recommendation_stale WHERE usr = ?"
+
+_STORED_QUERY = '''
+    SELECT candidate, mutual FROM follow_recommendations
+    WHERE usr = ?
+    ORDER BY rank
+    LIMIT ?
+'''
+
+
+class FollowGraph:
+    """
+    The follows table as CSR arrays, indexed by user id.
+    """
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+        # In-degree (follower count) per user, for tie-breaking
+        self.followers = array.array("i", bytes(4 * (len(offsets) - 1)))
+        for target in targets:
+            self.followers[target] += 1
+
+    @classmethod
+    def load(cls, conn):
+        """
+        Read follows in (flwer, flwee) order, which is its primary key order, into CSR arrays.
+        """
+        size = conn.execute('''
+            SELECT MAX(COALESCE((SELECT MAX(usr) FROM users), 0),
+                       COALESCE((SELECT MAX(flwer) FROM follows), 0),
+                       COALESCE((SELECT MAX(flwee) FROM follows), 0))
+        ''').fetchone()[0] + 1
+        offsets = array.array("i", bytes(4 * (size + 1)))
+        targets = array.array("i")
+        # Count out-degrees first, then prefix-sum them into offsets
+        for flwer, flwee in conn.execute("SELECT flwer, flwee FROM follows ORDER BY flwer, flwee"):
+            offsets[flwer + 1] += 1
+            targets.append(flwee)
+        for usr in range(size):
+            offsets[usr + 1] += offsets[usr]
+        return cls(offsets, targets)
+
+    def followees(self, usr):
+        return self.targets[self.offsets[usr]:self.offsets[usr + 1]]
+
+    def candidates(self, usr, limit):
+        """
+        Return up to limit (candidate, mutual) pairs for usr, best first.
+        """
+        if usr >= len(self.offsets) - 1:
+            return []
+        offsets, targets = self.offsets, self.targets
+        mine = targets[offsets[usr]:offsets[usr + 1]]
+        counts = {}
+        for followee in mine:
+            for candidate in targets[offsets[followee]:offsets[followee + 1]]:
+                counts[candidate] = counts.get(candidate, 0) + 1
+        counts.pop(usr, None)
+        for followee in mine:
+            counts.pop(followee, None)
+        followers = self.followers
+        return heapq.nsmallest(limit, counts.items(),
+                               key=lambda item: (-item[1], -followers[item[0]], item[0]))
+
+
+def recommendations(conn, usr, limit=RECOMMEND_LIMIT):
+    """
+    Return up to limit (candidate, mutual) pairs for usr, best first.
+    """
+    if conn.execute(_IS_STALE_QUERY, (usr,)).fetchone():
+        rows = conn.execute(_CANDIDATES_QUERY, {"usr": usr, "limit": limit})
+    else:
+        rows = conn.execute(_STORED_QUERY, (usr, limit))
+    return [(row[0], row[1]) for row in rows]
+
+
+def _store(conn, results, seq):
+    """
+    Replace the stored recommendations of the users in results, a list of
+    (usr, [(candidate, mutual), ...]), and clear their stale marks up to seq.
+    """
+    conn.executemany("DELETE FROM follow_recommendations WHERE usr = ?", [(usr,) for usr, _ in results])
+    conn.executemany(
+        "INSERT INTO follow_recommendations (usr, rank, candidate, mutual) VALUES (?, ?, ?, ?)",
+        [(usr, rank, candidate, mutual)
+         for usr, candidates in results
+         for rank, (candidate, mutual) in enumerate(candidates)],
+    )
+    conn.executemany("DELETE FROM recommendation_stale WHERE usr = ? AND seq <= ?",
+                     [(usr, seq) for usr, _ in results])
+
+
+def _score_user(conn, usr):
+    seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM recommendation_stale").fetchone()[0]
+    candidates = [(row[0], row[1]) for row in conn.execute(
+        _CANDIDATES_QUERY, {"usr": usr, "limit": RECOMMEND_LIMIT})]
+    return candidates, seq
+
+
+def refresh_user(conn, usr):
+    """
+    Recompute one user's stored recommendations from follows.
+    """
+    candidates, seq = _score_user(conn, usr)
+    _store(conn, [(usr, candidates)], seq)
+
+
+def refresh_user_after_commit(conn, usr):
+    """
+    Refresh one user's stored recommendations once the current transaction
+    ends, so the write that made them stale does not hold the write lock
+    through the candidates query. The query reads a snapshot; only storing
+    the result takes the lock. If that fails the user stays stale.
+    """
+    def refresh():
+        if conn.in_transaction:
+            # conn is not pooled, so its caller owns the transaction
+            refresh_user(conn, usr)
+            return
+        try:
+            conn.execute("BEGIN")
+            candidates, seq = _score_user(conn, usr)
+            conn.commit()
+            conn.execute("BEGIN IMMEDIATE")
+            _store(conn, [(usr, candidates)], seq)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+
+    after_commit(conn, refresh)
+
+
+def refresh_stale(db_filename, log=print):
+    """
+    Refresh every user marked stale, and up to RECOMMEND_STALE_FOLLOWERS
+    followers of each user whose follows changed, one transaction per
+    RECOMMEND_CHUNK users. Returns the number of users refreshed.
+    """
+    pool = get_pool(db_filename)
+    with pool.connection() as conn:
+        changed_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM recommendation_changed").fetchone()[0]
+        users = {row[0] for row in conn.execute("SELECT usr FROM recommendation_stale")}
+        for (changed,) in conn.execute("SELECT usr FROM recommendation_changed").fetchall():
+            users.update(row[0] for row in conn.execute(
+                "SELECT flwer FROM follows WHERE flwee = ? LIMIT ?",
+                (changed, settings.RECOMMEND_STALE_FOLLOWERS)))
+    users = sorted(users)
+    chunk = max(1, settings.RECOMMEND_CHUNK)
+    for start in range(0, len(users), chunk):
+        with pool.connection(immediate=True) as conn:
+            for usr in users[start:start + chunk]:
+                refresh_user(conn, usr)
+    with pool.connection(immediate=True) as conn:
+        conn.execute("DELETE FROM recommendation_changed WHERE seq <= ?", (changed_seq,))
+    log(f"Refreshed {len(users):,} stale user(s).")
+    return len(users)
+
+
+# ========================
+# Batch Precompute
+# ========================
+
+_graph = None
+
+
+def _init_worker(graph):
+    global _graph
+    _graph = graph
+
+
+def _score_chunk(user_ids, limit):
+    return [(usr, _graph.candidates(usr, limit)) for usr in user_ids]
+
+
+def precompute(db_filename, workers=None, log=print):
+    """
+    Recompute every user's recommendations from one snapshot of follows.
+    Returns the number of users scored.
+    """
+    workers = settings.RECOMMEND_WORKERS if workers is None else workers
+    limit = RECOMMEND_LIMIT
+    chunk = max(1, settings.RECOMMEND_CHUNK)
+    pool = get_pool(db_filename)
+
+    start = time.perf_counter()
+    with pool.connection(immediate=True) as conn:
+        # Taking the write lock makes the graph and seq one snapshot
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM recommendation_stale").fetchone()[0]
+        changed_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM recommendation_changed").fetchone()[0]
+        graph = FollowGraph.load(conn)
+        user_ids = [row[0] for row in conn.execute("SELECT usr FROM users ORDER BY usr")]
+    log(f"Loaded {len(graph.targets):,} follows in {time.perf_counter() - start:.2f}s")
+
+    chunks = [user_ids[i:i + chunk] for i in range(0, len(user_ids), chunk)]
+    start = time.perf_counter()
+    if workers <= 1:
+        _init_worker(graph)
+        results = (_score_chunk(ids, limit) for ids in chunks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(graph,))
+        results = executor.map(_score_chunk, chunks, [limit] * len(chunks))
+    try:
+        for scored in results:
+            with pool.connection(immediate=True) as conn:
+                _store(conn, scored, seq)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    with pool.connection(immediate=True) as conn:
+        conn.execute("DELETE FROM recommendation_changed WHERE seq <= ?", (changed_seq,))
+    elapsed = time.perf_counter() - start
+    log(f"Scored {len(user_ids):,} users with {max(1, workers)} worker(s) in {elapsed:.2f}s "
+        f"({len(user_ids) / elapsed if elapsed else 0:,.0f} users/s)")
+    return len(user_ids)
+
+
+def mark_all_stale(conn):
+    """
+    Mark every user stale, for when follows changed without the triggers (bulk loads).
+    """
+    conn.execute("INSERT OR REPLACE INTO recommendation_stale (usr) SELECT usr FROM users")
+
+
+# ========================
+# Command Line
+# ========================
+# Usage: python recommend.py <database> [--stale] [--workers N]
+# Without --stale every user is recomputed; with it only the stale ones.
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute who-to-follow recommendations.")
+    parser.add_argument("database")
+    parser.add_argument("--stale", action="store_true", help="only refresh the users marked stale")
+    parser.add_argument("--workers", type=int, default=settings.RECOMMEND_WORKERS)
+    args = parser.parse_args()
+
+    # Set_Database creates the tables (and the recommendation objects) and migrates
+    import MiniProject
+    sys.argv = [sys.argv[0], args.database]
+    MiniProject.Set_Database()
+
+    try:
+        if args.stale:
+            refresh_stale(args.database)
+        else:
+            precompute(args.database, args.workers)
+    finally:
+        close_all_pools()
+
+
+if __name__ == "__main__":
+    main()
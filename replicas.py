@@ -0,0 +1,231 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import settings
+from connection_pool import ConnectionPool, after_commit, get_pool
+
+
+# ========================
+# Read Replicas
+# ========================
+# With TWITTER_REPLICAS=N, reads that opt in (read_connection) are served
+# from N snapshot copies of the database while every write goes to the
+# primary file. In WAL mode readers never block the writer, but long reads
+# (search scans, profile pages) still pin old snapshots, which keeps
+# checkpoints from resetting the primary's WAL, and they share its page
+# cache and file with posting. On a replica they do neither.
+#
+# Each replica is refreshed by the online backup API (Connection.backup)
+# in one step, which reads one consistent snapshot of the primary and
+# writes it as one transaction on the replica. Replicas are in WAL mode, so
+# their readers keep their own snapshot during a refresh instead of
+# waiting. A background thread refreshes them in turn, one every
+# REPLICA_REFRESH_MS / N. A refresh copies the whole file, so it must be
+# well under the interval: size REPLICA_REFRESH_MS to the database.
+#
+# Every replica remembers when its snapshot was taken. A read goes to the
+# next replica (round robin) that is:
+# - at most REPLICA_MAX_LAG_MS old (the staleness bound), and
+# - newer than the reading user's last write (read-your-writes).
+# If none qualifies, it reads the primary. write_connection records the
+# write time once the transaction ends. Writes are tracked per process, so
+# read-your-writes holds for writes made through this process. The
+# replicas are private to the process, in a temporary directory
+# (TWITTER_REPLICA_DIR chooses where) removed by close_replicas().
+#
+# Replica snapshots may predate a cache invalidation, so reads on a replica
+# use the read-model caches but never fill them (see is_replica). Reads
+# that write (the hourly trending advance) must stay on the primary.
+
+
+class _Replica:
+    def __init__(self, path):
+        self.path = path
+        # Written only by the refresher, one backup at a time
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.pool = ConnectionPool(path, read_only=True)
+        self.snapshot_time = float("-inf")
+
+
+class ReplicaSet:
+    """
+    Snapshot copies of a database file, refreshed in the background, that serve reads.
+    """
+
+    def __init__(self, db_filename, count=None, refresh_ms=None, max_lag_ms=None, directory=None):
+        self.db_filename = db_filename
+        count = settings.REPLICAS if count is None else count
+        if count < 1:
+            raise ValueError("A ReplicaSet needs at least one replica.")
+        self.refresh_seconds = (settings.REPLICA_REFRESH_MS if refresh_ms is None else refresh_ms) / 1000
+        self.max_lag_seconds = (settings.REPLICA_MAX_LAG_MS if max_lag_ms is None else max_lag_ms) / 1000
+        self._dir = tempfile.mkdtemp(prefix="replicas-", dir=directory or settings.REPLICA_DIR or None)
+        self._source = sqlite3.connect(db_filename, timeout=settings.DB_BUSY_TIMEOUT_MS / 1000,
+                                       check_same_thread=False)
+        self._replicas = [_Replica(os.path.join(self._dir, f"replica{i}.db")) for i in range(count)]
+        self._lock = threading.Lock()
+        # User id (None for the process's own session) -> monotonic time of their last write
+        self._writes = {}
+        self._next = 0
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.refreshes = 0
+        self.refresh_seconds_total = 0.0
+
+        for replica in self._replicas:
+            self.refresh(replica)
+            # Set after the first copy: a WAL database cannot take a new page size
+            replica.conn.execute("PRAGMA journal_mode = WAL")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="db-replicas", daemon=True)
+        self._thread.start()
+
+    def refresh(self, replica):
+        """
+        Copy the primary into a replica.
+        """
+        # The backup's read snapshot starts after this, so it holds every write committed before it
+        started = time.monotonic()
+        self._source.backup(replica.conn)
+        # Fold the copy into the file when no replica reader still needs the old pages
+        replica.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        replica.snapshot_time = started
+        with self._lock:
+            self.refreshes += 1
+            self.refresh_seconds_total += time.monotonic() - started
+
+    def _run(self):
+        index = 0
+        while not self._stop.wait(self.refresh_seconds / len(self._replicas)):
+            try:
+                self.refresh(self._replicas[index])
+            except sqlite3.Error:
+                # The replica just ages out of the staleness bound until the next try
+                pass
+            index = (index + 1) % len(self._replicas)
+
+    def note_write(self, user_id=None):
+        """
+        Record that user_id just committed a write, so their reads skip older replicas.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._writes[user_id] = now
+            if len(self._writes) > 1000:
+                # Writes older than the staleness bound already predate every usable replica
+                horizon = now - self.max_lag_seconds
+                self._writes = {user: at for user, at in self._writes.items() if at >= horizon}
+
+    def read_pool(self, user_id=None):
+        """
+        Return the pool of a replica fresh enough for user_id, or the primary's.
+        """
+        with self._lock:
+            oldest = max(time.monotonic() - self.max_lag_seconds, self._writes.get(user_id, float("-inf")))
+            count = len(self._replicas)
+            for offset in range(count):
+                replica = self._replicas[(self._next + offset) % count]
+                if replica.snapshot_time >= oldest:
+                    self._next = (self._next + offset + 1) % count
+                    self.replica_reads += 1
+                    return replica.pool
+            self.primary_reads += 1
+        return get_pool(self.db_filename)
+
+    def owns(self, conn):
+        """
+        Return True if conn is the calling thread's connection to one of the replicas.
+        """
+        return any(getattr(replica.pool._local, "conn", None) is conn for replica in self._replicas)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "replicas": len(self._replicas),
+                "replica_reads": self.replica_reads,
+                "primary_reads": self.primary_reads,
+                "refreshes": self.refreshes,
+                "mean_refresh_ms": round(1000 * self.refresh_seconds_total / self.refreshes, 2)
+                if self.refreshes else 0.0,
+                "lag_ms": [round(1000 * (now - replica.snapshot_time), 1) for replica in self._replicas],
+            }
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        for replica in self._replicas:
+            replica.pool.close_all()
+            replica.conn.close()
+        self._source.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+_replica_sets = {}
+_replica_sets_lock = threading.Lock()
+
+
+def get_replicas(db_filename):
+    """
+    Return the ReplicaSet of a database file, creating it on first use, or None with TWITTER_REPLICAS=0.
+    """
+    if settings.REPLICAS <= 0:
+        return None
+    with _replica_sets_lock:
+        replicas = _replica_sets.get(db_filename)
+        if replicas is None:
+            replicas = _replica_sets[db_filename] = ReplicaSet(db_filename)
+        return replicas
+
+
+def read_connection(db_filename, user_id=None):
+    """
+    Like pool.connection() for a read-only block, on a replica when one is fresh enough for user_id.
+    """
+    replicas = get_replicas(db_filename)
+    pool = replicas.read_pool(user_id) if replicas is not None else get_pool(db_filename)
+    return pool.connection()
+
+
+@contextmanager
+def write_connection(db_filename, user_id=None):
+    """
+    Like pool.connection(immediate=True) on the primary; user_id's later reads will see the write.
+    """
+    with get_pool(db_filename).connection(immediate=True) as conn:
+        replicas = get_replicas(db_filename)
+        if replicas is not None:
+            after_commit(conn, lambda: replicas.note_write(user_id))
+        yield conn
+
+
+def note_write(db_filename, user_id=None):
+    """
+    Record a write by user_id that did not go through write_connection (e.g. the write queue).
+    """
+    replicas = get_replicas(db_filename)
+    if replicas is not None:
+        replicas.note_write(user_id)
+
+
+def is_replica(conn):
+    """
+    Return True if conn reads a replica snapshot (and must not fill the caches).
+    """
+    return any(replicas.owns(conn) for replicas in list(_replica_sets.values()))
+
+
+def close_replicas():
+    """
+    Stop the refreshers and delete the replica files; called when the program exits.
+    """
+    with _replica_sets_lock:
+        replica_sets = list(_replica_sets.values())
+        _replica_sets.clear()
+    for replicas in replica_sets:
+        replicas.close()
@@ -0,0 +1,556 @@
+import argparse
+import asyncio
+import base64
+import dataclasses
+import json
+import re
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import passwords
+import service
+import settings
+from cache import cache_stats
+from connection_pool import close_all_pools, get_pool
+from replicas import close_replicas, get_replicas, note_write, read_connection
+from write_queue import WriteQueue
+
+
+# ========================
+# HTTP/JSON Server
+# ========================
+# Usage: python server.py <database> [--host H] [--port P] [--workers N]
+#
+# A small HTTP/1.1 server on asyncio streams that serves the service layer as
+# JSON. The event loop only parses requests and writes responses; every
+# sqlite3 call runs on a bounded ThreadPoolExecutor. Each worker thread keeps
+# its own pooled connection (ConnectionPool is per-thread), and each request
+# is one transaction. Connections are kept alive between requests.
+#
+# With TWITTER_WRITE_QUEUE=1 (the default) POST requests that write go to a
+# WriteQueue instead: one writer thread commits them in batches while the
+# workers keep serving reads from WAL snapshots.
+#
+# With TWITTER_REPLICAS=N, GET requests read replica snapshots (replicas.py)
+# within the staleness bound. A user's reads (?user=, ?viewer= or /users/U)
+# skip replicas older than that user's last write through this server.
+#
+# The server trusts the user ids in requests; put it behind something that
+# authenticates clients before exposing it.
+#
+#   GET  /feed?user=U[&cursor=C][&limit=N]   home feed page
+#   GET  /search/tweets?q=kw1,kw2[&order=date|rank][&cursor=C][&limit=N]
+#   GET  /search/users?q=name[&cursor=C][&limit=N][&profiles=1[&viewer=V]]
+#   GET  /tweets/T                           tweet with reply and retweet counts
+#   GET  /tweets/T/thread[?depth=D][&width=W]  conversation: ancestors, tweet, replies depth-first
+#   GET  /trending[?window=1h|24h|7d][&limit=N]  most mentioned hashtags
+#   GET  /users/U[?viewer=V]                 profile with recent tweets
+#   GET  /users/U/tweets
+#   GET  /users/U/followers[?cursor=C][&limit=N][&profiles=1[&viewer=V]]
+#   GET  /users/U/lists
+#   GET  /users/U/recommendations[?limit=N]  who to follow, by followees in common
+#   GET  /stats/cache                        hit/miss counters of the read-model caches
+#   POST /login      {"user", "password"}
+#   POST /tweets     {"user", "text", "replyto"?}
+#   POST /retweets   {"user", "tid"}
+#   POST /follows    {"user", "followee"}
+#   POST /lists      {"user", "list", "tid"}   add a tweet to a favorite list
+#
+# Paged endpoints return {"items": [...], "next_cursor": C}; pass C back as
+# ?cursor=C for the next page. next_cursor is null on the last page.
+# With profiles=1 the user lists return full profiles (as /users/U does),
+# loaded for the whole page in one statement.
+
+MAX_BODY_BYTES = 64 * 1024
+
+# Upper bound on the limit parameter of paged endpoints
+MAX_PAGE_SIZE = 100
+
+STATUS_TEXT = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def encode_cursor(cursor):
+    """
+    Turn a keyset cursor into an opaque URL-safe string.
+    """
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+# Keyset cursor shapes: the accepted type(s) of each key column, in order.
+# A missing date is '' in every cursor.
+FEED_CURSOR = (str, str, int, int)
+SEARCH_CURSORS = {"date": (str, str, int), "rank": ((int, float), str, str, int)}
+USER_SEARCH_CURSOR = (int, str, int)
+FOLLOWER_CURSOR = (str, int)
+
+
+def decode_cursor(token, shape):
+    """
+    Decode a cursor from encode_cursor and check it against `shape`.
+    Anything that is not such a cursor is a 400, so it never reaches a query.
+    """
+    if not token:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        raise HTTPError(400, "Invalid cursor.") from None
+    if not isinstance(cursor, list) or not _matches(cursor, shape):
+        raise HTTPError(400, "Invalid cursor.")
+    return tuple(cursor)
+
+
+def _matches(cursor, shape):
+    # bool is an int subclass, but true/false is never a key column
+    return len(cursor) == len(shape) and all(
+        isinstance(value, types) and not isinstance(value, bool)
+        for value, types in zip(cursor, shape)
+    )
+
+
+def _int_param(values, name, default=None):
+    value = values.get(name, default)
+    if value is None:
+        raise HTTPError(400, f"Missing parameter: {name}")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"Parameter {name} must be an integer.") from None
+
+
+def _to_json(value):
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    return value
+
+
+# ========================
+# Routes
+# ========================
+# Handlers run on a worker thread: handler(conn, query, body, *path_groups)
+# returns (status, payload). Coroutine handlers run on the event loop as
+# handler(server, query, body, *path_groups) and hand each blocking step to
+# the database workers, the write queue or the password hashing pool.
+
+def _page_args(query, default_limit, cursor_shape):
+    limit = _int_param(query, "limit", default_limit)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPError(400, f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    return decode_cursor(query.get("cursor"), cursor_shape), limit
+
+
+def _page_json(page):
+    return {"items": _to_json(page.items), "next_cursor": encode_cursor(page.next_cursor)}
+
+
+def get_feed(conn, query, body):
+    cursor, limit = _page_args(query, service.FEED_PAGE_SIZE, FEED_CURSOR)
+    return 200, _page_json(service.get_feed(conn, _int_param(query, "user"), cursor, limit))
+
+
+def search_tweets(conn, query, body):
+    keywords = query.get("q", "").split(",")
+    order_by = query.get("order", "date")
+    if order_by not in ("date", "rank"):
+        raise HTTPError(400, "order must be 'date' or 'rank'.")
+    cursor, limit = _page_args(query, service.SEARCH_PAGE_SIZE, SEARCH_CURSORS[order_by])
+    return 200, _page_json(service.search_tweets(conn, keywords, cursor, limit, order_by))
+
+
+def _with_profiles(conn, query, page):
+    # ?profiles=1 replaces each user summary with a full profile, loaded for the whole page at once
+    if query.get("profiles") != "1":
+        return page
+    viewer = _int_param(query, "viewer") if "viewer" in query else None
+    profiles = service.get_user_profiles(conn, [user.usr for user in page.items], viewer_id=viewer)
+    return dataclasses.replace(page, items=profiles)
+
+
+def search_users(conn, query, body):
+    keyword = query.get("q", "").strip()
+    if not keyword:
+        raise HTTPError(400, "Keyword cannot be empty.")
+    cursor, limit = _page_args(query, service.USER_PAGE_SIZE, USER_SEARCH_CURSOR)
+    return 200, _page_json(_with_profiles(conn, query, service.search_users(conn, keyword, cursor, limit)))
+
+
+def get_tweet(conn, query, body, tid):
+    tweet = service.get_tweet(conn, int(tid))
+    stats = service.get_tweet_details(conn, tweet.tid)
+    return 200, {**_to_json(tweet), "replies": stats.replies, "retweets": stats.retweets}
+
+
+def get_thread(conn, query, body, tid):
+    max_depth = _int_param(query, "depth") if "depth" in query else None
+    max_width = _int_param(query, "width") if "width" in query else None
+    return 200, _to_json(list(service.get_conversation(conn, int(tid), max_depth, max_width)))
+
+
+def get_trending(conn, query, body):
+    limit = _int_param(query, "limit", service.TRENDING_LIMIT)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPError(400, f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    return 200, _to_json(service.get_trending(conn, query.get("window", "24h"), limit))
+
+
+def get_user(conn, query, body, usr):
+    viewer = _int_param(query, "viewer") if "viewer" in query else None
+    return 200, _to_json(service.get_user_profile(conn, int(usr), viewer_id=viewer))
+
+
+def get_user_tweets(conn, query, body, usr):
+    return 200, _to_json(service.get_user_tweets(conn, int(usr)))
+
+
+def get_followers(conn, query, body, usr):
+    cursor, limit = _page_args(query, service.USER_PAGE_SIZE, FOLLOWER_CURSOR)
+    return 200, _page_json(_with_profiles(conn, query, service.list_followers(conn, int(usr), cursor, limit)))
+
+
+def get_lists(conn, query, body, usr):
+    return 200, _to_json(service.get_favorite_lists(conn, int(usr)))
+
+
+def get_recommendations(conn, query, body, usr):
+    # Only the top RECOMMEND_LIMIT are precomputed
+    limit = _int_param(query, "limit", service.RECOMMEND_LIMIT)
+    if not 1 <= limit <= service.RECOMMEND_LIMIT:
+        raise HTTPError(400, f"limit must be between 1 and {service.RECOMMEND_LIMIT}.")
+    return 200, _to_json(service.get_recommendations(conn, int(usr), limit))
+
+
+def get_cache_stats(conn, query, body):
+    return 200, cache_stats()
+
+
+async def post_login(server, query, body):
+    # Like service.authenticate, but no database worker waits while the password hashes
+    user = _int_param(body, "user")
+    password = str(body.get("password", ""))
+    stored = await server.read(service.get_password_hash, user)
+    matches, needs_rehash = await asyncio.wrap_future(
+        passwords.submit(passwords.verify_password, password, stored))
+    if matches and needs_rehash:
+        new_hash = await asyncio.wrap_future(passwords.submit(passwords.hash_password, password))
+        await server.write(service.upgrade_password, user, stored, new_hash)
+    return 200, {"ok": matches}
+
+
+def post_tweet(conn, query, body):
+    replyto = _int_param(body, "replyto") if body.get("replyto") is not None else None
+    tweet = service.post_tweet(conn, _int_param(body, "user"), str(body.get("text", "")), replyto)
+    return 201, _to_json(tweet)
+
+
+def post_retweet(conn, query, body):
+    service.retweet(conn, _int_param(body, "user"), _int_param(body, "tid"))
+    return 201, {"ok": True}
+
+
+def post_follow(conn, query, body):
+    service.follow(conn, _int_param(body, "user"), _int_param(body, "followee"))
+    return 201, {"ok": True}
+
+
+def post_list_include(conn, query, body):
+    service.add_to_list(conn, _int_param(body, "user"), str(body.get("list", "")), _int_param(body, "tid"))
+    return 201, {"ok": True}
+
+
+ROUTES = [
+    ("GET", re.compile(r"/feed"), get_feed),
+    ("GET", re.compile(r"/search/tweets"), search_tweets),
+    ("GET", re.compile(r"/search/users"), search_users),
+    ("GET", re.compile(r"/tweets/(\d+)"), get_tweet),
+    ("GET", re.compile(r"/tweets/(\d+)/thread"), get_thread),
+    ("GET", re.compile(r"/trending"), get_trending),
+    ("GET", re.compile(r"/users/(\d+)"), get_user),
+    ("GET", re.compile(r"/users/(\d+)/tweets"), get_user_tweets),
+    ("GET", re.compile(r"/users/(\d+)/followers"), get_followers),
+    ("GET", re.compile(r"/users/(\d+)/lists"), get_lists),
+    ("GET", re.compile(r"/users/(\d+)/recommendations"), get_recommendations),
+    ("GET", re.compile(r"/stats/cache"), get_cache_stats),
+    ("POST", re.compile(r"/login"), post_login),
+    ("POST", re.compile(r"/tweets"), post_tweet),
+    ("POST", re.compile(r"/retweets"), post_retweet),
+    ("POST", re.compile(r"/follows"), post_follow),
+    ("POST", re.compile(r"/lists"), post_list_include),
+]
+
+
+def resolve(method, path):
+    """
+    Return (handler, path groups) for a request, or raise HTTPError.
+    """
+    allowed = False
+    for route_method, pattern, handler in ROUTES:
+        match = pattern.fullmatch(path)
+        if match:
+            if route_method == method:
+                return handler, match.groups()
+            allowed = True
+    if allowed:
+        raise HTTPError(405, "Method not allowed.")
+    raise HTTPError(404, "No such endpoint.")
+
+
+# Handlers that write; with TWITTER_WRITE_QUEUE=1 they run on the write queue
+WRITE_HANDLERS = {post_tweet, post_retweet, post_follow, post_list_include}
+
+# GET handlers that stay on the primary with replicas: reading the trending windows may advance them
+PRIMARY_READS = {get_trending}
+
+
+def reader_id(path, query):
+    """
+    Return the user a request reads or writes for (?user=, ?viewer= or /users/U), or None.
+    """
+    value = query.get("user") or query.get("viewer")
+    if value is None:
+        match = re.match(r"/users/(\d+)", path)
+        value = match.group(1) if match else None
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def error_response(e):
+    """
+    Return (status, payload) for an expected error; re-raise anything else.
+    Call it from the except block handling e.
+    """
+    if isinstance(e, HTTPError):
+        return e.status, {"error": str(e)}
+    if isinstance(e, service.NotFound):
+        return 404, {"error": str(e)}
+    if isinstance(e, service.AlreadyExists):
+        return 409, {"error": str(e)}
+    if isinstance(e, service.InvalidInput):
+        return 400, {"error": str(e)}
+    if isinstance(e, sqlite3.OperationalError):
+        # Usually "database is locked" after busy_timeout; the client may retry
+        return 503, {"error": str(e)}
+    if isinstance(e, passwords.VerifierBusy):
+        return 503, {"error": str(e)}
+    raise
+
+
+def run_in_transaction(db_filename, fn, *args):
+    """
+    Call fn(conn, *args) in one transaction on the worker thread's connection.
+    """
+    with get_pool(db_filename).connection() as conn:
+        return fn(conn, *args)
+
+
+def run_handler(db_filename, handler, query, body, groups, replica=False, user_id=None):
+    """
+    Run a handler in one transaction on the worker thread's connection,
+    or with replica on a replica fresh enough for user_id.
+    """
+    try:
+        if replica:
+            with read_connection(db_filename, user_id) as conn:
+                return handler(conn, query, body, *groups)
+        return run_in_transaction(db_filename, handler, query, body, *groups)
+    except Exception as e:
+        return error_response(e)
+
+
+# ========================
+# Connection Handling
+# ========================
+
+class Server:
+    """
+    Accept HTTP connections and dispatch requests to the worker pool.
+    """
+
+    def __init__(self, db_filename, workers=None):
+        self.db_filename = db_filename
+        self.workers = settings.SERVER_WORKERS if workers is None else workers
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="db")
+        self.write_queue = WriteQueue(db_filename) if settings.WRITE_QUEUE else None
+        # Take the first replica copies before serving rather than on the first read
+        self.replicas = get_replicas(db_filename)
+
+    async def _read_request(self, reader):
+        """
+        Read one request; returns (method, target, headers, body) or None at EOF.
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line.") from None
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length.") from None
+        if length < 0 or length > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large.")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    async def dispatch(self, method, target, body):
+        """
+        Return (status, payload) for a parsed request.
+        """
+        url = urlsplit(target)
+        handler, groups = resolve(method, url.path.rstrip("/") or "/")
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        data = {}
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                raise HTTPError(400, "Body must be JSON.") from None
+            if not isinstance(data, dict):
+                raise HTTPError(400, "Body must be a JSON object.")
+
+        if asyncio.iscoroutinefunction(handler):
+            try:
+                return await handler(self, query, data, *groups)
+            except Exception as e:
+                return error_response(e)
+
+        if self.write_queue is not None and handler in WRITE_HANDLERS:
+            # The writer thread commits this request together with other queued writes;
+            # no worker thread waits while it is queued
+            try:
+                result = await asyncio.wrap_future(self.write_queue.submit(handler, query, data, *groups))
+            except Exception as e:
+                return error_response(e)
+        else:
+            loop = asyncio.get_running_loop()
+            replica = method == "GET" and handler not in PRIMARY_READS
+            result = await loop.run_in_executor(
+                self.executor, run_handler, self.db_filename, handler, query, data, groups,
+                replica, reader_id(url.path, query))
+
+        if handler in WRITE_HANDLERS and result[0] < 400:
+            # Committed: the user's next reads must not come from an older replica
+            note_write(self.db_filename, reader_id(url.path, data))
+        return result
+
+    async def read(self, fn, *args):
+        """
+        Run fn(conn, *args) in a transaction on a database worker.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, run_in_transaction, self.db_filename, fn, *args)
+
+    async def write(self, fn, *args):
+        """
+        Run fn(conn, *args) on the write queue, or on a database worker without one.
+        """
+        if self.write_queue is not None:
+            return await asyncio.wrap_future(self.write_queue.submit(fn, *args))
+        return await self.read(fn, *args)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                keep_alive = True
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    status, payload = await self.dispatch(method, target, body)
+                except HTTPError as e:
+                    status, payload, keep_alive = e.status, {"error": str(e)}, False
+                except Exception as e:
+                    status, payload, keep_alive = 500, {"error": f"Internal error: {e}"}, False
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                    "\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving {self.db_filename} on http://{host}:{port} with {self.workers} workers")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.write_queue is not None:
+            self.write_queue.close()
+        self.executor.shutdown(wait=True)
+        close_replicas()
+        passwords.shutdown()
+        close_all_pools()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the tweet store as HTTP/JSON.")
+    parser.add_argument("database")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS)
+    args = parser.parse_args()
+
+    # Set_Database reads the database name from the command line
+    import MiniProject
+    sys.argv = [sys.argv[0], args.database]
+    MiniProject.Set_Database()
+
+    server = Server(args.database, args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
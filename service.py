@@ -0,0 +1,611 @@
+import json
+import re
+import sqlite3
+from dataclasses import dataclass, field, replace
+
+import passwords
+from cache import profile_cache, tweet_stats_cache
+from connection_pool import after_commit
+from conversation import fetch_thread
+from feed import FEED_PAGE_SIZE, backfill_follow, fan_out_retweet, fan_out_tweet, fetch_feed_page
+from id_allocator import allocate_id
+from recommend import RECOMMEND_LIMIT, recommendations, refresh_user_after_commit
+from replicas import is_replica
+from stats import get_tweet_stats
+from trending import TRENDING_LIMIT, TRENDING_WINDOWS, top_trending
+from tweet_search import SEARCH_PAGE_SIZE, fetch_search_page
+
+
+# ========================
+# Service Layer
+# ========================
+# Every data path of the app, without input() or print(). Functions take an
+# open connection (usually `with get_pool(db).connection() as conn:`), so the
+# caller decides the transaction boundary, and they return the data objects
+# below. Failures are raised as ServiceError subclasses for the front end
+# (the CLI in MiniProject.py, or anything else) to report.
+
+class ServiceError(Exception):
+    """
+    Base class for errors a front end should show to the user.
+    """
+
+
+class NotFound(ServiceError):
+    pass
+
+
+class AlreadyExists(ServiceError):
+    pass
+
+
+class InvalidInput(ServiceError):
+    pass
+
+
+@dataclass(frozen=True)
+class Tweet:
+    tid: int
+    writer_id: int
+    tdate: str
+    ttime: str
+    text: str
+
+
+@dataclass(frozen=True)
+class FeedItem:
+    type: str
+    tid: int
+    tdate: str
+    ttime: str
+    spam: int
+
+
+@dataclass(frozen=True)
+class Page:
+    items: list
+    # Pass back to the same function for the next page; None on the last page
+    next_cursor: tuple = None
+
+
+@dataclass(frozen=True)
+class TweetStats:
+    tid: int
+    replies: int
+    retweets: int
+
+
+@dataclass(frozen=True)
+class UserSummary:
+    usr: int
+    name: str
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    usr: int
+    name: str
+    tweets: int
+    following: int
+    followers: int
+    recent_tweets: tuple = ()
+    # Whether the viewer follows this user; False when there is no viewer
+    is_following: bool = False
+
+
+@dataclass(frozen=True)
+class ThreadNode:
+    tweet: Tweet
+    # Levels below the requested tweet; negative for the tweets it replies to
+    depth: int
+    # All replies to this tweet, including any the thread limits left out
+    replies: int
+
+
+@dataclass(frozen=True)
+class TrendingTag:
+    term: str
+    mentions: int
+
+
+@dataclass(frozen=True)
+class Recommendation:
+    usr: int
+    name: str
+    mutual: int
+
+
+@dataclass(frozen=True)
+class FavoriteList:
+    name: str
+    tids: list = field(default_factory=list)
+
+
+HASHTAG_PATTERN = re.compile(r"#\w+")
+
+# Rows per page of user search results and follower lists
+USER_PAGE_SIZE = 5
+
+# Latest tweets shown on a profile
+PROFILE_RECENT_TWEETS = 3
+
+
+def _tweet(row):
+    return Tweet(row["tid"], row["writer_id"], row["tdate"], row["ttime"], row["text"])
+
+
+def _integrity_error(error, duplicate_message, missing_message):
+    # Foreign key failures mean a referenced row is missing; anything else is a duplicate key
+    if "FOREIGN KEY" in str(error):
+        return NotFound(missing_message)
+    return AlreadyExists(duplicate_message)
+
+
+# ========================
+# Accounts
+# ========================
+
+def is_valid_email(email):
+    """
+    Validate an email address based on standard email rules.
+    """
+    email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+    return re.match(email_regex, email) is not None
+
+
+def is_valid_phone(phone):
+    # Check if the phone number contains only numeric characters and meets length requirements
+    return phone.isdigit() and 7 <= len(phone) <= 15
+
+
+_PASSWORD_QUERY = "SELECT pwd FROM users WHERE usr = ?"
+
+
+def get_password_hash(conn, user_id):
+    """
+    Return the stored password hash (or legacy plaintext) of a user, or None if there is no such user.
+    """
+    row = conn.execute(_PASSWORD_QUERY, (user_id,)).fetchone()
+    return row["pwd"] if row is not None else None
+
+
+def upgrade_password(conn, user_id, old_stored, new_hash):
+    """
+    Replace a legacy or outdated password value with new_hash, unless it changed meanwhile.
+    """
+    conn.execute("UPDATE users SET pwd = ? WHERE usr = ? AND pwd = ?", (new_hash, user_id, old_stored))
+
+
+def authenticate(conn, user_id, password):
+    """
+    Return True if the user ID and password match a user.
+    Hashing runs on the bounded passwords pool; a plaintext or outdated hash is replaced.
+    """
+    stored = get_password_hash(conn, user_id)
+    matches, needs_rehash = passwords.run(passwords.verify_password, password, stored)
+    if matches and needs_rehash:
+        upgrade_password(conn, user_id, stored, passwords.run(passwords.hash_password, password))
+    return matches
+
+
+def create_user(conn, name, email, phone, password, user_id=None):
+    """
+    Register a user and return the new user ID.
+    Pass user_id to use an ID allocated elsewhere (the shard map, see sharding.py).
+    """
+    if not name:
+        raise InvalidInput("Name cannot be empty.")
+    if not is_valid_email(email):
+        raise InvalidInput("Invalid email address.")
+    if not is_valid_phone(phone):
+        raise InvalidInput("Invalid phone number.")
+    if not password:
+        raise InvalidInput("Password cannot be empty.")
+
+    # Hash before the first statement, so no lock is held while it runs
+    pwd = passwords.run(passwords.hash_password, password)
+
+    # Atomically assign the next user ID
+    new_id = allocate_id(conn, "users") if user_id is None else user_id
+    conn.execute("INSERT INTO users (usr, name, email, phone, pwd) VALUES (?, ?, ?, ?, ?)",
+                 (new_id, name, email, phone, pwd))
+    return new_id
+
+
+# ========================
+# Reads
+# ========================
+
+def search_tweets(conn, keywords, cursor=None, limit=SEARCH_PAGE_SIZE, order_by="date"):
+    """
+    Return one Page of Tweets matching at least one keyword, newest first
+    (or best match first with order_by="rank").
+    """
+    keywords = [kw.strip() for kw in keywords if kw.strip()]
+    rows, next_cursor = fetch_search_page(conn, keywords, cursor, limit, order_by)
+    return Page([_tweet(row) for row in rows], next_cursor)
+
+
+def search_users(conn, keyword, cursor=None, limit=USER_PAGE_SIZE):
+    """
+    Return one Page of users whose name contains the keyword (case-insensitive),
+    shortest names first.
+    """
+    after = ""
+    params = ['%' + keyword + '%']
+    if cursor is not None:
+        after = "AND (LENGTH(name), name, usr) > (?, ?, ?)"
+        params.extend(cursor)
+    rows = conn.execute(f'''
+        SELECT usr, name
+        FROM users
+        WHERE name LIKE ? COLLATE NOCASE {after}
+        ORDER BY LENGTH(name) ASC, name ASC, usr ASC
+        LIMIT ?
+    ''', [*params, limit + 1]).fetchall()
+    return _user_page(rows, limit, lambda row: (len(row["name"]), row["name"], row["usr"]))
+
+
+def get_feed(conn, user_id, cursor=None, limit=FEED_PAGE_SIZE):
+    """
+    Return one Page of tweets and non-spam retweets from followed users.
+    """
+    rows, next_cursor = fetch_feed_page(conn, user_id, cursor, limit)
+    items = [FeedItem(row["type"], row["tid"], row["tdate"], row["ttime"], row["spam"]) for row in rows]
+    return Page(items, next_cursor)
+
+
+def get_tweet(conn, tid):
+    """
+    Return a Tweet by ID, or raise NotFound.
+    """
+    row = conn.execute("SELECT tid, writer_id, tdate, ttime, text FROM tweets WHERE tid = ?", (tid,)).fetchone()
+    if row is None:
+        raise NotFound("Tweet does not exist.")
+    return _tweet(row)
+
+
+def get_tweet_details(conn, tid):
+    """
+    Return the reply and retweet counts of a tweet (cached; see cache.py).
+    """
+    if is_replica(conn):
+        # A replica snapshot can predate the last invalidation: use the cache, never fill it
+        cached = tweet_stats_cache.get(tid)
+        replies, retweets = cached if cached is not None else get_tweet_stats(conn, tid)
+    else:
+        replies, retweets = tweet_stats_cache.get_or_load(tid, lambda: get_tweet_stats(conn, tid))
+    return TweetStats(tid, replies, retweets)
+
+
+def get_conversation(conn, tid, max_depth=None, max_width=None):
+    """
+    Return an iterator of ThreadNodes for the conversation around a tweet, in
+    display order (see conversation.py). Rows are read as the iterator is
+    consumed, so use it while conn is open.
+    """
+    limits = {}
+    if max_depth is not None:
+        limits["max_depth"] = max_depth
+    if max_width is not None:
+        limits["max_width"] = max_width
+    rows = fetch_thread(conn, tid, **limits)
+    first = rows.fetchone()
+    if first is None:
+        raise NotFound("Tweet does not exist.")
+
+    def nodes():
+        yield ThreadNode(_tweet(first), first["depth"], first["replies"])
+        for row in rows:
+            yield ThreadNode(_tweet(row), row["depth"], row["replies"])
+
+    return nodes()
+
+
+def get_trending(conn, window="24h", limit=TRENDING_LIMIT):
+    """
+    Return the most mentioned hashtags (lowercased) of the last hour, day or
+    week ("1h", "24h" or "7d"), most mentioned first.
+    """
+    if window not in TRENDING_WINDOWS:
+        raise InvalidInput(f"Window must be one of {', '.join(TRENDING_WINDOWS)}.")
+    return [TrendingTag(term, mentions) for term, mentions in top_trending(conn, window, limit)]
+
+
+_USER_TWEETS_QUERY = '''
+    SELECT tid, writer_id, tdate, ttime, text
+    FROM tweets
+    WHERE writer_id = ?
+    ORDER BY tdate DESC, ttime DESC
+    LIMIT ?
+'''
+
+
+def get_user_tweets(conn, user_id, limit=None):
+    """
+    Return a user's tweets, newest first; all of them unless limit is given.
+    """
+    rows = conn.execute(_USER_TWEETS_QUERY, (user_id, -1 if limit is None else limit)).fetchall()
+    return [_tweet(row) for row in rows]
+
+
+# Profiles for a list of users in one statement: counts from user_stats,
+# whether the viewer follows each user (a scalar subquery), and each user's
+# latest tweets. One row per recent tweet, or one row with NULL tweet columns
+# for a user without tweets. The latest tweets come from a per-user LIMIT
+# subquery on idx_tweets_writer, so a prolific user costs `recent` index
+# steps, where ROW_NUMBER() over the user's tweets would read all of them.
+_PROFILES_QUERY = '''
+    SELECT u.usr, u.name,
+           COALESCE(s.tweets, 0) AS tweets,
+           COALESCE(s.following, 0) AS following,
+           COALESCE(s.followers, 0) AS followers,
+           EXISTS (SELECT 1 FROM follows WHERE flwer = :viewer AND flwee = u.usr) AS is_following,
+           t.tid, t.writer_id, t.tdate, t.ttime, t.text
+    FROM json_each(:users) k
+    CROSS JOIN users u ON u.usr = k.value
+    LEFT JOIN user_stats s ON s.usr = u.usr
+    LEFT JOIN tweets t ON t.tid IN (
+        SELECT tid FROM tweets WHERE writer_id = u.usr
+        ORDER BY tdate DESC, ttime DESC, tid DESC
+        LIMIT :recent
+    )
+    ORDER BY k.key, t.tdate DESC, t.ttime DESC, t.tid DESC
+'''
+
+
+def _load_profiles(conn, user_ids, viewer_id, recent):
+    """
+    Return ({usr: UserProfile without is_following}, set of users viewer_id follows).
+    """
+    rows = conn.execute(_PROFILES_QUERY, {
+        "users": json.dumps(list(user_ids)),
+        "viewer": viewer_id,
+        "recent": recent,
+    }).fetchall()
+
+    first_rows = {}
+    tweets = {}
+    for row in rows:
+        usr = row["usr"]
+        if usr not in first_rows:
+            first_rows[usr] = row
+            tweets[usr] = []
+        if row["tid"] is not None:
+            tweets[usr].append(_tweet(row))
+
+    profiles = {
+        usr: UserProfile(usr, row["name"], row["tweets"], row["following"], row["followers"], tuple(tweets[usr]))
+        for usr, row in first_rows.items()
+    }
+    following = {usr for usr, row in first_rows.items() if row["is_following"]}
+    return profiles, following
+
+
+def get_user_profiles(conn, user_ids, viewer_id=None, recent=PROFILE_RECENT_TWEETS):
+    """
+    Return UserProfiles for user_ids, in that order, skipping unknown users.
+    Loads every uncached profile in one statement, so a page of search_users
+    or list_followers results costs one round trip (two with a viewer when
+    some profiles came from the cache).
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    cacheable = recent == PROFILE_RECENT_TWEETS
+    profiles = {}
+    if cacheable:
+        for usr in user_ids:
+            profile = profile_cache.get(usr)
+            if profile is not None:
+                profiles[usr] = profile
+    cached = list(profiles)
+
+    following = set()
+    missing = [usr for usr in user_ids if usr not in profiles]
+    if missing:
+        # A replica snapshot can predate the last invalidation, so only primary reads fill the cache
+        fill = cacheable and not is_replica(conn)
+        # Versions taken before loading, so a write that commits meanwhile keeps its invalidation
+        versions = {usr: profile_cache.version(usr) for usr in missing} if fill else {}
+        loaded, following = _load_profiles(conn, missing, viewer_id, recent)
+        for usr, profile in loaded.items():
+            profiles[usr] = profile
+            if fill:
+                profile_cache.put(usr, profile, versions[usr])
+
+    if viewer_id is not None and cached:
+        rows = conn.execute(
+            "SELECT flwee FROM follows WHERE flwer = ? AND flwee IN (SELECT value FROM json_each(?))",
+            (viewer_id, json.dumps(cached)),
+        ).fetchall()
+        following.update(row["flwee"] for row in rows)
+
+    return [replace(profiles[usr], is_following=True) if usr in following else profiles[usr]
+            for usr in user_ids if usr in profiles]
+
+
+def get_user_profile(conn, user_id, viewer_id=None, recent=PROFILE_RECENT_TWEETS):
+    """
+    Return a UserProfile with counts and the `recent` latest tweets.
+    is_following tells whether viewer_id follows the user.
+    The viewer-independent part is cached (see cache.py) for the default `recent`.
+    """
+    profiles = get_user_profiles(conn, [user_id], viewer_id, recent)
+    if not profiles:
+        raise NotFound("User not found.")
+    return profiles[0]
+
+
+_IS_FOLLOWING_QUERY = "SELECT 1 FROM follows WHERE flwer = ? AND flwee = ?"
+
+
+def is_following_user(conn, flwer, flwee):
+    row = conn.execute(_IS_FOLLOWING_QUERY, (flwer, flwee)).fetchone()
+    return row is not None
+
+
+_FOLLOWERS_QUERY = '''
+    SELECT u.usr, u.name
+    FROM follows f
+    JOIN users u ON f.flwer = u.usr
+    WHERE f.flwee = ? {after}
+    ORDER BY COALESCE(u.name, '') ASC, u.usr ASC
+    LIMIT ?
+'''
+_FOLLOWERS_AFTER = "AND (COALESCE(u.name, ''), u.usr) > (?, ?)"
+
+
+def list_followers(conn, user_id, cursor=None, limit=USER_PAGE_SIZE):
+    """
+    Return one Page of the followers of a user, ordered by name.
+    """
+    params = [user_id]
+    if cursor is not None:
+        params.extend(cursor)
+    query = _FOLLOWERS_QUERY.format(after=_FOLLOWERS_AFTER if cursor is not None else "")
+    rows = conn.execute(query, [*params, limit + 1]).fetchall()
+    return _user_page(rows, limit, lambda row: (row["name"] or "", row["usr"]))
+
+
+def get_recommendations(conn, user_id, limit=RECOMMEND_LIMIT):
+    """
+    Return users to follow: the accounts followed by the users user_id
+    follows, by how many of them follow each (mutual), best first.
+    """
+    if not conn.execute("SELECT 1 FROM users WHERE usr = ?", (user_id,)).fetchone():
+        raise NotFound("User not found.")
+    candidates = recommendations(conn, user_id, limit)
+    names = {row["usr"]: row["name"] for row in conn.execute(
+        "SELECT usr, name FROM users WHERE usr IN (SELECT value FROM json_each(?))",
+        (json.dumps([usr for usr, _mutual in candidates]),),
+    )}
+    return [Recommendation(usr, names.get(usr), mutual) for usr, mutual in candidates]
+
+
+def _user_page(rows, limit, cursor_of):
+    # rows holds up to limit + 1 rows; the extra one only says whether more exist
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = cursor_of(rows[-1]) if has_more else None
+    return Page([UserSummary(row["usr"], row["name"]) for row in rows], next_cursor)
+
+
+_LISTS_QUERY = "SELECT lname FROM lists WHERE owner_id = ?"
+_LIST_TWEETS_QUERY = "SELECT lname, tid FROM include WHERE owner_id = ?"
+
+
+def get_favorite_lists(conn, user_id):
+    """
+    Return the user's favorite lists with the tweet IDs stored in each.
+    """
+    lists = {}
+    for row in conn.execute(_LISTS_QUERY, (user_id,)):
+        lists[row["lname"]] = []
+    for row in conn.execute(_LIST_TWEETS_QUERY, (user_id,)):
+        if row["lname"] in lists:
+            lists[row["lname"]].append(row["tid"])
+    return [FavoriteList(name, tids) for name, tids in lists.items()]
+
+
+# ========================
+# Writes
+# ========================
+# Writes invalidate the cached read models they change twice: at once, and
+# again after the transaction ends, so a reader that loaded the old rows in
+# between cannot leave them cached.
+
+def _invalidate(cache, key, conn):
+    cache.invalidate(key)
+    after_commit(conn, lambda: cache.invalidate(key))
+
+
+def post_tweet(conn, user_id, text, replyto_tid=None, tid=None):
+    """
+    Post a tweet (or a reply to replyto_tid) with its hashtags and return it.
+    Duplicate hashtags (case-insensitive) are rejected. Pass tid to use an ID
+    allocated elsewhere (the shard map, see sharding.py).
+    """
+    text = text.strip()
+    if not text:
+        raise InvalidInput("Tweet cannot be empty.")
+
+    hashtags = HASHTAG_PATTERN.findall(text)
+    lower_hashtags = [h.lower() for h in hashtags]
+    if len(lower_hashtags) != len(set(lower_hashtags)):
+        raise InvalidInput("Duplicate hashtags are not allowed.")
+
+    # Get new Tweet ID (unique even with concurrent writers)
+    new_tid = allocate_id(conn, "tweets") if tid is None else tid
+
+    try:
+        # Handles both normal and reply tweets; replyto_tid is NULL for normal tweets
+        row = conn.execute('''
+            INSERT INTO tweets (tid, writer_id, text, tdate, ttime, replyto_tid)
+            VALUES (?, ?, ?, DATE('now'), TIME('now'), ?)
+            RETURNING tid, writer_id, tdate, ttime, text
+        ''', (new_tid, user_id, text, replyto_tid)).fetchall()[0]
+
+        # Insert hashtags into `hashtag_mentions` table in one batch, in the tweet's transaction
+        conn.executemany("INSERT INTO hashtag_mentions (tid, term) VALUES (?, ?)",
+                         [(new_tid, hashtag) for hashtag in hashtags])
+    except sqlite3.IntegrityError as e:
+        raise _integrity_error(e, "Tweet already exists.", "User or parent tweet does not exist.") from None
+
+    # Push the tweet into followers' timelines (fan-out mode only)
+    fan_out_tweet(conn, new_tid)
+
+    # The writer's tweet count and recent tweets, and the parent's reply count
+    _invalidate(profile_cache, user_id, conn)
+    if replyto_tid is not None:
+        _invalidate(tweet_stats_cache, replyto_tid, conn)
+    return _tweet(row)
+
+
+_WRITER_QUERY = "SELECT writer_id FROM tweets WHERE tid = ?"
+
+
+def retweet(conn, user_id, tid):
+    """
+    Retweet a tweet as user_id.
+    """
+    writer = conn.execute(_WRITER_QUERY, (tid,)).fetchone()
+    if writer is None:
+        raise NotFound("Tweet does not exist.")
+
+    try:
+        conn.execute('''
+            INSERT INTO retweets (tid, retweeter_id, writer_id, spam, rdate)
+            VALUES (?, ?, ?, 0, DATE('now'))
+        ''', (tid, user_id, writer[0]))
+    except sqlite3.IntegrityError as e:
+        raise _integrity_error(e, "You have already retweeted this tweet.", "User does not exist.") from None
+    fan_out_retweet(conn, tid, user_id)
+    _invalidate(tweet_stats_cache, tid, conn)
+
+
+def follow(conn, flwer, flwee):
+    """
+    Make flwer follow flwee and copy flwee's recent posts into flwer's timeline.
+    """
+    if flwer == flwee:
+        raise InvalidInput("You cannot follow yourself.")
+    try:
+        conn.execute('''
+            INSERT INTO follows (flwer, flwee, start_date)
+            VALUES (?, ?, DATE('now'))
+        ''', (flwer, flwee))
+    except sqlite3.IntegrityError as e:
+        raise _integrity_error(e, "You are already following this user.", "User does not exist.") from None
+    backfill_follow(conn, flwer, flwee)
+    refresh_user_after_commit(conn, flwer)
+    _invalidate(profile_cache, flwer, conn)
+    _invalidate(profile_cache, flwee, conn)
+
+
+def add_to_list(conn, user_id, lname, tid):
+    """
+    Add a tweet to one of the user's favorite lists.
+    """
+    try:
+        conn.execute("INSERT INTO include (owner_id, lname, tid) VALUES (?, ?, ?)", (user_id, lname, tid))
+    except sqlite3.IntegrityError as e:
+        raise _integrity_error(e, f"Tweet is already in '{lname}'.", "List or tweet does not exist.") from None
@@ -0,0 +1,113 @@
+import os
+
+
+# ========================
+# Runtime Settings
+# ========================
+# Every tunable is read once from the environment so the CLI keeps its
+# single command line argument (the database filename).
+
+def _env_int(name, default):
+    """
+    Read an integer setting from the environment, falling back to the default.
+    """
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Warning: {name} must be an integer, using {default}.")
+        return default
+
+
+# Milliseconds a connection waits on a locked database before failing.
+DB_BUSY_TIMEOUT_MS = _env_int("TWITTER_DB_BUSY_TIMEOUT_MS", 5000)
+
+# Journal mode applied once per database file when the pool opens it.
+DB_JOURNAL_MODE = os.environ.get("TWITTER_DB_JOURNAL_MODE", "WAL").strip().upper() or "WAL"
+
+# Tweet search backend: "auto" uses the FTS5 index when available, "like" forces LOWER(text) LIKE scans.
+SEARCH_BACKEND = os.environ.get("TWITTER_SEARCH_BACKEND", "auto").strip().lower() or "auto"
+
+# Home feed mode: "pull" computes the feed at read time, "fanout" reads the materialized timeline table.
+FEED_MODE = os.environ.get("TWITTER_FEED_MODE", "pull").strip().lower() or "pull"
+
+# Maximum number of entries kept per user in the fan-out timeline.
+TIMELINE_LENGTH = _env_int("TWITTER_TIMELINE_LENGTH", 800)
+
+# Tweet ids reserved per round trip to id_sequences; larger blocks suit busy servers but leave gaps on exit.
+TWEET_ID_BLOCK_SIZE = _env_int("TWITTER_TWEET_ID_BLOCK_SIZE", 1)
+
+# HTTP server (server.py): listen address and number of database worker threads.
+SERVER_HOST = os.environ.get("TWITTER_SERVER_HOST", "127.0.0.1").strip() or "127.0.0.1"
+SERVER_PORT = _env_int("TWITTER_SERVER_PORT", 8080)
+SERVER_WORKERS = _env_int("TWITTER_SERVER_WORKERS", 8)
+
+# Query profiling (query_profiler.py): 1 times every statement and logs slow ones.
+QUERY_PROFILE = _env_int("TWITTER_QUERY_PROFILE", 0) == 1
+
+# Statements taking at least this many milliseconds go to the slow query log; -1 disables it.
+SLOW_QUERY_MS = _env_int("TWITTER_SLOW_QUERY_MS", 100)
+
+# File the slow query log and the exit summary are appended to; empty means stderr.
+SLOW_QUERY_LOG = os.environ.get("TWITTER_SLOW_QUERY_LOG", "").strip()
+
+# Number of statements in the exit summary, ordered by total time.
+QUERY_PROFILE_TOP = _env_int("TWITTER_QUERY_PROFILE_TOP", 10)
+
+# In-process read-model caches (cache.py): maximum entries (0 disables) and seconds an entry stays fresh.
+CACHE_PROFILE_ENTRIES = _env_int("TWITTER_CACHE_PROFILE_ENTRIES", 10000)
+CACHE_TWEET_STATS_ENTRIES = _env_int("TWITTER_CACHE_TWEET_STATS_ENTRIES", 50000)
+CACHE_TTL_SECONDS = _env_int("TWITTER_CACHE_TTL_SECONDS", 30)
+LOGIN_CACHE_ENTRIES = _env_int("TWITTER_LOGIN_CACHE_ENTRIES", 10000)
+
+# Prepared statements kept per connection; the app issues about a hundred distinct statements.
+STATEMENT_CACHE_SIZE = _env_int("TWITTER_STATEMENT_CACHE_SIZE", 256)
+
+# Server writes go through one writer thread that commits them in batches (write_queue.py); 0 disables.
+WRITE_QUEUE = _env_int("TWITTER_WRITE_QUEUE", 1) == 1
+
+# Most writes committed together, and milliseconds the writer waits for more before committing a batch.
+WRITE_BATCH_SIZE = _env_int("TWITTER_WRITE_BATCH_SIZE", 64)
+WRITE_BATCH_WAIT_MS = _env_int("TWITTER_WRITE_BATCH_WAIT_MS", 0)
+
+# Password hashing (passwords.py): "scrypt" or "pbkdf2_sha256", and the cost of each.
+PASSWORD_SCHEME = os.environ.get("TWITTER_PASSWORD_SCHEME", "scrypt").strip().lower() or "scrypt"
+PASSWORD_SCRYPT_N = _env_int("TWITTER_PASSWORD_SCRYPT_N", 2 ** 14)
+PASSWORD_SCRYPT_R = _env_int("TWITTER_PASSWORD_SCRYPT_R", 8)
+PASSWORD_SCRYPT_P = _env_int("TWITTER_PASSWORD_SCRYPT_P", 1)
+PASSWORD_PBKDF2_ITERATIONS = _env_int("TWITTER_PASSWORD_PBKDF2_ITERATIONS", 600000)
+
+# Threads that hash passwords, and password checks allowed to wait for them before logins are refused.
+PASSWORD_WORKERS = _env_int("TWITTER_PASSWORD_WORKERS", os.cpu_count() or 1)
+PASSWORD_MAX_PENDING = _env_int("TWITTER_PASSWORD_MAX_PENDING", 256)
+
+# Rows bulk_io.py imports per transaction, so the WAL is checkpointed as the load goes.
+BULK_COMMIT_ROWS = _env_int("TWITTER_BULK_COMMIT_ROWS", 500000)
+# Page cache of the bulk_io.py connection in MiB; the index builds at the end sort in it.
+BULK_CACHE_MB = _env_int("TWITTER_BULK_CACHE_MB", 256)
+
+# Processes recommend.py scores users on, and users per chunk (one write transaction each).
+RECOMMEND_WORKERS = _env_int("TWITTER_RECOMMEND_WORKERS", os.cpu_count() or 1)
+RECOMMEND_CHUNK = _env_int("TWITTER_RECOMMEND_CHUNK", 500)
+# Followers of each user whose follows changed that `recommend.py --stale` refreshes.
+RECOMMEND_STALE_FOLLOWERS = _env_int("TWITTER_RECOMMEND_STALE_FOLLOWERS", 1000)
+
+# spam.py: retweets per retweeter per day above which all of that day's are spam, users posting
+# the same text above which its retweets are spam, and flags written per transaction.
+SPAM_BURST_PER_DAY = _env_int("TWITTER_SPAM_BURST_PER_DAY", 50)
+SPAM_DUPLICATE_WRITERS = _env_int("TWITTER_SPAM_DUPLICATE_WRITERS", 5)
+SPAM_BATCH_ROWS = _env_int("TWITTER_SPAM_BATCH_ROWS", 50000)
+
+# Read replicas (replicas.py): snapshot copies serving reads, 0 for none. Each is refreshed
+# about every REPLICA_REFRESH_MS; reads skip replicas older than REPLICA_MAX_LAG_MS.
+REPLICAS = _env_int("TWITTER_REPLICAS", 0)
+REPLICA_REFRESH_MS = _env_int("TWITTER_REPLICA_REFRESH_MS", 500)
+REPLICA_MAX_LAG_MS = _env_int("TWITTER_REPLICA_MAX_LAG_MS", 2000)
+# Directory for the replica files; empty for the system temporary directory.
+REPLICA_DIR = os.environ.get("TWITTER_REPLICA_DIR", "").strip()
+
+# Sharding (sharding.py): threads running the per-shard queries of a scatter-gather read,
+# 0 for one per shard.
+SHARD_WORKERS = _env_int("TWITTER_SHARD_WORKERS", 0)
@@ -0,0 +1,583 @@
+import argparse
+import heapq
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import service
+import settings
+from bulk_io import TABLES, bulk_connection, defer_schema, finish_load, table_columns
+from connection_pool import ConnectionPool, close_all_pools, get_pool
+from feed import FEED_PAGE_SIZE, backfill_follow, fan_out_retweet, fetch_feed_page, row_cursor
+from id_allocator import SEQUENCE_SCHEMA, SEQUENCES, _reserve
+from service import AlreadyExists, FeedItem, InvalidInput, NotFound, Page, Tweet
+from tweet_search import SEARCH_PAGE_SIZE, fetch_search_page, search_cursor
+
+
+# ========================
+# Sharding
+# ========================
+# A sharded database is N ordinary database files (shards), each with the
+# full schema, plus a shard map file that records which shard each user is
+# on. A user's rows all live on their shard:
+# - their users row, the tweets they wrote with their hashtag_mentions, the
+#   retweets they made, and their lists and include rows
+# - the follows rows where they are the followee (flwee)
+# Storing follows with the followee puts every follows row next to the
+# tweets and retweets it brings into a feed. So the unchanged feed query
+# (feed.py), run on one shard, returns the viewer's feed rows from the
+# followees on that shard. Each shard's triggers keep its derived tables
+# (counters, hashtag dictionary, search index, timelines) from its own rows.
+#
+# Reads that span users are scatter-gather. search_tweets and get_feed run
+# one page query per shard in parallel on a thread pool of SHARD_WORKERS
+# threads (SQLite releases the GIL while a statement runs). heapq.merge then
+# k-way merges the shards' ordered rows and keeps the first limit + 1. The
+# cursor is the last row's sort key, as on one file, so every shard resumes
+# after it. With order_by="rank" each shard scores with its own bm25
+# statistics, so the ranking across shards is approximate.
+#
+# A write goes to one shard, that of the user it belongs to. The map is read
+# inside the shard's write transaction (_write_connection). User and tweet
+# ids come from id_sequences in the map file, so they are unique across
+# shards. Tweet ids are reserved TWEET_ID_BLOCK_SIZE at a time, so with
+# larger blocks most posts do not write to the map.
+#
+# References between shards (a follower, a retweeted tweet, a reply's
+# parent) cannot be foreign keys. Shard connections therefore run with
+# foreign keys off, and the writes below check references on the shard that
+# owns them. Counters of rows owned by other users (a tweet's replies and
+# retweets, a user's following count) are partial on each shard; this layer
+# does not read them.
+#
+# Rebalancing moves whole users (move_user):
+# 1. Copy their rows to the target while holding the source's write lock.
+# 2. Point the map at the target.
+# 3. Delete the rows from the source.
+# A writer that waited on the source lock reads the map again and goes to
+# the target. shard_moves records each move until it is done, so an
+# interrupted rebalance finishes it on the next run. Until then the user's
+# rows can be on both shards; the merge drops the repeated rows.
+
+SHARD_MAP_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS shards (
+        shard INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS shard_users (
+        usr INTEGER PRIMARY KEY,
+        shard INTEGER NOT NULL REFERENCES shards (shard)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS shard_moves (
+        usr INTEGER PRIMARY KEY,
+        source INTEGER NOT NULL,
+        target INTEGER NOT NULL
+    )
+    ''',
+    *SEQUENCE_SCHEMA,
+]
+
+# The column naming the owning user of each base table; hashtag_mentions go with their tweet
+OWNER_COLUMNS = {
+    "users": "usr",
+    "follows": "flwee",
+    "lists": "owner_id",
+    "tweets": "writer_id",
+    "include": "owner_id",
+    "retweets": "retweeter_id",
+}
+
+# One user's rows per base table, in load order (parents first); deletes run in reverse
+_USER_ROWS = [
+    (table, f"{OWNER_COLUMNS[table]} = ?") if table in OWNER_COLUMNS
+    else (table, "tid IN (SELECT tid FROM tweets WHERE writer_id = ?)")
+    for table in TABLES
+]
+
+# Rows each user owns on a shard (tweets, retweets and followers), for rebalancing
+_USER_WEIGHTS = '''
+    SELECT u.usr,
+           1 + (SELECT COUNT(*) FROM tweets t WHERE t.writer_id = u.usr)
+             + (SELECT COUNT(*) FROM retweets r WHERE r.retweeter_id = u.usr)
+             + (SELECT COUNT(*) FROM follows f WHERE f.flwee = u.usr)
+    FROM users u
+'''
+
+
+class _Descending:
+    """
+    A sort key that orders in reverse, for merge keys that mix directions.
+    """
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def _merge_pages(pages, key, limit, cursor_of, identity, reverse=True):
+    """
+    K-way merge the shards' ordered pages into one page of up to limit rows.
+    Returns (rows, next_cursor), like fetch_search_page and fetch_feed_page.
+    """
+    rows = []
+    seen = set()
+    for row in heapq.merge(*pages, key=key, reverse=reverse):
+        # A user being moved can have the same rows on two shards for a moment
+        if identity(row) in seen:
+            continue
+        seen.add(identity(row))
+        rows.append(row)
+        if len(rows) > limit:
+            break
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, cursor_of(rows[-1]) if has_more else None
+
+
+def _max_id(conn, table, column):
+    return conn.execute(f"SELECT COALESCE(MAX({column}), 0) FROM {table}").fetchone()[0]
+
+
+class ShardedDatabase:
+    """
+    The shards of a sharded database, opened through its shard map file.
+    """
+
+    def __init__(self, map_filename, workers=None):
+        if not os.path.exists(map_filename):
+            raise ValueError(f"{map_filename} does not exist; create it with `python sharding.py "
+                             f"{map_filename} split <database>`.")
+        self.map_filename = map_filename
+        self._map = ConnectionPool(map_filename)
+        with self._map.connection() as conn:
+            rows = conn.execute("SELECT shard, path FROM shards ORDER BY shard").fetchall()
+        if [row["shard"] for row in rows] != list(range(len(rows))) or not rows:
+            raise ValueError(f"{map_filename} does not list shards 0 to N - 1.")
+        base = os.path.dirname(os.path.abspath(map_filename))
+        self.paths = [os.path.join(base, row["path"]) for row in rows]
+        self.pools = [ConnectionPool(path, foreign_keys=False) for path in self.paths]
+        workers = settings.SHARD_WORKERS if workers is None else workers
+        # Sequence name -> [next id, end] of the block this process reserved
+        self._id_blocks = {}
+        self._ids_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers if workers > 0 else len(self.pools),
+                                            thread_name_prefix="shards")
+
+    def scatter(self, fn, *args):
+        """
+        Run fn(conn, *args) on every shard in parallel; returns the results in shard order.
+        """
+        def run(pool):
+            with pool.connection() as conn:
+                return fn(conn, *args)
+
+        return list(self._executor.map(run, self.pools))
+
+    def shard_of(self, usr):
+        """
+        Return the shard a user is on, or raise NotFound.
+        """
+        with self._map.connection() as conn:
+            row = conn.execute("SELECT shard FROM shard_users WHERE usr = ?", (usr,)).fetchone()
+        if row is None:
+            raise NotFound("User does not exist.")
+        return row[0]
+
+    def _next_id(self, name):
+        # As in id_allocator: tweet ids are reserved TWEET_ID_BLOCK_SIZE at a time, user ids one by one
+        count = max(1, settings.TWEET_ID_BLOCK_SIZE) if name == "tweets" else 1
+        with self._ids_lock:
+            block = self._id_blocks.get(name)
+            if block is None or block[0] >= block[1]:
+                with self._map.connection(immediate=True) as conn:
+                    # split seeds the sequences; a map built by add_shards starts after the shards' ids
+                    first_id = 1
+                    if not conn.execute("SELECT 1 FROM id_sequences WHERE name = ?", (name,)).fetchone():
+                        first_id = max(self.scatter(_max_id, *SEQUENCES[name])) + 1
+                    start = _reserve(conn, name, count, first_id)
+                block = self._id_blocks[name] = [start, start + count]
+            block[0] += 1
+            return block[0] - 1
+
+    @contextmanager
+    def _write_connection(self, usr):
+        """
+        Yield a write transaction on usr's shard.
+        """
+        while True:
+            shard = self.shard_of(usr)
+            with self.pools[shard].connection(immediate=True) as conn:
+                # A move may have pointed the map elsewhere while we waited for the lock
+                if self.shard_of(usr) == shard:
+                    yield conn
+                    return
+
+    # ========================
+    # Writes
+    # ========================
+
+    def create_user(self, name, email, phone, password):
+        """
+        Register a user on the next shard in turn and return the new user ID.
+        """
+        usr = self._next_id("users")
+        shard = usr % len(self.pools)
+        with self.pools[shard].connection(immediate=True) as conn:
+            service.create_user(conn, name, email, phone, password, user_id=usr)
+        # The map entry is written last, so a mapped user always exists
+        try:
+            with self._map.connection(immediate=True) as conn:
+                conn.execute("INSERT INTO shard_users (usr, shard) VALUES (?, ?)", (usr, shard))
+        except BaseException:
+            with self.pools[shard].connection(immediate=True) as conn:
+                conn.execute("DELETE FROM users WHERE usr = ?", (usr,))
+            raise
+        return usr
+
+    def post_tweet(self, user_id, text, replyto_tid=None):
+        """
+        Post a tweet (or a reply to replyto_tid) on the writer's shard and return it.
+        """
+        if replyto_tid is not None:
+            self.get_tweet(replyto_tid)
+        tid = self._next_id("tweets")
+        with self._write_connection(user_id) as conn:
+            return service.post_tweet(conn, user_id, text, replyto_tid, tid=tid)
+
+    def retweet(self, user_id, tid):
+        """
+        Retweet a tweet as user_id, on the retweeter's shard.
+        """
+        tweet = self.get_tweet(tid)
+        with self._write_connection(user_id) as conn:
+            try:
+                conn.execute('''
+                    INSERT INTO retweets (tid, retweeter_id, writer_id, spam, rdate)
+                    VALUES (?, ?, ?, 0, DATE('now'))
+                ''', (tid, user_id, tweet.writer_id))
+            except sqlite3.IntegrityError:
+                raise AlreadyExists("You have already retweeted this tweet.") from None
+            fan_out_retweet(conn, tid, user_id)
+
+    def follow(self, flwer, flwee):
+        """
+        Make flwer follow flwee, on the followee's shard.
+        """
+        if flwer == flwee:
+            raise InvalidInput("You cannot follow yourself.")
+        self.shard_of(flwer)
+        with self._write_connection(flwee) as conn:
+            try:
+                conn.execute('''
+                    INSERT INTO follows (flwer, flwee, start_date)
+                    VALUES (?, ?, DATE('now'))
+                ''', (flwer, flwee))
+            except sqlite3.IntegrityError:
+                raise AlreadyExists("You are already following this user.") from None
+            backfill_follow(conn, flwer, flwee)
+
+    # ========================
+    # Reads
+    # ========================
+
+    def get_tweet(self, tid):
+        """
+        Return a Tweet by ID from whichever shard holds it, or raise NotFound.
+        """
+        for row in self.scatter(lambda conn: conn.execute(
+                "SELECT tid, writer_id, tdate, ttime, text FROM tweets WHERE tid = ?", (tid,)).fetchone()):
+            if row is not None:
+                return Tweet(row["tid"], row["writer_id"], row["tdate"], row["ttime"], row["text"])
+        raise NotFound("Tweet does not exist.")
+
+    def search_tweets(self, keywords, cursor=None, limit=SEARCH_PAGE_SIZE, order_by="date"):
+        """
+        Like service.search_tweets, across every shard.
+        """
+        keywords = [kw.strip() for kw in keywords if kw.strip()]
+        pages = [rows for rows, _next in self.scatter(fetch_search_page, keywords, cursor, limit + 1, order_by)]
+        if order_by == "rank":
+            def key(row):
+                return row["score"], _Descending(search_cursor(row))
+            rows, next_cursor = _merge_pages(pages, key, limit, lambda row: search_cursor(row, "rank"),
+                                             lambda row: row["tid"], reverse=False)
+        else:
+            rows, next_cursor = _merge_pages(pages, search_cursor, limit, search_cursor, lambda row: row["tid"])
+        return Page([Tweet(row["tid"], row["writer_id"], row["tdate"], row["ttime"], row["text"]) for row in rows],
+                    next_cursor)
+
+    def get_feed(self, user_id, cursor=None, limit=FEED_PAGE_SIZE):
+        """
+        Like service.get_feed, across every shard.
+        """
+        pages = [rows for rows, _next in self.scatter(fetch_feed_page, user_id, cursor, limit + 1)]
+        rows, next_cursor = _merge_pages(pages, row_cursor, limit, row_cursor,
+                                         lambda row: (row["tid"], row["sort_rid"]))
+        return Page([FeedItem(row["type"], row["tid"], row["tdate"], row["ttime"], row["spam"]) for row in rows],
+                    next_cursor)
+
+    def status(self):
+        """
+        Return (users, tweets, file bytes) per shard.
+        """
+        counts = self.scatter(lambda conn: conn.execute(
+            "SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM tweets)").fetchone())
+        return [(row[0], row[1], os.path.getsize(path)) for row, path in zip(counts, self.paths)]
+
+    # ========================
+    # Moving Users
+    # ========================
+
+    def move_user(self, usr, target):
+        """
+        Move a user's rows to the target shard. Returns the number of rows moved.
+        """
+        source = self.shard_of(usr)
+        if source == target:
+            return 0
+        with self._map.connection(immediate=True) as conn:
+            conn.execute("INSERT OR REPLACE INTO shard_moves (usr, source, target) VALUES (?, ?, ?)",
+                         (usr, source, target))
+        return self._finish_move(usr, source, target)
+
+    def _finish_move(self, usr, source, target):
+        moved = 0
+        # The source's write lock keeps the user's writers waiting until the map points at the target
+        with self.pools[source].connection(immediate=True) as src:
+            with self.pools[target].connection(immediate=True) as dst:
+                for table, where in _USER_ROWS:
+                    rows = src.execute(f"SELECT * FROM {table} WHERE {where}", (usr,)).fetchall()
+                    if rows:
+                        # IGNORE: a resumed move may have copied them already
+                        dst.executemany(f"INSERT OR IGNORE INTO {table} VALUES ({', '.join('?' * len(rows[0]))})",
+                                        rows)
+                    if table == "follows":
+                        for row in rows:
+                            backfill_follow(dst, row["flwer"], usr)
+                    moved += len(rows)
+            with self._map.connection(immediate=True) as conn:
+                conn.execute("UPDATE shard_users SET shard = ? WHERE usr = ?", (target, usr))
+            for table, where in reversed(_USER_ROWS):
+                src.execute(f"DELETE FROM {table} WHERE {where}", (usr,))
+        with self._map.connection(immediate=True) as conn:
+            conn.execute("DELETE FROM shard_moves WHERE usr = ?", (usr,))
+        return moved
+
+    def resume_moves(self):
+        """
+        Finish the moves an interrupted rebalance left in shard_moves. Returns how many there were.
+        """
+        with self._map.connection() as conn:
+            moves = conn.execute("SELECT usr, source, target FROM shard_moves ORDER BY usr").fetchall()
+        for usr, source, target in moves:
+            self._finish_move(usr, source, target)
+        return len(moves)
+
+    def user_weights(self):
+        """
+        Return {shard: [(usr, rows the user owns), ...]}.
+        """
+        return dict(enumerate(self.scatter(lambda conn: [(row[0], row[1]) for row in conn.execute(_USER_WEIGHTS)])))
+
+    def close(self):
+        self._executor.shutdown()
+        for pool in self.pools:
+            pool.close_all()
+        self._map.close_all()
+
+
+# ========================
+# Splitting and Rebalancing
+# ========================
+
+def plan_moves(weights, shard_count, tolerance=0.05):
+    """
+    Plan user moves that bring every shard within tolerance of the mean weight.
+    weights is {shard: [(usr, weight), ...]}; returns [(usr, source, target), ...].
+    Users leave the heaviest shards, heaviest user first, for the lightest
+    shard, as long as neither shard ends up beyond the tolerance.
+    """
+    loads = [sum(weight for _usr, weight in weights.get(shard, [])) for shard in range(shard_count)]
+    mean = sum(loads) / shard_count
+    slack = mean * tolerance
+    moves = []
+    for source in sorted(range(shard_count), key=lambda shard: -loads[shard]):
+        for usr, weight in sorted(weights.get(source, []), key=lambda item: -item[1]):
+            if loads[source] <= mean + slack:
+                break
+            target = min(range(shard_count), key=loads.__getitem__)
+            if loads[source] - weight >= mean - slack and loads[target] + weight <= mean + slack:
+                moves.append((usr, source, target))
+                loads[source] -= weight
+                loads[target] += weight
+    return moves
+
+
+def _create_shard(path):
+    # Set_Database creates the tables (and every derived object) and migrates
+    import MiniProject
+    MiniProject.Set_Database(path)
+    get_pool(path).close_all()
+
+
+def add_shards(map_filename, count, log=print):
+    """
+    Create the shard map if needed and empty shards up to `count` shards in all.
+    Shard files are named <map name>-shard<N>.db, next to the map.
+    Returns the number of shards added.
+    """
+    pool = get_pool(map_filename)
+    with pool.connection(immediate=True) as conn:
+        for statement in SHARD_MAP_SCHEMA:
+            conn.execute(statement)
+        existing = conn.execute("SELECT COUNT(*) FROM shards").fetchone()[0]
+    if count < existing:
+        raise ValueError(f"{map_filename} already has {existing} shards; removing shards is not supported.")
+
+    stem = os.path.splitext(os.path.basename(map_filename))[0]
+    base = os.path.dirname(os.path.abspath(map_filename))
+    for shard in range(existing, count):
+        name = f"{stem}-shard{shard}.db"
+        _create_shard(os.path.join(base, name))
+        with pool.connection(immediate=True) as conn:
+            conn.execute("INSERT INTO shards (shard, path) VALUES (?, ?)", (shard, name))
+        log(f"Created shard {shard}: {name}")
+    return count - existing
+
+
+def split(db_filename, map_filename, shards, log=print):
+    """
+    Copy a database into `shards` new shards and a shard map, placing each
+    user on shard usr % shards. Run it while the app is stopped.
+    """
+    if shards < 1:
+        raise ValueError("A sharded database needs at least one shard.")
+    if os.path.exists(map_filename):
+        raise ValueError(f"{map_filename} already exists.")
+    add_shards(map_filename, shards, log)
+    db = ShardedDatabase(map_filename)
+    paths = db.paths
+    db.close()
+
+    for shard, path in enumerate(paths):
+        start = time.perf_counter()
+        conn = bulk_connection(path)
+        try:
+            # The same deferred indexes and triggers as a bulk_io.py import
+            defer_schema(conn, TABLES)
+            try:
+                conn.execute("ATTACH DATABASE ? AS source", (db_filename,))
+                copied = 0
+                for table in TABLES:
+                    if table in OWNER_COLUMNS:
+                        where = f"{OWNER_COLUMNS[table]} % :shards = :shard"
+                    else:
+                        where = "tid IN (SELECT tid FROM main.tweets)"
+                    columns = ", ".join(table_columns(conn, table))
+                    conn.execute("BEGIN IMMEDIATE")
+                    copied += conn.execute(f'''
+                        INSERT INTO main.{table} ({columns}) SELECT {columns} FROM source.{table} WHERE {where}
+                    ''', {"shards": shards, "shard": shard}).rowcount
+                    conn.execute("COMMIT")
+                conn.execute("DETACH DATABASE source")
+            finally:
+                # References to other shards show up as foreign key violations; they are expected
+                finish_load(conn, log=lambda message: None)
+        finally:
+            conn.close()
+        log(f"Shard {shard}: {copied:,} rows in {time.perf_counter() - start:.2f}s")
+
+    source = sqlite3.connect(db_filename)
+    try:
+        users = source.execute("SELECT usr, usr % ? FROM users", (shards,)).fetchall()
+        next_ids = source.execute('''
+            SELECT COALESCE((SELECT MAX(usr) FROM users), 0) + 1, COALESCE((SELECT MAX(tid) FROM tweets), 0) + 1
+        ''').fetchone()
+    finally:
+        source.close()
+    with get_pool(map_filename).connection(immediate=True) as conn:
+        conn.executemany("INSERT INTO shard_users (usr, shard) VALUES (?, ?)", users)
+        conn.executemany("INSERT INTO id_sequences (name, next_id) VALUES (?, ?)",
+                         [("users", next_ids[0]), ("tweets", next_ids[1])])
+    log(f"Mapped {len(users):,} users to {shards} shards.")
+
+
+def rebalance(map_filename, shards=None, tolerance=0.05, log=print):
+    """
+    Add shards up to `shards` (if given), then move users until every shard's
+    weight is within tolerance of the mean. Returns the number of users moved.
+    """
+    if shards is not None:
+        add_shards(map_filename, shards, log)
+    db = ShardedDatabase(map_filename)
+    try:
+        resumed = db.resume_moves()
+        if resumed:
+            log(f"Finished {resumed} interrupted move(s).")
+        weights = db.user_weights()
+        moves = plan_moves(weights, len(db.pools), tolerance)
+        start = time.perf_counter()
+        rows = 0
+        for usr, _source, target in moves:
+            rows += db.move_user(usr, target)
+        log(f"Moved {len(moves):,} user(s), {rows:,} rows, in {time.perf_counter() - start:.2f}s.")
+        return len(moves)
+    finally:
+        db.close()
+
+
+# ========================
+# Command Line
+# ========================
+# Usage: python sharding.py <shard map> split <database> --shards N
+#        python sharding.py <shard map> rebalance [--shards N] [--tolerance F]
+#        python sharding.py <shard map> status
+
+def main():
+    parser = argparse.ArgumentParser(description="Split a database into shards and rebalance them.")
+    parser.add_argument("map", help="the shard map file")
+    parser.add_argument("command", choices=["split", "rebalance", "status"])
+    parser.add_argument("database", nargs="?", help="split: the database to copy")
+    parser.add_argument("--shards", type=int, help="split: number of shards; rebalance: grow to this many")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="rebalance: allowed weight above or below the mean, as a fraction")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "split":
+            if args.database is None or args.shards is None:
+                parser.error("split needs a database and --shards")
+            split(args.database, args.map, args.shards)
+        elif args.command == "rebalance":
+            rebalance(args.map, args.shards, args.tolerance)
+        # Every command ends with the shards' sizes
+        db = ShardedDatabase(args.map)
+        try:
+            for shard, (users, tweets, size) in enumerate(db.status()):
+                print(f"shard {shard}: {users:,} users, {tweets:,} tweets, {size / 2 ** 20:,.1f} MiB")
+        finally:
+            db.close()
+    except (ValueError, sqlite3.DatabaseError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        close_all_pools()
+
+
+if __name__ == "__main__":
+    main()
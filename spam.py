@@ -0,0 +1,138 @@
+import argparse
+import hashlib
+import sys
+import time
+
+import settings
+from connection_pool import close_all_pools, get_pool
+
+
+# ========================
+# Spam Classification
+# ========================
+# The feed shows retweets with spam = 0 only. classify_spam scores the
+# unflagged retweets in bulk and sets spam = 1 on those that trip a rule:
+# - burst: the retweeter made more than SPAM_BURST_PER_DAY retweets that
+#   day. One ordered pass over idx_retweets_day counts every
+#   (retweeter, day) without a sort.
+# - duplicate text: the retweeted tweet's text, lowercased with whitespace
+#   collapsed and hashed, was posted by at least SPAM_DUPLICATE_WRITERS
+#   users (copy-paste campaigns). Tweets have no spam column, so this is
+#   how spam tweets reach the feed filter: through their retweets.
+#
+# The rules are scored in one read snapshot, and the flags are written
+# SPAM_BATCH_ROWS per transaction. Both features only grow as rows are
+# added, so flags are only ever raised and a flagged row is never rescored.
+# That also keeps fan-out timelines right: they skip flagged retweets at
+# read time (feed.py) but would never get an unflagged one back.
+#
+# idx_retweets_feed holds only the rows with spam = 0, in the feed's
+# (retweeter, date) order. The feed's retweets branch (r.spam = 0) and the
+# timeline backfill walk it without stepping over spam rows, and it shrinks
+# as rows are flagged. (spam is a column too: SQLite only counts an index as
+# covering if it holds the columns of its own WHERE clause.)
+#
+# It replaces the covering idx_retweets_retweeter, which the planner
+# preferred for the feed. idx_retweets_day serves the lookups that must see
+# every row: the burst counts, retweets by user, and deletes cascading from
+# users. Migration 8 (migrations.py) creates both indexes.
+#
+# Run `python spam.py <database>` periodically (e.g. from cron).
+
+_BURST_QUERY = '''
+    SELECT r.tid, r.retweeter_id
+    FROM (
+        SELECT retweeter_id, rdate FROM retweets
+        GROUP BY retweeter_id, rdate
+        HAVING COUNT(*) > :burst
+    ) g
+    JOIN retweets r ON r.retweeter_id = g.retweeter_id AND r.rdate = g.rdate
+    WHERE r.spam = 0
+'''
+
+# Every tweet is hashed once; the CTE is read twice (the counts, then the matches)
+_DUPLICATE_QUERY = '''
+    WITH hashed AS MATERIALIZED (
+        SELECT tid, writer_id, spam_text_hash(text) AS h FROM tweets
+    )
+    SELECT r.tid, r.retweeter_id
+    FROM hashed t
+    JOIN retweets r ON r.tid = t.tid
+    WHERE r.spam = 0
+      AND t.h IN (SELECT h FROM hashed GROUP BY h HAVING COUNT(DISTINCT writer_id) >= :writers)
+'''
+
+_FLAG = "UPDATE retweets SET spam = 1 WHERE tid = ? AND retweeter_id = ? AND spam = 0"
+
+
+def text_hash(text):
+    """
+    Return a 64-bit hash of a tweet's text, ignoring case and whitespace, or None for no text.
+    """
+    if text is None:
+        return None
+    normalized = " ".join(text.lower().split())
+    digest = hashlib.blake2b(normalized.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def score_retweets(conn):
+    """
+    Return {rule: set of (tid, retweeter_id)} for the unflagged retweets each rule flags.
+    """
+    conn.create_function("spam_text_hash", 1, text_hash, deterministic=True)
+    params = {"burst": settings.SPAM_BURST_PER_DAY, "writers": settings.SPAM_DUPLICATE_WRITERS}
+    return {
+        "burst": {(row[0], row[1]) for row in conn.execute(_BURST_QUERY, params)},
+        "duplicate text": {(row[0], row[1]) for row in conn.execute(_DUPLICATE_QUERY, params)},
+    }
+
+
+def classify_spam(db_filename, log=print):
+    """
+    Score the unflagged retweets and set spam = 1 on the ones a rule flags.
+    Returns the number of retweets flagged.
+    """
+    pool = get_pool(db_filename)
+    start = time.perf_counter()
+    with pool.connection() as conn:
+        # One read transaction: both rules see the same snapshot
+        conn.execute("BEGIN")
+        flagged = score_retweets(conn)
+    for rule, keys in flagged.items():
+        log(f"{rule}: {len(keys):,} retweet(s)")
+    keys = sorted(set().union(*flagged.values()))
+    log(f"Scored in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    batch = max(1, settings.SPAM_BATCH_ROWS)
+    for offset in range(0, len(keys), batch):
+        with pool.connection(immediate=True) as conn:
+            conn.executemany(_FLAG, keys[offset:offset + batch])
+    log(f"Flagged {len(keys):,} retweet(s) in {time.perf_counter() - start:.2f}s")
+    return len(keys)
+
+
+# ========================
+# Command Line
+# ========================
+# Usage: python spam.py <database>
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag spam retweets in bulk.")
+    parser.add_argument("database")
+    args = parser.parse_args()
+
+    # Set_Database creates the tables (and the partial index) and migrates
+    import MiniProject
+    sys.argv = [sys.argv[0], args.database]
+    MiniProject.Set_Database()
+
+    try:
+        classify_spam(args.database)
+    finally:
+        close_all_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import sys
+
+from connection_pool import get_pool
+
+
+# ========================
+# Denormalized Counters
+# ========================
+# tweet_stats and user_stats hold the reply/retweet and tweet/following/
+# follower counts shown on the tweet and profile screens. Triggers keep them
+# in step with every write to tweets, retweets and follows inside the same
+# transaction, so reads are a single primary-key lookup. reconcile_stats()
+# recomputes them in bulk if they ever drift (for example after rows were
+# loaded with triggers disabled).
+# The tables and triggers are created by migration 2 (migrations.py).
+
+_TRUE_TWEET_STATS = '''
+    SELECT tid, SUM(replies) AS replies, SUM(retweets) AS retweets FROM (
+        SELECT replyto_tid AS tid, COUNT(*) AS replies, 0 AS retweets
+        FROM tweets WHERE replyto_tid IS NOT NULL GROUP BY replyto_tid
+        UNION ALL
+        SELECT tid, 0, COUNT(*) FROM retweets WHERE tid IS NOT NULL GROUP BY tid
+    )
+    GROUP BY tid
+'''
+
+_TRUE_USER_STATS = '''
+    SELECT usr, SUM(tweets) AS tweets, SUM(following) AS following, SUM(followers) AS followers FROM (
+        SELECT writer_id AS usr, COUNT(*) AS tweets, 0 AS following, 0 AS followers
+        FROM tweets WHERE writer_id IS NOT NULL GROUP BY writer_id
+        UNION ALL
+        SELECT flwer, 0, COUNT(*), 0 FROM follows WHERE flwer IS NOT NULL GROUP BY flwer
+        UNION ALL
+        SELECT flwee, 0, 0, COUNT(*) FROM follows WHERE flwee IS NOT NULL GROUP BY flwee
+    )
+    GROUP BY usr
+'''
+
+
+def reconcile_stats(conn):
+    """
+    Recompute every counter from the base tables in one pass per table.
+    Returns the number of counter rows that were wrong or missing.
+    """
+    drift = 0
+    for table, key, columns, truth in (
+        ("tweet_stats", "tid", "replies, retweets", _TRUE_TWEET_STATS),
+        ("user_stats", "usr", "tweets, following, followers", _TRUE_USER_STATS),
+    ):
+        # Keys whose stored counts differ from the truth; all-zero rows count as absent
+        nonzero = " OR ".join(f"{c.strip()} != 0" for c in columns.split(","))
+        drift += conn.execute(f'''
+            SELECT COUNT(*) FROM (
+                SELECT {key} FROM (
+                    SELECT {key}, {columns} FROM ({truth})
+                    EXCEPT
+                    SELECT {key}, {columns} FROM {table} WHERE {nonzero}
+                )
+                UNION
+                SELECT {key} FROM (
+                    SELECT {key}, {columns} FROM {table} WHERE {nonzero}
+                    EXCEPT
+                    SELECT {key}, {columns} FROM ({truth})
+                )
+            )
+        ''').fetchone()[0]
+
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} ({key}, {columns}) {truth}")
+    return drift
+
+
+_TWEET_STATS_QUERY = "SELECT replies, retweets FROM tweet_stats WHERE tid = ?"
+_USER_STATS_QUERY = "SELECT tweets, following, followers FROM user_stats WHERE usr = ?"
+
+
+def get_tweet_stats(conn, tid):
+    """
+    Return (replies, retweets) for a tweet.
+    """
+    row = conn.execute(_TWEET_STATS_QUERY, (tid,)).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def get_user_stats(conn, usr):
+    """
+    Return (tweets, following, followers) for a user.
+    """
+    row = conn.execute(_USER_STATS_QUERY, (usr,)).fetchone()
+    return (row[0], row[1], row[2]) if row else (0, 0, 0)
+
+
+# ========================
+# Reconcile Command
+# ========================
+# Usage: python stats.py <database>
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python stats.py <database>")
+        sys.exit(2)
+
+    from migrations import migrate
+
+    with get_pool(sys.argv[1]).connection() as conn:
+        migrate(conn)
+        fixed = reconcile_stats(conn)
+    print(f"Counters reconciled: {fixed} row(s) corrected.")
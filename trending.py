@@ -0,0 +1,130 @@
+# ========================
+# Trending Hashtags
+# ========================
+# Hashtag mentions are counted per lowercased term and per hour of the
+# tweet (UTC, like tdate/ttime) in trending_buckets, by a trigger on
+# hashtag_mentions. Each window (1h, 24h, 7d) keeps a running total per term
+# in trending_totals over the hours (head - hours, head], where head is the
+# window's current hour in trending_windows:
+# - A new mention bumps its bucket and the total of every window that
+#   covers its hour: a few primary-key upserts per hashtag.
+# - advance_windows moves each head to the current hour. It adds the buckets
+#   that entered the window and subtracts the ones that left it, so every
+#   bucket is added and subtracted once per window (constant amortized
+#   work per mention). Buckets older than the longest window are deleted.
+# - The top K of a window is the first K entries of idx_trending_top, read
+#   in order without a sort, whatever the number of terms.
+#
+# top_trending advances the windows when the hour has moved past their
+# head, so a read writes at most once an hour. The advance starts with a
+# write statement: in a transaction that has not read yet it waits for the
+# write lock, instead of failing on a stale read snapshot in WAL mode.
+#
+# Mentions deleted together with their tweet (ON DELETE CASCADE) no longer
+# find the tweet's hour, so their counts stay until rebuild_trending runs,
+# as bulk_io.py does after a load.
+# The tables, index and triggers are created by migration 6 (migrations.py).
+
+# Window name -> hours
+TRENDING_WINDOWS = {"1h": 1, "24h": 24, "7d": 168}
+
+TRENDING_LIMIT = 10
+
+# The UTC hour of a tweet, in hours since the epoch; NULL for unparseable dates
+_TWEET_HOUR = "CAST(strftime('%s', t.tdate || ' ' || COALESCE(t.ttime, '00:00:00')) AS INTEGER) / 3600"
+
+# Windows whose head is behind :now by less than their length catch up
+# incrementally; the others are recomputed from the buckets. The first
+# statement writes, so the advance takes the write lock before it reads.
+_ADVANCE = [
+    '''
+    INSERT INTO trending_totals (hours, term, mentions)
+    SELECT w.hours, b.term, SUM(CASE WHEN b.hour > w.head THEN b.mentions ELSE -b.mentions END)
+    FROM trending_windows w, trending_buckets b
+    WHERE w.head < :now AND :now - w.head < w.hours
+      AND ((b.hour > w.head AND b.hour <= :now)
+           OR (b.hour > w.head - w.hours AND b.hour <= :now - w.hours))
+    GROUP BY w.hours, b.term
+    ON CONFLICT (hours, term) DO UPDATE SET mentions = mentions + excluded.mentions
+    ''',
+    '''
+    DELETE FROM trending_totals
+    WHERE hours IN (SELECT hours FROM trending_windows WHERE :now - head >= hours)
+    ''',
+    '''
+    INSERT INTO trending_totals (hours, term, mentions)
+    SELECT w.hours, b.term, SUM(b.mentions)
+    FROM trending_windows w, trending_buckets b
+    WHERE :now - w.head >= w.hours
+      AND b.hour > :now - w.hours AND b.hour <= :now
+    GROUP BY w.hours, b.term
+    ''',
+    "DELETE FROM trending_totals WHERE mentions <= 0",
+    "UPDATE trending_windows SET head = :now WHERE head < :now",
+    "DELETE FROM trending_buckets WHERE hour <= :now - (SELECT MAX(hours) FROM trending_windows)",
+]
+
+_TOP_QUERY = '''
+    SELECT term, mentions FROM trending_totals
+    WHERE hours = ? AND mentions > 0
+    ORDER BY mentions DESC, term
+    LIMIT ?
+'''
+
+
+def current_hour(conn, now=None):
+    """
+    Return the current UTC hour (hours since the epoch), or the hour of `now` (epoch seconds).
+    """
+    if now is not None:
+        return int(now) // 3600
+    return conn.execute("SELECT CAST(strftime('%s', 'now') AS INTEGER) / 3600").fetchone()[0]
+
+
+def rebuild_trending(conn, now=None):
+    """
+    Recount the buckets of the longest window from hashtag_mentions and
+    recompute every window's totals, with heads at the current hour.
+    """
+    hour = current_hour(conn, now)
+    conn.executemany("INSERT OR IGNORE INTO trending_windows (hours, head) VALUES (?, ?)",
+                     [(hours, hour) for hours in TRENDING_WINDOWS.values()])
+    conn.execute("UPDATE trending_windows SET head = ?", (hour,))
+    oldest = hour - max(TRENDING_WINDOWS.values())
+    conn.execute("DELETE FROM trending_buckets")
+    conn.execute(f'''
+        INSERT INTO trending_buckets (term, hour, mentions)
+        SELECT LOWER(h.term), {_TWEET_HOUR} AS hour, COUNT(*)
+        FROM hashtag_mentions h
+        JOIN tweets t ON t.tid = h.tid
+        WHERE hour > ?
+        GROUP BY LOWER(h.term), hour
+    ''', (oldest,))
+    conn.execute("DELETE FROM trending_totals")
+    conn.execute('''
+        INSERT INTO trending_totals (hours, term, mentions)
+        SELECT w.hours, b.term, SUM(b.mentions)
+        FROM trending_windows w, trending_buckets b
+        WHERE b.hour > w.head - w.hours AND b.hour <= w.head
+        GROUP BY w.hours, b.term
+    ''')
+
+
+def advance_windows(conn, now=None):
+    """
+    Move every window to the current hour (a no-op if they are already there).
+    """
+    hour = current_hour(conn, now)
+    for statement in _ADVANCE:
+        conn.execute(statement, {"now": hour})
+
+
+def top_trending(conn, window="24h", limit=TRENDING_LIMIT, now=None):
+    """
+    Return up to `limit` (term, mentions) pairs for a window, most mentioned first.
+    """
+    hours = TRENDING_WINDOWS[window]
+    head = conn.execute("SELECT MIN(head) FROM trending_windows").fetchone()[0]
+    if head is not None and head < current_hour(conn, now):
+        advance_windows(conn, now)
+    return [(row[0], row[1]) for row in conn.execute(_TOP_QUERY, (hours, limit))]
@@ -0,0 +1,293 @@
+import json
+import sqlite3
+
+import settings
+
+
+# ========================
+# Full-Text Tweet Search
+# ========================
+# tweets_fts is an external-content FTS5 table over tweets.text using the
+# trigram tokenizer, so a plain keyword still matches anywhere inside a word
+# (the same substring semantics as LIKE '%kw%') and matching is case-insensitive.
+# Triggers on tweets keep it in sync with every writer, including compose_tweet.
+
+# The trigram tokenizer cannot match keywords shorter than three characters
+FTS_MIN_KEYWORD_LENGTH = 3
+
+FTS_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5(
+        text,
+        content='tweets',
+        content_rowid='tid',
+        tokenize='trigram'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_ai AFTER INSERT ON tweets BEGIN
+        INSERT INTO tweets_fts (rowid, text) VALUES (new.tid, new.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_ad AFTER DELETE ON tweets BEGIN
+        INSERT INTO tweets_fts (tweets_fts, rowid, text) VALUES ('delete', old.tid, old.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_au AFTER UPDATE OF tid, text ON tweets BEGIN
+        INSERT INTO tweets_fts (tweets_fts, rowid, text) VALUES ('delete', old.tid, old.text);
+        INSERT INTO tweets_fts (rowid, text) VALUES (new.tid, new.text);
+    END
+    ''',
+]
+
+
+def ensure_fts_index(conn):
+    """
+    Create the FTS5 index and its sync triggers if they are missing.
+    Returns False (leaving the database untouched) when FTS5 or the trigram
+    tokenizer is not compiled into this SQLite build.
+    """
+    if fts_available(conn):
+        return True
+    try:
+        conn.execute("SAVEPOINT create_fts")
+        for statement in FTS_SCHEMA:
+            conn.execute(statement)
+        # Index the tweets that were written before the table existed
+        conn.execute("INSERT INTO tweets_fts (tweets_fts) VALUES ('rebuild')")
+        conn.execute("RELEASE create_fts")
+        return True
+    except sqlite3.OperationalError:
+        conn.execute("ROLLBACK TO create_fts")
+        conn.execute("RELEASE create_fts")
+        return False
+
+
+def fts_available(conn):
+    """
+    Check whether the database has the tweets_fts index.
+    """
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tweets_fts'"
+    ).fetchone()
+    return row is not None
+
+
+def _fts_phrase(keyword):
+    # Quote the keyword as an FTS5 string so operators and punctuation are literal
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+# ========================
+# Hashtag Dictionary
+# ========================
+# hashtag_mentions keeps terms as written (#Party, #PARTY, ...). Triggers mirror
+# every mention into a dictionary of lowercased terms (hashtag_terms) and a
+# (term_id, tid) posting table, so an exact "#tag" search is an index seek
+# and a substring search only scans distinct terms. LOWER() is used on both
+# sides so the normalization always matches SQLite's.
+# The tables and triggers are created by migration 4 (migrations.py).
+
+
+def rebuild_hashtag_dictionary(conn):
+    """
+    Refill hashtag_terms and hashtag_tweets from hashtag_mentions.
+    """
+    conn.execute("DELETE FROM hashtag_tweets")
+    conn.execute("INSERT OR IGNORE INTO hashtag_terms (term) SELECT DISTINCT LOWER(term) FROM hashtag_mentions")
+    conn.execute('''
+        INSERT OR IGNORE INTO hashtag_tweets (term_id, tid)
+        SELECT h.term_id, m.tid
+        FROM hashtag_mentions m
+        JOIN hashtag_terms h ON h.term = LOWER(m.term)
+    ''')
+
+
+# ========================
+# Keyword Search
+# ========================
+# Results are read a page at a time by keyset, like the home feed: each page
+# remembers the sort key of its last row and the next query starts after it.
+#
+# The SQL text never depends on the keywords. Each kind of keyword travels
+# as one JSON array parameter that json_each() turns into rows, and an absent
+# cursor is a NULL parameter. A search therefore runs one of four fixed
+# statements (with or without the FTS branch, by date or by rank), and the
+# connection's statement cache keeps them prepared between searches.
+
+SEARCH_PAGE_SIZE = 5
+
+# Each branch yields (tid, score) for one kind of keyword; an empty list yields nothing.
+# CROSS JOIN fixes the join order, since the planner cannot estimate json_each():
+# the keyword list is the outer loop, so each keyword seeks or scans once and an
+# empty list costs nothing.
+
+# "#tag": exact hashtag (case-insensitive), an index seek on the dictionary
+_HASHTAG_EXACT = '''
+            SELECT ht.tid, 0 AS score
+            FROM json_each(:tags) k
+            CROSS JOIN hashtag_terms h
+            CROSS JOIN hashtag_tweets ht ON ht.term_id = h.term_id
+            WHERE h.term = LOWER(k.value)
+'''
+
+# Substring of tweet text (case-insensitive), for keywords the FTS index cannot serve
+_TEXT_SUBSTRING = '''
+            SELECT t.tid, 0 AS score
+            FROM json_each(:text_patterns) k
+            CROSS JOIN tweets t
+            WHERE LOWER(t.text) LIKE k.value
+'''
+
+# Substring of hashtags: scans the distinct terms, not every mention
+_HASHTAG_SUBSTRING = '''
+            SELECT ht.tid, 0 AS score
+            FROM json_each(:term_patterns) k
+            CROSS JOIN hashtag_terms h
+            CROSS JOIN hashtag_tweets ht ON ht.term_id = h.term_id
+            WHERE h.term LIKE k.value
+'''
+
+# One MATCH over all FTS keywords: bm25 scores lower (more negative) for better matches.
+# MATCH rejects NULL, so searches without FTS keywords use the statements without this branch.
+_FTS_BRANCH = '''
+            SELECT rowid AS tid, bm25(tweets_fts) AS score FROM tweets_fts WHERE tweets_fts MATCH :fts
+'''
+
+# The sort key ends in tid so every row has a distinct position for the cursor.
+# A missing date sorts as '', as in the feed, so those rows can be paged to.
+_DATE_ORDER = {
+    "where": '''WHERE :after_tid IS NULL
+               OR (COALESCE(t.tdate, ''), COALESCE(t.ttime, ''), t.tid) < (:after_date, :after_time, :after_tid)''',
+    "having": "",
+    "order": "sort_date DESC, sort_time DESC, t.tid DESC",
+}
+_RANK_ORDER = {
+    "where": "",
+    "having": '''HAVING :after_tid IS NULL OR score > :after_score
+               OR (score = :after_score AND (sort_date, sort_time, t.tid) < (:after_date, :after_time, :after_tid))''',
+    "order": "score ASC, sort_date DESC, sort_time DESC, t.tid DESC",
+}
+
+
+def _search_statement(with_fts, order):
+    branches = ([_FTS_BRANCH] if with_fts else []) + [_HASHTAG_EXACT, _TEXT_SUBSTRING, _HASHTAG_SUBSTRING]
+    # matches drives the outer join as well, so tweets is only searched by tid
+    return f"""
+        WITH matches (tid, score) AS (
+            {' UNION ALL '.join(branches)}
+        )
+        SELECT t.tid, t.writer_id, t.tdate, t.ttime, t.text, MIN(m.score) AS score,
+               COALESCE(t.tdate, '') AS sort_date, COALESCE(t.ttime, '') AS sort_time
+        FROM matches m
+        CROSS JOIN tweets t ON t.tid = m.tid
+        {order["where"]}
+        GROUP BY t.tid
+        {order["having"]}
+        ORDER BY {order["order"]}
+        LIMIT :limit
+    """
+
+
+# (with FTS branch, order_by) -> SQL; every search runs one of these
+SEARCH_STATEMENTS = {
+    (with_fts, order_by): _search_statement(with_fts, order)
+    for with_fts in (False, True)
+    for order_by, order in (("date", _DATE_ORDER), ("rank", _RANK_ORDER))
+}
+
+
+def build_search_query(keywords, use_fts, order_by="date", cursor=None, limit=None):
+    """
+    Return one of SEARCH_STATEMENTS and its named parameters for a keyword search.
+    - "#tag" keywords match hashtags exactly (case-insensitive) with an index seek
+      on the normalized hashtag_terms dictionary.
+    - Other keywords match tweet text or hashtag terms as substrings.
+    With use_fts, text matches go through tweets_fts and can be ranked by bm25;
+    keywords too short for the trigram index fall back to LIKE.
+    order_by is "date" (newest first) or "rank" (best bm25 score first).
+    With a cursor from search_cursor(), only rows after it are returned;
+    limit bounds the number of rows.
+    """
+    tags = []
+    text_patterns = []
+    term_patterns = []
+    fts_terms = []
+
+    for kw in keywords:
+        if kw.startswith("#"):
+            tags.append(kw)
+            continue
+
+        pattern = f"%{kw.lower()}%"
+        if use_fts and len(kw) >= FTS_MIN_KEYWORD_LENGTH:
+            fts_terms.append(_fts_phrase(kw))
+        else:
+            text_patterns.append(pattern)
+        term_patterns.append(pattern)
+
+    if order_by == "rank":
+        after_score, after_date, after_time, after_tid = cursor if cursor is not None else (None,) * 4
+    else:
+        after_score = None
+        after_date, after_time, after_tid = cursor if cursor is not None else (None,) * 3
+
+    params = {
+        "tags": json.dumps(tags),
+        "text_patterns": json.dumps(text_patterns),
+        "term_patterns": json.dumps(term_patterns),
+        "fts": " OR ".join(fts_terms) or None,
+        "after_score": after_score,
+        "after_date": after_date,
+        "after_time": after_time,
+        "after_tid": after_tid,
+        # A negative LIMIT means no limit
+        "limit": -1 if limit is None else limit,
+    }
+    return SEARCH_STATEMENTS[bool(fts_terms), "rank" if order_by == "rank" else "date"], params
+
+
+def search_cursor(row, order_by="date"):
+    """
+    Return the keyset cursor for a search result row.
+    """
+    key = (row["sort_date"], row["sort_time"], row["tid"])
+    if order_by == "rank":
+        return (row["score"], *key)
+    return key
+
+
+def _use_fts(conn):
+    return settings.SEARCH_BACKEND != "like" and fts_available(conn)
+
+
+def find_tweets(conn, keywords, order_by="date"):
+    """
+    Return every tweet matching at least one keyword, using FTS5 when it is
+    enabled and available and the LIKE scan otherwise.
+    Prefer fetch_search_page for anything shown to a user.
+    """
+    if not keywords:
+        return []
+    query, params = build_search_query(keywords, _use_fts(conn), order_by)
+    return conn.execute(query, params).fetchall()
+
+
+def fetch_search_page(conn, keywords, cursor=None, limit=SEARCH_PAGE_SIZE, order_by="date"):
+    """
+    Fetch one page of search results starting after `cursor` (None for the first page).
+    Returns (rows, next_cursor); next_cursor is None when there is nothing more.
+    Only limit + 1 rows ever reach Python, however many tweets match.
+    """
+    if not keywords:
+        return [], None
+    # One extra row tells us whether another page exists
+    query, params = build_search_query(keywords, _use_fts(conn), order_by, cursor, limit + 1)
+    rows = conn.execute(query, params).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = search_cursor(rows[-1], order_by) if has_more else None
+    return rows, next_cursor
@@ -0,0 +1,145 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import settings
+from connection_pool import get_pool, run_callbacks
+
+
+# ========================
+# Write Queue
+# ========================
+# SQLite allows one writer per database at a time. In WAL mode (the pool's
+# default) readers never wait for it, but writers on many threads take turns
+# at the lock and each pays for its own commit.
+#
+# A WriteQueue owns one writer thread. Other threads submit write jobs and
+# get a Future back; the writer takes whatever jobs are waiting (up to
+# WRITE_BATCH_SIZE) and runs them back to back in one transaction, each in
+# its own savepoint, then commits once for the whole batch (group commit).
+# A job that raises only rolls back its own savepoint. Its Future gets the
+# exception, and the rest of the batch still commits. If the commit itself
+# fails, every job in the batch fails with that error.
+#
+# Futures resolve only after the commit, so a caller that sees its result
+# knows the write is durable and visible to every reader. They resolve as
+# soon as it succeeds. The after_commit callbacks of the jobs that committed
+# (cache invalidation, recommendation refreshes) run afterwards, so callers
+# do not wait for them. A failing callback is logged and cannot fail a batch
+# that has committed. A job that rolled back drops the callbacks it registered.
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Serialize writes to a database file through one thread that commits them in batches.
+    """
+
+    def __init__(self, db_filename, batch_size=None, batch_wait_ms=None):
+        self.db_filename = db_filename
+        self.batch_size = settings.WRITE_BATCH_SIZE if batch_size is None else batch_size
+        self.batch_wait_ms = settings.WRITE_BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms
+        self._jobs = queue.SimpleQueue()
+        self._closed = False
+        self.batches = 0
+        self.jobs = 0
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        """
+        Queue fn(conn, *args) to run on the writer thread.
+        Returns a Future for its result, set once its batch has committed.
+        """
+        if self._closed:
+            raise RuntimeError("write queue is closed")
+        future = Future()
+        self._jobs.put((future, fn, args))
+        return future
+
+    def call(self, fn, *args):
+        """
+        Run fn(conn, *args) on the writer thread and wait for its committed result.
+        """
+        return self.submit(fn, *args).result()
+
+    def close(self):
+        """
+        Commit the jobs already queued and stop the writer thread.
+        """
+        if not self._closed:
+            self._closed = True
+            self._jobs.put(_STOP)
+            self._thread.join()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "jobs": self.jobs,
+            "mean_batch": round(self.jobs / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def _take_batch(self):
+        """
+        Block for the first job, then take the jobs already waiting (or arriving
+        within batch_wait_ms). Returns (jobs, stop).
+        """
+        job = self._jobs.get()
+        if job is _STOP:
+            return [], True
+        batch = [job]
+        deadline = time.monotonic() + self.batch_wait_ms / 1000
+        while len(batch) < self.batch_size:
+            try:
+                timeout = deadline - time.monotonic()
+                job = self._jobs.get(timeout=timeout) if timeout > 0 else self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is _STOP:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    def _run(self):
+        pool = get_pool(self.db_filename)
+        stop = False
+        while not stop:
+            batch, stop = self._take_batch()
+            if batch:
+                self._run_batch(pool, batch)
+
+    def _run_batch(self, pool, batch):
+        outcomes = []
+        callbacks = []
+        try:
+            with pool.connection(immediate=True, callbacks=callbacks) as conn:
+                for future, fn, args in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with pool.savepoint(conn, "write_job"):
+                            result = fn(conn, *args)
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, result, None))
+        except Exception as e:
+            # BEGIN IMMEDIATE timed out or the commit failed: nothing in the batch was written
+            errors = {id(future): error for future, _result, error in outcomes if error is not None}
+            for future, _fn, _args in batch:
+                if not future.done():
+                    future.set_exception(errors.get(id(future), e))
+            # The transaction rolled back, but callbacks (cache invalidations) still run
+            run_callbacks(callbacks)
+            return
+
+        self.batches += 1
+        self.jobs += len(outcomes)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        run_callbacks(callbacks)